@@ -1,36 +1,266 @@
-from flask import Flask, render_template, render_template_string, jsonify
+from flask import Flask, Response, render_template, jsonify, request
+from collections import OrderedDict
+import json
 import os
+import threading
+import time
+import history
+import metrics
 import papishares
+from portfolio import Portfolio
+from refresher import Refresher
+from repository import get_repository
+from shared import leader_lock, shared_path, shared_store
+
+REFRESH_INTERVAL = float(os.getenv('REFRESH_INTERVAL', '30'))   # Seconds between background refreshes
+SNAPSHOT_WAIT_TIMEOUT = float(os.getenv('SNAPSHOT_WAIT_TIMEOUT', '60'))  # Max wait for the first snapshot
+STREAM_KEEPALIVE = float(os.getenv('STREAM_KEEPALIVE', '15'))  # Seconds between keep-alive comments on idle streams
+STREAM_MAX_CONNECTIONS = int(os.getenv('STREAM_MAX_CONNECTIONS', '8'))  # Open streams per worker, each holds a thread (keep below WEB_THREADS)
+ENTRIES_PAGES_MAX = 32  # Rendered /entries pages kept, one per risk value
 
 app = Flask(__name__)
 db = os.getenv('DB_PATH', './papishares.db')
 papishares.initialize_database(db)
-all_tickers = papishares.fetch_all_tickers_info()
+instruments = papishares.load_instruments()
+
+# With several worker processes (SHARED_STATE_DIR set, see gunicorn.conf.py) or replicas (LEADER_BACKEND=sqlite)
+# one of them computes the snapshots and runs the stop-loss watcher, the others serve what it publishes
+leader = leader_lock("positions", db)
+portfolio_file = shared_store("portfolio.json", db)
+
+def compute_positions():
+    result = papishares.get_current_positions(db, instruments)
+    if portfolio_file is not None:
+        # For /risk in the other workers
+        portfolio_file.write(json.dumps(papishares.last_portfolio.to_json()).encode())
+    return result
+
+def start_leader_jobs():
+    # Another process may have sent crossover alerts since this one last led
+    papishares.notifications.use_store(get_repository(db))
+    # Stops are checked against live prices every STOP_WATCH_INTERVAL seconds, whether or not anyone has the page open
+    papishares.stop_watcher.auto_sell = papishares.get_flag('auto_sell', db)
+    if leader is not None:
+        # /autosell may be toggled in another process, and a lost lease must stop selling right away
+        papishares.stop_watcher.read_auto_sell = lambda: leader.held and papishares.get_flag('auto_sell', db)
+    # Highs seen between refreshes raise the stored max price, the trailing stop's basis
+    papishares.stop_watcher.record_high = get_repository(db).positions.raise_max_price
+    papishares.stop_watcher.start()
+
+def stop_leader_jobs():
+    papishares.stop_watcher.stop()
+    # The new leader writes the positions table from now on
+    get_repository(db).positions.reset()
+
+def current_portfolio():
+    if positions_refresher.leading or portfolio_file is None:
+        return papishares.last_portfolio
+    return portfolio_file.load(lambda contents: Portfolio.from_json(json.loads(contents)))
+
+positions_refresher = Refresher(
+    "positions",
+    compute_positions,
+    interval=REFRESH_INTERVAL,
+    list_keys={"positions": "ticker"},
+    shared=shared_store("positions.snapshot", db),
+    lock=leader,
+    on_lead=start_leader_jobs,
+    on_follow=stop_leader_jobs,
+)
+positions_refresher.start()
 
 @app.route('/positions')
 def get_positions():
-    positions = papishares.get_current_positions(db, all_tickers)
-    return positions
+    snapshot = positions_refresher.wait(SNAPSHOT_WAIT_TIMEOUT)
+    if snapshot is None:
+        return jsonify(status="warming up"), 503
+    headers = {
+        'Age': str(int(snapshot.age)),
+        'X-Snapshot-Version': str(snapshot.version),
+        # Kept out of the body, so an unchanged refresh keeps the version and ETag
+        'X-Generated-At': str(snapshot.created_at),
+        'ETag': positions_refresher.etag(snapshot),
+        'Cache-Control': 'no-cache',
+    }
+    if request.headers.get('If-None-Match') == headers['ETag']:
+        return Response(status=304, headers=headers)
+
+    # ?since=<version> returns only what changed since that version, if it is still kept
+    since = request.args.get('since', type=int)
+    if since is not None:
+        body = positions_refresher.delta_body(since)
+        if body is not None:
+            return Response(body, mimetype='application/json', headers=headers)
+    return Response(snapshot.body, mimetype='application/json', headers=headers)
+
+stream_slots = threading.BoundedSemaphore(STREAM_MAX_CONNECTIONS)
+
+@app.route('/positions/stream')
+def stream_positions():
+    # Server-Sent Events: a full snapshot on connect (or a delta when resuming), then a delta per refresh
+    version = positions_refresher.version_from_etag(request.headers.get('Last-Event-ID'))
+    # Every stream holds one of the worker's threads for as long as it is open, past the cap
+    # the dashboard is told to poll /positions?since= instead, so the other routes keep threads
+    if not stream_slots.acquire(blocking=False):
+        return jsonify(status="too many streams, poll /positions"), 503
+
+    def events():
+        sent = version
+        while True:
+            snapshot = positions_refresher.wait_for_update(sent or 0, STREAM_KEEPALIVE)
+            if snapshot is None:
+                yield ": keep-alive\n\n"
+                continue
+            body = positions_refresher.delta_body(sent) if sent else None
+            event = "delta" if body is not None else "snapshot"
+            yield f"id: {positions_refresher.etag(snapshot)}\nevent: {event}\ndata: {(body or snapshot.body).decode()}\n\n"
+            sent = snapshot.version
+
+    response = Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # The server closes the response when the client goes away (even before the first event)
+    response.call_on_close(stream_slots.release)
+    return response
+
+@app.route('/risk')
+def get_risk():
+    # What-if stop losses and total risk for ?risk_percentage=0.5&risk_percentage=1.0, no upstream calls
+    portfolio = current_portfolio()
+    if portfolio is None:
+        return jsonify(status="warming up"), 503
+    risk_percentages = request.args.getlist('risk_percentage', type=float) or [papishares.RISK_PERCENTAGE]
+    return jsonify(portfolio.what_if(risk_percentages))
+
+def collect_stats():
+    return {
+        "positions_cache": get_repository(db).positions.stats_summary(),
+        "bars": papishares.bars.store.stats,
+        "indicators": papishares.indicators.engine.stats,
+        "prices": papishares.price_stats,
+        "t212": {**papishares.client.stats, **papishares.upstream.stats},
+        "stop_watcher": papishares.stop_watcher.stats,
+        "notifications": {**papishares.notifications.stats, "backlog": papishares.notifications.backlog},
+        "risk": papishares.risk.engine.stats,
+        "sectors": papishares.risk.sectors.stats,
+        "entries": {**papishares.entries_feed.stats, "pages": len(entries_pages)},
+        "worker": {"pid": os.getpid(), "leading": int(positions_refresher.leading)},
+    }
+
+def cache_hit_ratios():
+    stats = collect_stats()
+    bars, t212 = stats["bars"], stats["t212"]
+    return {
+        ("positions",): stats["positions_cache"]["hit_rate"],
+        ("bars",): metrics.hit_ratio(bars["hits"] + bars["disk_hits"], bars["fetches"] + bars["incremental_fetches"]),
+        ("t212_responses",): metrics.hit_ratio(t212["hits"] + t212["coalesced"], t212["fetches"]),
+        ("bulk_prices",): metrics.hit_ratio(stats["prices"]["bulk"], stats["prices"]["fallback"]),
+    }
+
+def component_stats():
+    return {
+        (component, name): value
+        for component, values in collect_stats().items()
+        for name, value in values.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+
+def snapshot_age():
+    snapshot = positions_refresher.get()
+    return {(): snapshot.age if snapshot is not None else None}
+
+metrics.REGISTRY.gauge("papishares_cache_hit_ratio", "Share of lookups served without an upstream call", ("cache",), cache_hit_ratios)
+metrics.REGISTRY.gauge("papishares_component_stat", "Counters of /stats, per component", ("component", "stat"), component_stats)
+metrics.REGISTRY.gauge("papishares_snapshot_age_seconds", "Age of the positions snapshot being served", (), snapshot_age)
+
+# Under gunicorn every worker publishes its metrics, so whichever answers the scrape reports them all
+metrics_dir = shared_path("metrics")
+worker_metrics = metrics.WorkerMetrics(metrics.REGISTRY, metrics_dir) if metrics_dir else None
+if worker_metrics is not None:
+    worker_metrics.start()
+
+@app.route('/stats')
+def get_stats():
+    # Cache effectiveness counters since startup
+    return jsonify(collect_stats())
+
+@app.route('/history/equity')
+def get_equity_history():
+    # Account value and total risk over the last ?days=, one point per ?step= seconds
+    start = time.time() - request.args.get('days', 30, type=float) * 86400
+    return jsonify(history.store.equity_curve(start, step=request.args.get('step', 0, type=float)))
+
+@app.route('/history/positions/<ticker>')
+def get_position_history(ticker):
+    start = time.time() - request.args.get('days', 30, type=float) * 86400
+    return jsonify(history.store.position_history(ticker, start, step=request.args.get('step', 0, type=float)))
 
 @app.route('/orders')
 def get_orders():
-    orders = papishares.get_pending_orders(all_tickers)
-    return orders
+    # Pending orders come with every positions snapshot
+    snapshot = positions_refresher.get()
+    if snapshot is not None and "orders" in snapshot.data:
+        orders = snapshot.data["orders"]
+    else:
+        orders = papishares.get_pending_orders(instruments)
+    response = jsonify(orders)
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# Rendered /entries pages per risk value for the current feed version, least recently used evicted first
+entries_pages = OrderedDict()
+entries_pages_version = None
+entries_pages_lock = threading.Lock()
+
+def render_entries(risk):
+    global entries_pages_version
+    entries, version = papishares.get_last_entries()
+    if version is None:
+        # Error message, not cached so the next load retries
+        return render_template('entries.html', data=entries, risk=risk), None
+    with entries_pages_lock:
+        if version != entries_pages_version:
+            entries_pages.clear()
+            entries_pages_version = version
+        page = entries_pages.get(risk)
+        if page is not None:
+            entries_pages.move_to_end(risk)
+            return page, version
+    page = render_template('entries.html', data=entries, risk=risk)
+    with entries_pages_lock:
+        if version == entries_pages_version:
+            entries_pages[risk] = page
+            while len(entries_pages) > ENTRIES_PAGES_MAX:
+                entries_pages.popitem(last=False)
+    return page, version
 
 @app.route('/entries')
 def get_entries():
-    entries = papishares.get_last_entries()
-    return render_template('entries.html', data=entries, risk=70)
+    # Position sizes for ?risk= (amount risked per position), served from memory until the feed changes
+    risk = request.args.get('risk', 70, type=int)
+    page, version = render_entries(risk)
+    response = Response(page, mimetype='text/html')
+    if version is None:
+        return response
+    response.set_etag(f"{version}-{risk}")
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route('/autosell', methods=['POST'])
 def autosell():
     new_status = papishares.update_flag('auto_sell', db)
+    papishares.stop_watcher.auto_sell = papishares.get_flag('auto_sell', db)
     return jsonify({'auto_sell': new_status})
 
 @app.route('/')
 def index():
     return render_template('positions.html')
 
+@app.route('/metrics')
+def get_metrics():
+    # Prometheus scrape endpoint: upstream and refresh stage latencies, cache hit ratios, rate-limit waits
+    body = worker_metrics.render() if worker_metrics is not None else metrics.REGISTRY.render()
+    return Response(body, content_type=metrics.CONTENT_TYPE)
+
 @app.route("/healthz")
 def healthz():
     return jsonify(status="ok"), 200
@@ -40,4 +270,5 @@ def readyz():
     return jsonify(status="ready"), 200
 
 if __name__ == '__main__':
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    # The reloader would import the app in a second process, with its own refresh loop and stop-loss watcher
+    app.run(debug=True, use_reloader=False, host="0.0.0.0", port=5000)
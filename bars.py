@@ -0,0 +1,382 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+import logging
+import os
+import sqlite3
+import threading
+import time
+import pandas as pd
+import yfinance as yf
+from yfinance.exceptions import YFRateLimitError
+import metrics
+import ratelimit
+
+logger = logging.getLogger(__name__)
+
+BARS_DB_PATH = os.getenv("BARS_DB_PATH", os.getenv("DB_PATH", "./papishares.db"))
+BARS_LIVE_TTL = float(os.getenv("BARS_LIVE_TTL", "300"))  # Seconds before today's partial daily bar is topped up during trading hours, 0 = once per day
+BARS_LIVE_HOURS = os.getenv("BARS_LIVE_HOURS", "7-21")  # UTC hours of the trading day (London open to New York close) in which it is topped up
+DEFAULT_PERIOD = "3mo"
+
+# Time-to-live for intraday intervals, daily and longer bars expire with the trading calendar instead
+INTRADAY_TTL = {
+    "1m": 60, "2m": 120, "5m": 300, "15m": 900, "30m": 1800,
+    "60m": 3600, "90m": 5400, "1h": 3600,
+}
+PERSISTED_INTERVALS = ("1d",)
+COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+PERIOD_DAYS = {
+    "1d": 1, "5d": 5, "1mo": 31, "3mo": 92, "6mo": 183,
+    "1y": 366, "2y": 731, "5y": 1827, "10y": 3653,
+}
+
+
+def _fetch_period(period: str) -> str:
+    """Download at least the default window, so short requests don't trigger refetches for longer ones"""
+    if PERIOD_DAYS.get(period, 0) < PERIOD_DAYS[DEFAULT_PERIOD]:
+        return DEFAULT_PERIOD
+    return period
+
+
+def next_session_start(fetched_at: datetime) -> datetime:
+    """Midnight of the first weekday after `fetched_at`, when daily bars get a new bar"""
+    day = fetched_at.date() + timedelta(days=1)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return datetime.combine(day, datetime.min.time())
+
+
+def is_fresh(interval: str, fetched_at: float, now: Optional[float] = None) -> bool:
+    now = time.time() if now is None else now
+    if interval in INTRADAY_TTL:
+        return now - fetched_at < INTRADAY_TTL[interval]
+    if BARS_LIVE_TTL and now - fetched_at >= BARS_LIVE_TTL:
+        day = datetime.fromtimestamp(now, timezone.utc)
+        opens, closes = (day.replace(hour=int(hour), minute=0, second=0, microsecond=0) for hour in BARS_LIVE_HOURS.split("-"))
+        # Topped up during the session, and once more after it for the closing values
+        if day.weekday() < 5 and day >= opens and fetched_at < closes.timestamp():
+            return False
+    return datetime.fromtimestamp(now) < next_session_start(datetime.fromtimestamp(fetched_at))
+
+
+class BarStore:
+    """
+    Local OHLCV store keyed by (symbol, interval), shared by every indicator.
+
+    Bars are kept in memory and daily bars are also persisted to SQLite, so
+    a restart doesn't download them again. A symbol is fetched from Yahoo
+    once per trading day, plus every BARS_LIVE_TTL seconds during trading
+    hours for today's bar (once per bar for intraday intervals), and
+    once a window is stored only bars from the last stored one onwards are
+    requested and spliced in.
+    """
+
+    def __init__(self, path: str = BARS_DB_PATH):
+        self.path = path
+        self._frames: Dict[Tuple[str, str], Tuple[pd.DataFrame, float, str]] = {}
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._initialized = False
+        # One connection per thread, as in Repository
+        self._local = threading.local()
+        self.stats = {"hits": 0, "disk_hits": 0, "fetches": 0, "incremental_fetches": 0, "batch_fetches": 0, "errors": 0}
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._local.conn = conn
+        if not self._initialized:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS bars (
+                    symbol TEXT,
+                    interval TEXT,
+                    ts TEXT,
+                    open REAL,
+                    high REAL,
+                    low REAL,
+                    close REAL,
+                    volume REAL,
+                    PRIMARY KEY (symbol, interval, ts)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS bar_fetches (
+                    symbol TEXT,
+                    interval TEXT,
+                    tz TEXT,
+                    fetched_at REAL,
+                    period TEXT,
+                    PRIMARY KEY (symbol, interval)
+                )
+            """)
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _cached(self, key: Tuple[str, str]) -> Optional[Tuple[pd.DataFrame, float, str]]:
+        """Stored bars for `key` (with their fetch time and the period last downloaded in full) from memory, or from disk on first use"""
+        cached = self._frames.get(key)
+        if cached is None and key[1] in PERSISTED_INTERVALS:
+            cached = self._load(*key)
+            if cached is not None:
+                self._frames[key] = cached
+                self.stats["disk_hits"] += 1
+        return cached
+
+    def _store(self, key: Tuple[str, str], cached, new: pd.DataFrame, period: Optional[str]) -> pd.DataFrame:
+        """Splice downloaded bars into the store (or replace it with a full download of `period`) and persist them"""
+        incremental = period is None
+        df = self._splice(cached[0], new) if incremental else new
+        if df.empty:
+            return df
+        fetched_at = time.time()
+        if incremental:
+            period = cached[2]
+        self._frames[key] = (df, fetched_at, period)
+        if key[1] in PERSISTED_INTERVALS:
+            self._save(*key, new, fetched_at, period, replace=not incremental)
+        return df
+
+    def get(self, symbol: str, interval: str = "1d", period: str = DEFAULT_PERIOD) -> Optional[pd.DataFrame]:
+        """
+        Bars for `symbol`, fetching them only when the stored copy has expired.
+
+        Returns:
+        --------
+        pd.DataFrame or None
+            OHLCV frame covering `period` (treat as read-only), None when no data is available
+        """
+        key = (symbol, interval)
+        with self._key_lock(key):
+            cached = self._cached(key)
+
+            if cached is not None and is_fresh(interval, cached[1]) and self._covers(cached, period):
+                self.stats["hits"] += 1
+                return self._window(cached[0], period)
+
+            # Once the window is stored, the last stored bar is the high-water mark to fetch from
+            incremental = cached is not None and self._covers(cached, period)
+
+            try:
+                if incremental:
+                    new = self._download_since(symbol, interval, cached[0].index[-1])
+                else:
+                    new = self._download(symbol, interval, _fetch_period(period))
+            except Exception as e:
+                self.stats["errors"] += 1
+                if cached is None:
+                    raise
+                logger.info(f"Serving stale bars for {symbol} ({interval}) after fetch error: {e}")
+                return self._window(cached[0], period)
+
+            df = self._store(key, cached, new, None if incremental else _fetch_period(period))
+            if df.empty:
+                return None
+            return self._window(df, period)
+
+    def prefetch(self, symbols, interval: str = "1d", period: str = DEFAULT_PERIOD) -> int:
+        """
+        Bring every expired symbol up to date with at most two multi-ticker downloads,
+        one for symbols without a stored window and one for incremental tails.
+        Symbols the batch could not fetch are left to get() to retry on their own.
+
+        Returns:
+        --------
+        int
+            Number of symbols refreshed
+        """
+        full, since = [], {}
+        for symbol in dict.fromkeys(symbols):
+            key = (symbol, interval)
+            with self._key_lock(key):
+                cached = self._cached(key)
+                if cached is None or not self._covers(cached, period):
+                    full.append(symbol)
+                elif not is_fresh(interval, cached[1]):
+                    since[symbol] = cached[0].index[-1]
+
+        refreshed = 0
+        batches = [(full, {"period": _fetch_period(period)}, _fetch_period(period))]
+        if since:
+            start = min(ts.tz_convert(None) if ts.tz is not None else ts for ts in since.values())
+            batches.append((list(since), {"start": start.strftime("%Y-%m-%d")}, None))
+
+        for batch, kwargs, fetched_period in batches:
+            if not batch:
+                continue
+            try:
+                frames = self._download_batch(batch, interval, **kwargs)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.info(f"Batch download of {len(batch)} symbols failed: {e}")
+                continue
+            for symbol, new in frames.items():
+                key = (symbol, interval)
+                with self._key_lock(key):
+                    self._store(key, self._cached(key), new, fetched_period)
+                refreshed += 1
+        return refreshed
+
+    def close_frame(self, symbols, interval: str = "1d", period: str = DEFAULT_PERIOD) -> pd.DataFrame:
+        """Column-per-symbol frame of closes (NaN where a symbol has no bar), prefetching in one batch first"""
+        self.prefetch(symbols, interval, period)
+        closes = {}
+        for symbol in dict.fromkeys(symbols):
+            try:
+                df = self.get(symbol, interval, period)
+            except Exception as e:
+                logger.info(f"❌ Error fetching data for {symbol}: {e}")
+                continue
+            if df is not None and not df.empty:
+                closes[symbol] = df["Close"]
+        if not closes:
+            return pd.DataFrame()
+        return pd.concat(closes, axis=1).sort_index()
+
+    @staticmethod
+    def _covers(cached: Tuple[pd.DataFrame, float, str], period: str) -> bool:
+        """
+        Whether the stored bars cover `period`: a full download of at least that period does,
+        however little history the symbol has, otherwise the bars must span it
+        (allowing for weekends and holidays at the edges)
+        """
+        df, _, fetched_period = cached
+        if period not in PERIOD_DAYS or df.empty:
+            return True
+        if PERIOD_DAYS.get(fetched_period, 0) >= PERIOD_DAYS[period]:
+            return True
+        return (df.index[-1] - df.index[0]).days >= PERIOD_DAYS[period] - 7
+
+    @staticmethod
+    def _window(df: pd.DataFrame, period: str) -> pd.DataFrame:
+        if period not in PERIOD_DAYS or df.empty:
+            return df
+        start = df.index[-1] - timedelta(days=PERIOD_DAYS[period])
+        return df[df.index > start]
+
+    def _download(self, symbol: str, interval: str, period: str) -> pd.DataFrame:
+        logger.info(f"Downloading {period} of {interval} bars for {symbol}...")
+        self.stats["fetches"] += 1
+        ratelimit.YAHOO.acquire()
+        try:
+            with metrics.upstream_call("yahoo", "history"):
+                df = yf.Ticker(symbol).history(period=period, interval=interval)
+        except YFRateLimitError:
+            ratelimit.YAHOO.penalize(5)
+            raise
+        return df[COLUMNS] if not df.empty else df
+
+    def _download_batch(self, symbols, interval: str, **kwargs) -> Dict[str, pd.DataFrame]:
+        """Bars for several symbols with a single yf.download call, returned per symbol"""
+        logger.info(f"Downloading {interval} bars for {len(symbols)} symbols in one batch...")
+        self.stats["batch_fetches"] += 1
+        # yf.download still issues one chart request per symbol under the hood, so each one needs a token
+        for _ in symbols:
+            ratelimit.YAHOO.acquire()
+        daily = interval not in INTRADAY_TTL
+        try:
+            with metrics.upstream_call("yahoo", "download"):
+                data = yf.download(
+                    symbols, interval=interval, group_by="ticker", auto_adjust=True, ignore_tz=daily,
+                    threads=True, progress=False, multi_level_index=True, **kwargs
+                )
+        except YFRateLimitError:
+            ratelimit.YAHOO.penalize(5)
+            raise
+
+        frames = {}
+        if data is None or data.empty:
+            return frames
+        for symbol in symbols:
+            if symbol not in data.columns.get_level_values(0):
+                continue
+            frame = data[symbol][COLUMNS].dropna(how="all")
+            if frame.empty:
+                continue
+            if frame.index.tz is None:
+                # Daily batches come back as naive dates, history() uses midnight in the exchange timezone
+                frame.index = frame.index.tz_localize(self._exchange_tz(symbol, interval))
+            frame.index.name = "Date"
+            frames[symbol] = frame
+        return frames
+
+    def _exchange_tz(self, symbol: str, interval: str) -> str:
+        cached = self._frames.get((symbol, interval))
+        if cached is not None and cached[0].index.tz is not None:
+            return str(cached[0].index.tz)
+        return "Europe/London" if symbol.endswith(".L") else "America/New_York"
+
+    def _download_since(self, symbol: str, interval: str, start: pd.Timestamp) -> pd.DataFrame:
+        """Bars from `start` (included, it may be a partial bar) up to now"""
+        logger.info(f"Downloading {interval} bars for {symbol} since {start}...")
+        self.stats["incremental_fetches"] += 1
+        ratelimit.YAHOO.acquire()
+        try:
+            with metrics.upstream_call("yahoo", "history_since"):
+                df = yf.Ticker(symbol).history(start=start, interval=interval)
+        except YFRateLimitError:
+            ratelimit.YAHOO.penalize(5)
+            raise
+        return df[COLUMNS] if not df.empty else df
+
+    @staticmethod
+    def _splice(df: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+        """Append `new` bars to `df`, replacing any stored bar they overlap (the previous partial bar)"""
+        if new.empty:
+            return df
+        if new.index.tz is not None and df.index.tz is not None:
+            new = new.tz_convert(df.index.tz)
+        return pd.concat([df[df.index < new.index[0]], new])
+
+    def _load(self, symbol: str, interval: str) -> Optional[Tuple[pd.DataFrame, float, str]]:
+        conn = self._connection()
+        meta = conn.execute(
+            "SELECT tz, fetched_at, period FROM bar_fetches WHERE symbol=? AND interval=?", (symbol, interval)
+        ).fetchone()
+        if meta is None:
+            return None
+        rows = conn.execute(
+            "SELECT ts, open, high, low, close, volume FROM bars WHERE symbol=? AND interval=? ORDER BY ts",
+            (symbol, interval)
+        ).fetchall()
+        if not rows:
+            return None
+
+        tz, fetched_at, period = meta
+        df = pd.DataFrame([row[1:] for row in rows], columns=COLUMNS)
+        df.index = pd.to_datetime([row[0] for row in rows], utc=True).tz_convert(tz)
+        df.index.name = "Date"
+        return df, fetched_at, period or ""
+
+    def _save(self, symbol: str, interval: str, df: pd.DataFrame, fetched_at: float, period: str, replace: bool = True):
+        """Persist bars, either replacing the stored series or upserting into it"""
+        rows = [] if df.empty else [
+            (symbol, interval, ts.isoformat(), *(float(v) for v in values))
+            for ts, values in zip(df.index, df[COLUMNS].itertuples(index=False))
+        ]
+        conn = self._connection()
+        with conn:
+            if replace:
+                tz = str(df.index.tz) if df.index.tz is not None else "UTC"
+                conn.execute("DELETE FROM bars WHERE symbol=? AND interval=?", (symbol, interval))
+                conn.execute("""
+                    INSERT INTO bar_fetches (symbol, interval, tz, fetched_at, period) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(symbol, interval) DO UPDATE SET
+                        tz = excluded.tz, fetched_at = excluded.fetched_at, period = excluded.period
+                """, (symbol, interval, tz, fetched_at, period))
+            else:
+                conn.execute("UPDATE bar_fetches SET fetched_at=? WHERE symbol=? AND interval=?",
+                             (fetched_at, symbol, interval))
+            conn.executemany("INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+store = BarStore()
@@ -0,0 +1,69 @@
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+import threading
+import time
+
+
+class Coalescer:
+    """
+    Short-lived cache of upstream responses shared by every caller.
+
+    A result is reused for `ttl` seconds, and callers asking for a key while
+    it is being fetched wait for that request instead of sending their own.
+    Errors are not cached.
+
+    Parameters:
+    -----------
+    ttl : float
+        Seconds a fetched result is served from memory
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._results: Dict[str, Tuple[float, Any]] = {}
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "coalesced": 0, "fetches": 0}
+
+    def get(self, key: str, fetch: Callable[[], Any], max_age: Optional[float] = None) -> Any:
+        """Cached result of `key` if younger than max_age (default ttl), else fetch it or join the fetch in flight"""
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and time.time() - cached[0] <= max_age:
+                self.stats["hits"] += 1
+                return cached[1]
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+                self.stats["fetches"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._results[key] = (time.time(), value)
+            del self._in_flight[key]
+        future.set_result(value)
+        return value
+
+    def fetched_at(self, key: str) -> Optional[float]:
+        """When the cached result of `key` was fetched"""
+        cached = self._results.get(key)
+        return cached[0] if cached is not None else None
+
+    def invalidate(self, *keys: str):
+        """Drop cached results (e.g. after placing an order), in-flight requests are still shared"""
+        with self._lock:
+            for key in keys or list(self._results):
+                self._results.pop(key, None)
@@ -0,0 +1,110 @@
+from typing import Any, Callable, Optional, Tuple
+import hashlib
+import json
+import logging
+import time
+from filecache import FileBackedCache
+
+logger = logging.getLogger(__name__)
+
+
+class FeedCache(FileBackedCache):
+    """
+    Last good copy of a JSON feed, revalidated with conditional GETs.
+
+    Readers always get the copy in memory (loaded from the cache file at
+    startup); once it is older than max_age it is revalidated in a
+    background thread with If-None-Match/If-Modified-Since, so an unchanged
+    feed costs a 304 and a failing one keeps serving the last good copy.
+    Only the very first load, with no cache file, waits for the network.
+
+    Parameters:
+    -----------
+    fetch : callable
+        fetch(etag, last_modified) -> (data or None if unchanged, etag, last_modified)
+    path : str
+        Cache file path
+    max_age : float
+        Seconds before the copy is revalidated
+    retry_interval : float
+        Seconds between attempts while the feed is failing
+    """
+
+    thread_name = "feed-refresh"
+
+    def __init__(self, fetch: Callable, path: str, max_age: float = 300, retry_interval: float = 60):
+        super().__init__(path)
+        self.fetch = fetch
+        self.max_age = max_age
+        self.retry_interval = retry_interval
+        # (data, version) replaced as a whole, so readers never pair new data with an old version
+        self._current: Tuple[Any, Optional[str]] = (None, None)
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        self._checked_at = 0.0
+        self._loaded = False
+        self.error: Optional[str] = None
+        self.stats = {"hits": 0, "fetches": 0, "not_modified": 0, "errors": 0}
+
+    def get(self) -> Tuple[Any, Optional[str]]:
+        """
+        Returns:
+        --------
+        tuple
+            (data, version), version changing only when the content does;
+            (None, None) if the feed was never fetched successfully
+        """
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    if not self._load_file():
+                        self._try_refresh()
+                    self._loaded = True
+        now = time.time()
+        if now - self._checked_at > self.max_age and now - self._last_attempt > self.retry_interval:
+            self.refresh_async()
+        self.stats["hits"] += 1
+        return self._current
+
+    def _restore(self, cached: dict):
+        self._set(cached["data"])
+        self._etag = cached.get("etag")
+        self._last_modified = cached.get("last_modified")
+        self._checked_at = cached.get("checked_at", 0.0)
+
+    def _document(self) -> dict:
+        return {
+            "checked_at": self._checked_at,
+            "etag": self._etag,
+            "last_modified": self._last_modified,
+            "data": self._current[0],
+        }
+
+    def _set(self, data):
+        self._current = (data, hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16])
+
+    def _refresh(self):
+        self._last_attempt = time.time()
+        self.stats["fetches"] += 1
+        # Without a copy to fall back on the validators are useless, fetch the full feed
+        has_copy = self._current[0] is not None
+        data, etag, last_modified = self.fetch(self._etag if has_copy else None, self._last_modified if has_copy else None)
+        if data is None:
+            self.stats["not_modified"] += 1
+        else:
+            self._set(data)
+        self._etag, self._last_modified = etag, last_modified
+        self._checked_at = time.time()
+        self.error = None
+        self._save_file()
+
+    def _try_refresh(self):
+        try:
+            self._refresh()
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.error = str(e)
+            logger.info(f"Feed refresh failed, {'keeping the last good copy' if self._current[0] is not None else 'no copy to serve'}: {e}")
+
+    def _background_refresh(self):
+        self._try_refresh()
@@ -0,0 +1,100 @@
+from abc import ABC, abstractmethod
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def write_json(path: str, document) -> None:
+    """
+    Write `document` to `path` atomically.
+
+    Each writer gets its own temporary file next to `path`, so processes
+    sharing the file (e.g. gunicorn workers) never write into each other's.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(document, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class FileBackedCache(ABC):
+    """
+    Last good copy of something fetched over the network, kept in memory and
+    in a JSON file (on the PVC) so a restart doesn't need the network.
+
+    Subclasses turn their state into the file's document and back and
+    fetch new copies; this class loads and atomically saves the file and
+    runs background refreshes, one at a time.
+
+    Parameters:
+    -----------
+    path : str
+        Cache file path
+    """
+
+    thread_name = "cache-refresh"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._last_attempt = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    @abstractmethod
+    def _document(self) -> dict:
+        """Current state as the JSON document of the cache file"""
+
+    @abstractmethod
+    def _restore(self, cached: dict):
+        """Adopt the state of a cache file document"""
+
+    @abstractmethod
+    def _refresh(self):
+        """Fetch a new copy (called with the lock held) and save it"""
+
+    def _load_file(self) -> bool:
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.info(f"No usable cache at {self.path}: {e}")
+            return False
+        self._restore(cached)
+        return True
+
+    def _save_file(self):
+        try:
+            write_json(self.path, self._document())
+        except OSError as e:
+            logger.info(f"Could not write cache to {self.path}: {e}")
+
+    def _background_refresh(self):
+        self._refresh()
+
+    def refresh_async(self):
+        """Refresh in a background thread (no-op if one is already running)"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+            self._last_attempt = time.time()
+
+        def run():
+            try:
+                with self._lock:
+                    self._background_refresh()
+            except Exception as e:
+                logger.info(f"Background refresh of {self.path} failed, keeping the cached copy: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name=self.thread_name, daemon=True).start()
@@ -0,0 +1,23 @@
+import os
+import shutil
+
+# Production server: several worker processes, each with a thread pool, so a slow request (or the
+# long-lived /positions/stream connections) never blocks /healthz and the other routes.
+# Workers share the positions snapshot, rate limiters and leadership through this directory.
+os.environ.setdefault("SHARED_STATE_DIR", "/tmp/papishares")
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))  # Worker processes, only one of them talks to Trading 212
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "16"))  # Threads per worker, each open event stream holds one
+timeout = 60
+graceful_timeout = 10  # Event streams never end on their own
+keepalive = 5
+# Each worker imports the app itself, background threads don't survive a fork
+preload_app = False
+accesslog = "-"
+
+
+def on_starting(server):
+    # Metrics files of a previous run's workers would be added to this one's
+    shutil.rmtree(os.path.join(os.environ["SHARED_STATE_DIR"], "metrics"), ignore_errors=True)
@@ -0,0 +1,223 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIR = os.getenv("HISTORY_DIR", os.path.join(os.path.dirname(os.getenv("DB_PATH", "./papishares.db")) or ".", "history"))
+
+# One row per refresh
+SNAPSHOT_DTYPE = np.dtype([
+    ("ts", "<f8"),
+    ("total_capital", "<f8"),
+    ("total_risk", "<f4"),
+    ("positions", "<u2"),
+])
+
+# One row per position, only written when something other than the timestamp changed
+POSITION_DTYPE = np.dtype([
+    ("ts", "<f8"),
+    ("ticker", "<u2"),
+    ("quantity", "<f8"),
+    ("current_price", "<f8"),
+    ("max_price", "<f8"),
+    ("stop_loss_price", "<f8"),
+    ("profit_pct", "<f4"),
+    ("macd_signal", "u1"),
+    ("macd_crossover", "u1"),
+])
+
+SIGNALS = (None, "BULLISH", "BEARISH", "NEUTRAL")
+
+
+def _day(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+class HistoryStore:
+    """
+    Append-only time series of refresh snapshots, partitioned by UTC day.
+
+    Each day has two packed-row files of fixed-size NumPy records,
+    snapshots-YYYY-MM-DD.bin and positions-YYYY-MM-DD.bin. Tickers are stored
+    as ids from symbols.json, and a position row is only written when its
+    values changed since the last row for that ticker (e.g. nothing is
+    written while markets are closed). Days before today are gzipped.
+    Rows are 22 and 48 bytes, so a year of 30s snapshots for a few dozen
+    positions stays in the tens of MB even before compression.
+
+    Parameters:
+    -----------
+    path : str
+        Directory holding the day files
+    """
+
+    def __init__(self, path: str = HISTORY_DIR):
+        self.path = path
+        self._symbols: Optional[Dict[str, int]] = None
+        self._symbols_mtime: Optional[int] = None
+        self._last_rows: Dict[int, tuple] = {}
+        self._day: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _file(self, kind: str, day: str) -> str:
+        return os.path.join(self.path, f"{kind}-{day}.bin")
+
+    def _load_symbols(self) -> Dict[str, int]:
+        # Reloaded when another worker process added symbols since
+        path = os.path.join(self.path, "symbols.json")
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if self._symbols is None or mtime != self._symbols_mtime:
+            os.makedirs(self.path, exist_ok=True)
+            try:
+                with open(path) as f:
+                    self._symbols = json.load(f)
+            except (OSError, ValueError):
+                self._symbols = {}
+            self._symbols_mtime = mtime
+        return self._symbols
+
+    def _symbol_id(self, ticker: str) -> int:
+        symbols = self._load_symbols()
+        if ticker not in symbols:
+            symbols[ticker] = len(symbols)
+            tmp = os.path.join(self.path, "symbols.json.tmp")
+            with open(tmp, "w") as f:
+                json.dump(symbols, f)
+            os.replace(tmp, os.path.join(self.path, "symbols.json"))
+            self._symbols_mtime = os.stat(os.path.join(self.path, "symbols.json")).st_mtime_ns
+        return symbols[ticker]
+
+    def append(self, result: dict, total_capital: float, ts: Optional[float] = None):
+        """Record one get_current_positions() result"""
+        ts = time.time() if ts is None else ts
+        day = _day(ts)
+        with self._lock:
+            if day != self._day:
+                # New partition: start with a full set of position rows and compress the closed days
+                self._last_rows.clear()
+                self._day = day
+                self._compress_closed(day)
+
+            snapshot = np.array([(ts, total_capital, result["total_risk"], len(result["positions"]))], dtype=SNAPSHOT_DTYPE)
+            rows = []
+            for position in result["positions"]:
+                ticker = self._symbol_id(position["ticker"])
+                values = (
+                    position["quantity"],
+                    position["current_price"],
+                    position["max_price"],
+                    position["stop_loss_price"],
+                    position["profit_pct"],
+                    SIGNALS.index(position["macd_signal"]),
+                    SIGNALS.index(position["macd_crossover"]),
+                )
+                if self._last_rows.get(ticker) != values:
+                    self._last_rows[ticker] = values
+                    rows.append((ts, ticker) + values)
+
+            with open(self._file("snapshots", day), "ab") as f:
+                f.write(snapshot.tobytes())
+            if rows:
+                with open(self._file("positions", day), "ab") as f:
+                    f.write(np.array(rows, dtype=POSITION_DTYPE).tobytes())
+
+    def _compress_closed(self, today: str):
+        for name in os.listdir(self.path) if os.path.isdir(self.path) else ():
+            if name.endswith(".bin") and name[-14:-4] < today:
+                source = os.path.join(self.path, name)
+                with open(source, "rb") as f_in, gzip.open(source + ".gz.tmp", "wb") as f_out:
+                    f_out.write(f_in.read())
+                os.replace(source + ".gz.tmp", source + ".gz")
+                os.remove(source)
+                logger.info(f"Compressed history partition {name}")
+
+    def _read_day(self, kind: str, day: str, dtype: np.dtype) -> np.ndarray:
+        path = self._file(kind, day)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+        elif os.path.exists(path + ".gz"):
+            with gzip.open(path + ".gz", "rb") as f:
+                data = f.read()
+        else:
+            return np.empty(0, dtype=dtype)
+        # Ignore a partially written last row
+        return np.frombuffer(data[:len(data) - len(data) % dtype.itemsize], dtype=dtype)
+
+    def _read(self, kind: str, dtype: np.dtype, start: float, end: float) -> np.ndarray:
+        days = []
+        day = datetime.fromtimestamp(start, timezone.utc).date()
+        while day <= datetime.fromtimestamp(end, timezone.utc).date():
+            days.append(self._read_day(kind, day.isoformat(), dtype))
+            day += timedelta(days=1)
+        rows = np.concatenate(days) if days else np.empty(0, dtype=dtype)
+        return rows[(rows["ts"] >= start) & (rows["ts"] <= end)]
+
+    def snapshots(self, start: float, end: Optional[float] = None, step: float = 0) -> np.ndarray:
+        """
+        Snapshot rows between two timestamps.
+
+        Parameters:
+        -----------
+        start, end : float
+            Unix timestamps (end defaults to now)
+        step : float
+            Keep only the last row of every `step` seconds bucket (0 = all rows)
+        """
+        rows = self._read("snapshots", SNAPSHOT_DTYPE, start, time.time() if end is None else end)
+        return downsample(rows, step)
+
+    def equity_curve(self, start: float, end: Optional[float] = None, step: float = 0) -> List[Dict]:
+        """Account value and total risk over time, JSON-ready"""
+        rows = self.snapshots(start, end, step)
+        return [
+            {"ts": float(ts), "total_capital": float(capital), "total_risk": round(float(risk), 4)}
+            for ts, capital, risk in zip(rows["ts"], rows["total_capital"], rows["total_risk"])
+        ]
+
+    def position_history(self, ticker: str, start: float, end: Optional[float] = None, step: float = 0) -> List[Dict]:
+        """
+        Recorded rows of one position, JSON-ready.
+
+        Rows are only stored on change, so each value holds until the next row.
+        """
+        symbol_id = self._load_symbols().get(ticker)
+        if symbol_id is None:
+            return []
+        rows = self._read("positions", POSITION_DTYPE, start, time.time() if end is None else end)
+        rows = downsample(rows[rows["ticker"] == symbol_id], step)
+        return [
+            {
+                "ts": float(row["ts"]),
+                "quantity": float(row["quantity"]),
+                "current_price": float(row["current_price"]),
+                "max_price": float(row["max_price"]),
+                "stop_loss_price": float(row["stop_loss_price"]),
+                "profit_pct": round(float(row["profit_pct"]), 2),
+                "macd_signal": SIGNALS[row["macd_signal"]],
+                "macd_crossover": SIGNALS[row["macd_crossover"]],
+            }
+            for row in rows
+        ]
+
+
+def downsample(rows: np.ndarray, step: float) -> np.ndarray:
+    """Last row of every `step` seconds bucket (rows sorted by ts)"""
+    if step <= 0 or len(rows) == 0:
+        return rows
+    buckets = np.floor(rows["ts"] / step)
+    last = np.append(buckets[1:] != buckets[:-1], True)
+    return rows[last]
+
+
+store = HistoryStore()
@@ -0,0 +1,176 @@
+from typing import Dict, NamedTuple, Optional, Tuple
+import logging
+import threading
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+FAST_PERIOD = 12
+SLOW_PERIOD = 26
+SIGNAL_PERIOD = 9
+SMA_WINDOW = 50  # Closes kept for SMA, enough for any get_sma(days) in use
+
+
+class Ema(NamedTuple):
+    weighted: float
+    old_wt: float
+
+
+def ema_alpha(span: int) -> float:
+    return 2.0 / (1.0 + span)
+
+
+def ema_step(state: Optional[Ema], cur: float, alpha: float) -> Ema:
+    """
+    One step of pandas' ewm(span, adjust=False).mean().
+
+    Written with the same operations (and NaN handling) as pandas' own loop,
+    so values match the vectorized calculation bit for bit.
+    """
+    if state is None:
+        return Ema(cur, 1.0)
+    weighted, old_wt = state
+    is_observation = cur == cur
+    if weighted == weighted:
+        old_wt *= 1.0 - alpha
+        if is_observation:
+            if weighted != cur:
+                weighted = old_wt * weighted + alpha * cur
+                weighted /= old_wt + alpha
+            old_wt = 1.0
+    elif is_observation:
+        weighted = cur
+    return Ema(weighted, old_wt)
+
+
+class IndicatorState(NamedTuple):
+    """MACD and SMA state after the bar at `ts`, with the EMAs seeded at the bar at `start`"""
+    ts: str
+    close: float
+    fast: Ema
+    slow: Ema
+    signal: Ema
+    closes: Tuple[float, ...]
+    start: str = ""
+
+    @property
+    def macd(self) -> float:
+        return self.fast.weighted - self.slow.weighted
+
+    @property
+    def signal_line(self) -> float:
+        return self.signal.weighted
+
+    @property
+    def histogram(self) -> float:
+        return self.macd - self.signal.weighted
+
+    def sma(self, days: int) -> Optional[float]:
+        if days > len(self.closes):
+            return None
+        # Summed in order from the window, same result as sum(prices[-days:])
+        return sum(self.closes[-days:]) / days
+
+
+def _same(a: float, b: float) -> bool:
+    return a == b or (a != a and b != b)
+
+
+def advance(state: Optional[IndicatorState], ts: pd.Timestamp, close: float) -> IndicatorState:
+    """State after one more bar, in O(1)"""
+    fast = ema_step(state.fast if state else None, close, ema_alpha(FAST_PERIOD))
+    slow = ema_step(state.slow if state else None, close, ema_alpha(SLOW_PERIOD))
+    signal = ema_step(state.signal if state else None, fast.weighted - slow.weighted, ema_alpha(SIGNAL_PERIOD))
+    closes = ((state.closes if state else ()) + (close,))[-SMA_WINDOW:]
+    return IndicatorState(ts.isoformat(), close, fast, slow, signal, closes, state.start if state else ts.isoformat())
+
+
+def macd_frame(closes: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    MACD for every column of a column-per-symbol close frame in one vectorized pass.
+
+    NaNs (dates a symbol did not trade) are skipped with ignore_na, so each
+    column matches calculate_macd() run on that symbol's own bars.
+
+    Returns:
+    --------
+    dict
+        'MACD', 'Signal' and 'Histogram' frames shaped like `closes`
+    """
+    traded = closes.notna()
+    fast = closes.ewm(span=FAST_PERIOD, adjust=False, ignore_na=True).mean()
+    slow = closes.ewm(span=SLOW_PERIOD, adjust=False, ignore_na=True).mean()
+    macd = (fast - slow).where(traded)
+    signal = macd.ewm(span=SIGNAL_PERIOD, adjust=False, ignore_na=True).mean().where(traded)
+    return {"MACD": macd, "Signal": signal, "Histogram": macd - signal}
+
+
+class IndicatorEngine:
+    """
+    Incremental MACD/SMA per symbol.
+
+    The EMAs are seeded at the first bar of the window passed to update()
+    (the 3mo bar store window), so values are identical to calculate_macd()
+    run over that window. That seed moves with every new daily bar, so the
+    state is rebuilt in one pass over the window once per bar; it is only
+    kept in memory. Between two bars (intraday top-ups of the partial last
+    bar) the state of the completed bars is reused and an update costs one
+    step.
+    """
+
+    def __init__(self):
+        self._states: Dict[Tuple[str, str], IndicatorState] = {}
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.stats = {"bars_applied": 0, "rebuilds": 0}
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def update(self, symbol: str, df: pd.DataFrame, interval: str = "1d") -> Tuple[Optional[IndicatorState], IndicatorState]:
+        """
+        Bring the state of `symbol` up to date with the bars in `df`.
+
+        Parameters:
+        -----------
+        df : DataFrame
+            Bars of the window the indicators are computed over, its first
+            bar seeds the EMAs
+
+        Returns:
+        --------
+        tuple
+            (state after the previous bar or None, state after the latest bar)
+        """
+        key = (symbol, interval)
+        with self._key_lock(key):
+            state = self._states.get(key)
+
+            closes = df["Close"]
+            start = 0
+            if state is not None:
+                ts = pd.Timestamp(state.ts)
+                pos = df.index.searchsorted(ts)
+                # Same seed bar, and the committed bar must still be there with the same close
+                # (no gap, no split/dividend adjustment)
+                if (state.start == df.index[0].isoformat() and pos < len(df) - 1 and df.index[pos] == ts
+                        and _same(float(closes.iloc[pos]), state.close)):
+                    start = int(pos) + 1
+                else:
+                    logger.debug(f"Rebuilding indicator state for {symbol} ({interval}) from {df.index[0]}")
+                    self.stats["rebuilds"] += 1
+                    state = None
+
+            committed = state
+            for i in range(start, len(df) - 1):
+                committed = advance(committed, df.index[i], float(closes.iloc[i]))
+            self.stats["bars_applied"] += max(0, len(df) - 1 - start)
+
+            self._states[key] = committed
+
+            latest = advance(committed, df.index[-1], float(closes.iloc[-1]))
+            return committed, latest
+
+
+engine = IndicatorEngine()
@@ -0,0 +1,150 @@
+from typing import Callable, Dict, Iterable, Iterator, Optional
+import logging
+import sys
+import time
+from filecache import FileBackedCache
+
+logger = logging.getLogger(__name__)
+
+# Listed in London but not priced in GBP/GBX (e.g. Coffee/Cocoa are in USD)
+LONDON_LISTED = {"3CFL", "COFF", "COCO"}
+
+
+class Instrument:
+    """Compact record for one entry of /metadata/instruments"""
+    __slots__ = ("ticker", "short_name", "name", "currency_code")
+
+    def __init__(self, ticker: str, short_name: str, name: str, currency_code: str):
+        # Interned, thousands of instruments share a handful of currency codes
+        self.ticker = sys.intern(ticker)
+        self.short_name = sys.intern(short_name)
+        self.name = name
+        self.currency_code = sys.intern(currency_code)
+
+    @classmethod
+    def from_json(cls, item: dict) -> "Instrument":
+        return cls(item["ticker"], item["shortName"], item["name"], item["currencyCode"])
+
+    def to_json(self) -> dict:
+        return {"ticker": self.ticker, "shortName": self.short_name, "name": self.name, "currencyCode": self.currency_code}
+
+    @property
+    def yahoo_symbol(self) -> str:
+        """Yahoo Finance symbol, London listings get the .L suffix"""
+        if self.currency_code in ("GBX", "GBP") or self.short_name in LONDON_LISTED:
+            return self.short_name + ".L"
+        return self.short_name
+
+    def __repr__(self):
+        return f"Instrument({self.ticker!r}, {self.short_name!r}, {self.currency_code!r})"
+
+
+class InstrumentIndex:
+    """O(1) lookups over the instrument list, by Trading 212 ticker or by Yahoo symbol"""
+
+    def __init__(self, instruments: Iterable[Instrument]):
+        self._by_ticker: Dict[str, Instrument] = {}
+        self._by_symbol: Dict[str, Instrument] = {}
+        for instrument in instruments:
+            self._by_ticker[instrument.ticker] = instrument
+            # First listing wins, shortNames are not unique across exchanges
+            self._by_symbol.setdefault(instrument.yahoo_symbol, instrument)
+
+    @classmethod
+    def from_json(cls, items: Iterable[dict]) -> "InstrumentIndex":
+        return cls(Instrument.from_json(item) for item in items)
+
+    def get(self, ticker: str) -> Optional[Instrument]:
+        return self._by_ticker.get(ticker)
+
+    def by_symbol(self, symbol: str) -> Optional[Instrument]:
+        return self._by_symbol.get(symbol)
+
+    def __len__(self):
+        return len(self._by_ticker)
+
+    def __iter__(self) -> Iterator[Instrument]:
+        return iter(self._by_ticker.values())
+
+
+class InstrumentCache(FileBackedCache):
+    """
+    Lazily loaded InstrumentIndex persisted to a JSON file (on the PVC).
+
+    The first lookup loads the cached file; only if there is none does it block
+    on the API. When the file is older than max_age it is refreshed in a
+    background thread with If-None-Match, and a ticker missing from the cache
+    (e.g. a newly listed instrument) forces one synchronous refresh at most
+    every min_refresh_interval seconds.
+
+    Parameters:
+    -----------
+    fetch : callable
+        fetch(etag) -> (instrument dicts or None if unchanged, etag)
+    path : str
+        Cache file path
+    max_age : float
+        Seconds before the cached list is refreshed
+    """
+
+    thread_name = "instruments-refresh"
+
+    def __init__(self, fetch: Callable, path: str, max_age: float = 86400, min_refresh_interval: float = 300):
+        super().__init__(path)
+        self.fetch = fetch
+        self.max_age = max_age
+        self.min_refresh_interval = min_refresh_interval
+        self._index: Optional[InstrumentIndex] = None
+        self._etag: Optional[str] = None
+        self._fetched_at = 0.0
+
+    def _ensure_loaded(self) -> InstrumentIndex:
+        if self._index is None:
+            with self._lock:
+                if self._index is None and not self._load_file():
+                    self._refresh()
+        now = time.time()
+        if now - self._fetched_at > self.max_age and now - self._last_attempt > self.min_refresh_interval:
+            self.refresh_async()
+        return self._index
+
+    def _restore(self, cached: dict):
+        self._index = InstrumentIndex.from_json(cached["instruments"])
+        self._etag = cached.get("etag")
+        self._fetched_at = cached.get("fetched_at", 0.0)
+        logger.info(f"Loaded {len(self._index)} instruments from {self.path}")
+
+    def _document(self) -> dict:
+        return {
+            "fetched_at": self._fetched_at,
+            "etag": self._etag,
+            "instruments": [instrument.to_json() for instrument in self._index],
+        }
+
+    def _refresh(self):
+        self._last_attempt = time.time()
+        items, etag = self.fetch(self._etag if self._index is not None else None)
+        if items is not None:
+            self._index = InstrumentIndex.from_json(items)
+            logger.info(f"Fetched {len(self._index)} instruments")
+        self._etag = etag
+        self._fetched_at = time.time()
+        self._save_file()
+
+    def get(self, ticker: str) -> Optional[Instrument]:
+        instrument = self._ensure_loaded().get(ticker)
+        if instrument is None and time.time() - self._last_attempt > self.min_refresh_interval:
+            logger.info(f"{ticker} not in the instrument cache, refreshing it")
+            with self._lock:
+                self._refresh()
+            instrument = self._index.get(ticker)
+        return instrument
+
+    def by_symbol(self, symbol: str) -> Optional[Instrument]:
+        return self._ensure_loaded().by_symbol(symbol)
+
+    def __len__(self):
+        return len(self._ensure_loaded())
+
+    def __iter__(self) -> Iterator[Instrument]:
+        return iter(self._ensure_loaded())
@@ -0,0 +1,359 @@
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import bisect
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upstream calls range from a few ms (SQLite) to tens of seconds (throttled Yahoo batches)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_PUBLISH_INTERVAL = float(os.getenv("METRICS_PUBLISH_INTERVAL", "5")) # Seconds between the writes of each worker's metrics for the one answering /metrics
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Histogram:
+    """
+    Prometheus histogram with a fixed label set.
+
+    Parameters:
+    -----------
+    name : str
+        Metric name, in seconds for timings
+    help : str
+        Description shown by Prometheus
+    labels : tuple
+        Label names, every observation gives a value for each
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> Dict[Tuple, List]:
+        with self._lock:
+            return {key: [[*counts], total, count] for key, (counts, total, count) in self._series.items()}
+
+    @staticmethod
+    def combine(a: List, b: List) -> List:
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def samples(self, series: Optional[Dict[Tuple, List]] = None) -> Iterable[str]:
+        series = self.snapshot() if series is None else series
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                yield f"{self.name}_bucket{_labels(self.label_names, key, ('le', _number(bound)))} {cumulative}"
+            yield f"{self.name}_bucket{_labels(self.label_names, key, ('le', '+Inf'))} {count}"
+            yield f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.label_names, key)} {count}"
+
+
+class Counter:
+    """Monotonic Prometheus counter with a fixed label set"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> Dict[Tuple, float]:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def combine(a: float, b: float) -> float:
+        return a + b
+
+    def samples(self, values: Optional[Dict[Tuple, float]] = None) -> Iterable[str]:
+        values = self.snapshot() if values is None else values
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.label_names, key)} {_number(value)}"
+
+
+class Gauge:
+    """
+    Values read at scrape time, e.g. the stats dicts of the caches.
+
+    Parameters:
+    -----------
+    collect : callable
+        Returns {label values tuple: value}
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], collect: Callable[[], Dict[Tuple, float]]):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.collect = collect
+
+    # Values of different workers are not added up but told apart by a label
+    combine = None
+
+    def snapshot(self) -> Dict[Tuple, float]:
+        return {key: value for key, value in self.collect().items() if value is not None}
+
+    def samples(self, values: Optional[Dict[Tuple, float]] = None, label_names: Optional[Tuple[str, ...]] = None) -> Iterable[str]:
+        values = self.snapshot() if values is None else values
+        label_names = self.label_names if label_names is None else label_names
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_labels(label_names, key)} {_number(value)}"
+
+
+class Registry:
+    """Every metric of the process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...], collect: Callable[[], Dict[Tuple, float]]) -> Gauge:
+        return self.register(Gauge(name, help, labels, collect))
+
+    def snapshot(self) -> Dict[str, List]:
+        """JSON-ready values of every metric, for render(workers=...)"""
+        return {
+            name: [[list(key), value] for key, value in metric.snapshot().items()]
+            for name, metric in list(self._metrics.items())
+        }
+
+    def cumulative(self, snapshot: Dict[str, List]) -> Dict[str, List]:
+        """The counters and histograms of a snapshot(), without its gauges"""
+        return {name: values for name, values in snapshot.items() if name in self._metrics and self._metrics[name].combine is not None}
+
+    def render(self, workers: Optional[Dict[str, Dict[str, List]]] = None) -> str:
+        """
+        Prometheus text format.
+
+        Parameters:
+        -----------
+        workers : dict, optional
+            {worker: snapshot()} of several processes: counters and histograms
+            are summed over them, gauges get a 'worker' label. Only this
+            process' own values when missing.
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if workers is None:
+                lines.extend(metric.samples())
+                continue
+            values = {}
+            for worker, snapshot in sorted(workers.items()):
+                for key, value in snapshot.get(metric.name, []):
+                    if metric.combine is None:
+                        values[(*key, worker)] = value
+                    else:
+                        key = tuple(key)
+                        values[key] = metric.combine(values[key], value) if key in values else value
+            if metric.combine is None:
+                lines.extend(metric.samples(values, (*metric.label_names, "worker")))
+            else:
+                lines.extend(metric.samples(values))
+        return "\n".join(lines) + "\n"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WorkerMetrics:
+    """
+    Metrics of every worker process of the server, merged at scrape time.
+
+    Each worker writes its registry's snapshot to its own file in `directory`
+    every `interval` seconds and right before it answers a scrape, which then
+    reads them all. Workers that exited keep contributing their counters and
+    histograms, so the totals never go backwards, but not their gauges.
+
+    Parameters:
+    -----------
+    registry : Registry
+        This process' metrics
+    directory : str
+        Directory shared by the workers (e.g. in SHARED_STATE_DIR)
+    interval : float
+        Seconds between writes
+    """
+
+    def __init__(self, registry: Registry, directory: str, interval: float = METRICS_PUBLISH_INTERVAL):
+        os.makedirs(directory, exist_ok=True)
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        # The start time tells apart a worker that reuses the pid of an exited one
+        self.path = os.path.join(directory, f"{os.getpid()}-{time.time_ns()}.json")
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="metrics-publish", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.publish()
+            except Exception as e:
+                logger.info(f"Could not publish the metrics to {self.path}: {e}")
+            time.sleep(self.interval)
+
+    def publish(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(tmp, self.path)
+
+    def render(self) -> str:
+        self.publish()
+        files = {}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            pid, started = os.path.basename(path)[:-len(".json")].split("-")
+            files.setdefault(int(pid), []).append((int(started), path))
+        workers = {}
+        for pid, paths in files.items():
+            paths.sort()
+            alive = _alive(pid)
+            for i, (started, path) in enumerate(paths):
+                try:
+                    with open(path) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.info(f"Skipping the metrics in {path}: {e}")
+                    continue
+                # Gauges describe the present, only the latest worker of a live pid has them
+                current = alive and i == len(paths) - 1
+                workers[str(pid) if current else f"{pid}-{started}"] = snapshot if current else self.registry.cumulative(snapshot)
+        return self.registry.render(workers)
+
+
+def hit_ratio(hits: float, misses: float) -> Optional[float]:
+    """Share of lookups served from cache, None before the first lookup"""
+    return hits / (hits + misses) if hits + misses else None
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = Registry()
+
+# Hot-path instruments, observed by the modules doing the work
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "papishares_upstream_request_seconds",
+    "Duration of calls to Trading 212, Yahoo Finance, Telegram and SQLite",
+    ("upstream", "endpoint", "status"),
+)
+REFRESH_STAGE_SECONDS = REGISTRY.histogram(
+    "papishares_refresh_stage_seconds",
+    "Duration of each stage of a positions refresh",
+    ("stage",),
+)
+INDICATOR_SECONDS = REGISTRY.histogram(
+    "papishares_position_indicators_seconds",
+    "MACD and SMA computation per position, bars included",
+)
+RATELIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    "papishares_ratelimit_wait_seconds",
+    "Time callers spent waiting for a rate limiter token",
+    ("bucket",),
+    buckets=(0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+RATELIMIT_PENALTIES = REGISTRY.counter(
+    "papishares_ratelimit_penalties_total",
+    "429 responses that paused a rate limiter",
+    ("bucket",),
+)
+
+
+@contextmanager
+def upstream_call(upstream: str, endpoint: str):
+    """
+    Time one upstream call into UPSTREAM_SECONDS.
+
+    The status label is 'ok', 'error' if the block raises, or whatever the
+    block sets in the yielded dict (e.g. the HTTP status code).
+    """
+    call = {"status": "ok"}
+    started = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call["status"] = "error"
+        raise
+    finally:
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, upstream=upstream, endpoint=endpoint, status=call["status"])
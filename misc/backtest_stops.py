@@ -0,0 +1,96 @@
+"""
+Backtest stop-loss policies over daily bars, every symbol at once.
+
+Each symbol is bought at its first bar and held until the policy's stop is
+hit. Bars come from the bar store (cached in BARS_DB_PATH) or are synthetic
+random walks, which needs no network:
+
+    python misc/backtest_stops.py AAPL MSFT VOD.L --period 5y
+    python misc/backtest_stops.py --synthetic 500 --policy risk:0.7:10 --policy tiered:4:10
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from stops import backtest, parse_policy, summarize
+
+BARS_PER_YEAR = 252
+
+
+def synthetic_bars(symbols, bars, seed=0):
+    """Geometric random walks with intraday ranges, staggered listings and a few gaps"""
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=bars)
+    returns = rng.normal(0.0004, 0.02, (bars, symbols))
+    close = 10 * rng.uniform(1, 50, symbols) * np.exp(np.cumsum(returns, axis=0))
+    high = close * (1 + np.abs(rng.normal(0, 0.01, close.shape)))
+    low = close * (1 - np.abs(rng.normal(0, 0.01, close.shape)))
+    listed = rng.integers(0, bars // 2, symbols)
+    missing = (np.arange(bars)[:, None] < listed) | (rng.random(close.shape) < 0.002)
+    columns = [f"SYN{i}" for i in range(symbols)]
+    frames = {}
+    for name, values in (("High", high), ("Low", low), ("Close", close)):
+        frames[name] = pd.DataFrame(np.where(missing, np.nan, values), index=index, columns=columns)
+    return frames
+
+
+def stored_bars(symbols, period):
+    """High, Low and Close frames (one column per symbol) from the bar store, fetching what is missing"""
+    from bars import store
+
+    store.prefetch(symbols, "1d", period)
+    frames = {"High": {}, "Low": {}, "Close": {}}
+    for symbol in dict.fromkeys(symbols):
+        df = store.get(symbol, "1d", period)
+        if df is None or df.empty:
+            print(f"No bars for {symbol}, skipped")
+            continue
+        # Exchanges close in different time zones, align on the trading date
+        df = df.set_axis(pd.DatetimeIndex(df.index.date))
+        for name in frames:
+            frames[name][symbol] = df[name]
+    return {name: pd.concat(columns, axis=1).sort_index() for name, columns in frames.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("symbols", nargs="*", help="Yahoo Finance symbols")
+    parser.add_argument("--period", default="5y", help="History per symbol, e.g. 1y, 5y (default 5y)")
+    parser.add_argument("--synthetic", type=int, metavar="N", help="Use N synthetic symbols instead of stored bars")
+    parser.add_argument("--policy", action="append", metavar="SPEC",
+                        help="risk[:risk_pct[:position_pct]] or tiered[:base_pct[:step]], repeatable (default risk:0.7:10 and tiered:4:10)")
+    parser.add_argument("--details", action="store_true", help="Also print the per-symbol trades")
+    args = parser.parse_args()
+
+    specs = args.policy or ["risk:0.7:10", "tiered:4:10"]
+    policies = [parse_policy(spec) for spec in specs]
+    if args.synthetic:
+        years = int(args.period.rstrip("y")) if args.period.endswith("y") else 5
+        frames = synthetic_bars(args.synthetic, years * BARS_PER_YEAR)
+    elif args.symbols:
+        frames = stored_bars(args.symbols, args.period)
+    else:
+        parser.error("give symbols or --synthetic N")
+
+    close = frames["Close"]
+    print(f"{close.shape[1]} symbols, {close.shape[0]} bars")
+    rows = []
+    for spec, policy in zip(specs, policies):
+        started = time.perf_counter()
+        result = backtest(policy, close, frames["High"], frames["Low"])
+        elapsed = time.perf_counter() - started
+        rows.append({"policy": spec, **summarize(result), "time_ms": elapsed * 1000})
+        if args.details:
+            print(f"\n{spec}")
+            print(tabulate(result, headers="keys", floatfmt=".2f"))
+    print(tabulate(rows, headers="keys", floatfmt=".2f"))
+
+
+if __name__ == "__main__":
+    main()
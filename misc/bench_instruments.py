@@ -0,0 +1,65 @@
+"""
+Compare instrument lookups: the old linear scan over /metadata/instruments
+against InstrumentIndex. Uses a synthetic instrument list, no API calls.
+
+    python misc/bench_instruments.py [instruments] [positions]
+"""
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from instruments import InstrumentIndex
+
+
+def synthetic_instruments(count):
+    currencies = ["USD", "GBX", "GBP", "EUR"]
+    return [
+        {
+            "ticker": f"SYM{i}_{'US' if i % 2 else 'L'}_EQ",
+            "shortName": f"SYM{i}",
+            "name": f"Synthetic instrument {i}",
+            "currencyCode": currencies[i % len(currencies)],
+            "type": "STOCK",
+            "isin": f"XX{i:010d}",
+        }
+        for i in range(count)
+    ]
+
+
+def measure_size(build):
+    tracemalloc.start()
+    obj = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size
+
+
+def main(count=15000, positions=40):
+    all_tickers, json_size = measure_size(lambda: synthetic_instruments(count))
+    index, index_size = measure_size(lambda: InstrumentIndex.from_json(all_tickers))
+    wanted = [item["ticker"] for item in random.Random(1).sample(all_tickers, positions)]
+
+    def scan():
+        for ticker in wanted:
+            next((item for item in all_tickers if item['ticker'] == ticker), None)
+
+    def lookup():
+        for ticker in wanted:
+            index.get(ticker)
+
+    build = min(timeit.repeat(lambda: InstrumentIndex.from_json(all_tickers), number=1, repeat=5))
+    scan_time = min(timeit.repeat(scan, number=10, repeat=5)) / 10
+    lookup_time = min(timeit.repeat(lookup, number=1000, repeat=5)) / 1000
+
+    print(f"{count} instruments, {positions} lookups per refresh")
+    print(f"Linear scan:      {scan_time * 1000:10.3f} ms")
+    print(f"InstrumentIndex:  {lookup_time * 1000:10.3f} ms  ({scan_time / lookup_time:,.0f}x faster)")
+    print(f"Index build:      {build * 1000:10.3f} ms (once at load time)")
+    print(f"Memory: raw JSON dicts {json_size / 1e6:.1f} MB, index {index_size / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,306 @@
+"""
+Benchmark the refresh path against a local stand-in for Trading 212 and
+Telegram, with fixture OHLCV bars in place of Yahoo Finance. No network or
+credentials needed.
+
+    python misc/bench_refresh.py [--sizes 5,25,100,500] [--latency 0.05] [--jitter 0.02]
+    python misc/bench_refresh.py --fixtures DIR     # replay recorded payloads
+    python misc/bench_refresh.py --record DIR       # record live payloads (uses the .env credentials)
+
+Each portfolio size runs in a fresh process (empty caches and DB) and
+reports, for a cold and a warm get_current_positions, get_pending_orders
+and manage_stop_losses: wall time, requests per upstream and SQLite
+statements. Recorded fixtures are portfolio.json, orders.json, cash.json
+and instruments.json in DIR.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+FIXTURES = ("portfolio", "orders", "cash", "instruments")
+
+
+def synthetic_payloads(size, seed=1):
+    rng = random.Random(seed)
+    currencies = ["USD", "GBX", "GBP"]
+    instruments, portfolio, orders = [], [], []
+    for i in range(max(size * 20, 1000)):
+        instruments.append({
+            "ticker": f"SYM{i}_EQ", "shortName": f"SYM{i}", "name": f"Synthetic {i}",
+            "currencyCode": currencies[i % len(currencies)], "type": "STOCK",
+        })
+    for i in range(size):
+        average = rng.uniform(5, 500)
+        portfolio.append({
+            "ticker": f"SYM{i}_EQ", "quantity": float(rng.randint(1, 300)), "averagePrice": average,
+            "currentPrice": round(average * rng.uniform(0.85, 1.3), 2),
+        })
+        if i % 3 == 0:
+            orders.append({"type": "STOP", "ticker": f"SYM{i}_EQ", "stopPrice": round(average * 0.9, 2), "quantity": 1})
+        if i % 5 == 0:
+            orders.append({"type": "LIMIT", "ticker": f"SYM{i}_EQ", "limitPrice": round(average * 0.95, 2), "quantity": 1})
+    total = sum(p["quantity"] * p["averagePrice"] for p in portfolio)
+    return {"portfolio": portfolio, "orders": orders, "cash": {"total": total * 1.2, "free": total * 0.2}, "instruments": instruments}
+
+
+class StandIn:
+    """Threaded HTTP server answering the Trading 212 and Telegram endpoints from fixtures"""
+
+    def __init__(self, payloads, latency=0.0, jitter=0.0):
+        self.payloads = payloads
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = Counter()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, body, status=200):
+                time.sleep(stand_in.latency + random.uniform(0, stand_in.jitter))
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path == "/portfolio":
+                    stand_in.calls["t212 /portfolio"] += 1
+                    return self._reply(stand_in.payloads["portfolio"])
+                if path.startswith("/portfolio/"):
+                    stand_in.calls["t212 /portfolio/{ticker}"] += 1
+                    ticker = path.rsplit("/", 1)[1]
+                    return self._reply(next(p for p in stand_in.payloads["portfolio"] if p["ticker"] == ticker))
+                if path == "/orders":
+                    stand_in.calls["t212 /orders"] += 1
+                    return self._reply(stand_in.payloads["orders"])
+                if path == "/account/cash":
+                    stand_in.calls["t212 /account/cash"] += 1
+                    return self._reply(stand_in.payloads["cash"])
+                if path == "/metadata/instruments":
+                    stand_in.calls["t212 /metadata/instruments"] += 1
+                    return self._reply(stand_in.payloads["instruments"])
+                self._reply({"error": "not found"}, 404)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path == "/orders/market":
+                    stand_in.calls["t212 /orders/market"] += 1
+                    return self._reply({"type": "/api-errors/selling-equity-not-owned"}, 400)
+                stand_in.calls["telegram"] += 1
+                self._reply({"ok": True})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+
+def install_fixture_bars(bars, calls, latency, jitter, days=70):
+    """Replace yfinance in the bar store with deterministic random-walk bars"""
+    import numpy as np
+    import pandas as pd
+
+    def frame(symbol, start=None):
+        tz = "Europe/London" if symbol.endswith(".L") else "America/New_York"
+        end = pd.Timestamp.now(tz=tz).normalize()
+        index = pd.bdate_range(end=end, periods=days, tz=tz, name="Date")
+        rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, days)))
+        df = pd.DataFrame({
+            "Open": close * 0.995, "High": close * 1.01, "Low": close * 0.99, "Close": close,
+            "Volume": rng.integers(1e5, 1e6, days).astype(float),
+        }, index=index)
+        if start is not None:
+            df = df[df.index >= pd.Timestamp(start).tz_localize(tz) if pd.Timestamp(start).tz is None else pd.Timestamp(start)]
+        return df
+
+    def wait():
+        time.sleep(latency + random.uniform(0, jitter))
+
+    class Ticker:
+        def __init__(self, symbol):
+            self.symbol = symbol
+
+        def history(self, period=None, interval="1d", start=None):
+            calls["yahoo chart"] += 1
+            wait()
+            return frame(self.symbol, start)
+
+    def download(symbols, interval="1d", ignore_tz=False, start=None, **kwargs):
+        calls["yahoo chart"] += len(symbols)
+        calls["yahoo download batches"] += 1
+        wait()
+        frames = {}
+        for symbol in symbols:
+            df = frame(symbol, start)
+            if ignore_tz:
+                df.index = df.index.tz_localize(None)
+            frames[symbol] = df
+        return pd.concat(frames, axis=1)
+
+    bars.yf.Ticker = Ticker
+    bars.yf.download = download
+
+
+def record(directory):
+    """Save live payloads as fixtures"""
+    import papishares
+    os.makedirs(directory, exist_ok=True)
+    fetched = {
+        "portfolio": papishares.fetch_positions(),
+        "orders": papishares.fetch_orders(),
+        "cash": papishares.get_account_value(),
+        "instruments": papishares.fetch_all_tickers_info(),
+    }
+    for name, payload in fetched.items():
+        with open(os.path.join(directory, f"{name}.json"), "w") as f:
+            json.dump(payload, f)
+    print(f"Recorded {len(fetched['portfolio'])} positions and {len(fetched['orders'])} orders to {directory}")
+
+
+def worker(args):
+    """One benchmark run in this (fresh) process"""
+    if args.fixtures:
+        payloads = {}
+        for name in FIXTURES:
+            with open(os.path.join(args.fixtures, f"{name}.json")) as f:
+                payloads[name] = json.load(f)
+    else:
+        payloads = synthetic_payloads(args.worker)
+    stand_in = StandIn(payloads, args.latency, args.jitter)
+
+    data = tempfile.mkdtemp(prefix="bench-refresh-")
+    try:
+        os.environ.update({
+            "T212_API_BASE": stand_in.url,
+            "TELEGRAM_API_BASE": stand_in.url,
+            "DB_PATH": os.path.join(data, "papishares.db"),
+            "T212_RATE_SCALE": str(args.rate_limit),
+            "YAHOO_RATE_LIMIT": str(args.rate_limit),
+            "YAHOO_RATE_BURST": str(args.rate_limit),
+            "TELEGRAM_RATE_LIMIT": str(args.rate_limit),
+            "TELEGRAM_RATE_BURST": str(args.rate_limit),
+            "NOTIFY_BATCH_WINDOW": "0",
+        })
+
+        # Count every SQLite statement of every connection the app opens
+        import sqlite3
+        statements = Counter()
+        connect = sqlite3.connect
+
+        def traced_connect(*a, **kw):
+            conn = connect(*a, **kw)
+            statements["connections"] += 1
+            conn.set_trace_callback(lambda sql: statements.update(["statements"]))
+            return conn
+
+        sqlite3.connect = traced_connect
+
+        import logging
+        logging.disable(logging.INFO)
+        import bars
+        import papishares
+        import stoploss
+        install_fixture_bars(bars, stand_in.calls, args.yahoo_latency, args.jitter)
+
+        papishares.initialize_database(os.environ["DB_PATH"])
+        instruments = papishares.load_instruments()
+
+        results = []
+
+        def measure(name, fn):
+            # Cached upstream responses would hide the calls of the next phase
+            papishares.upstream.invalidate()
+            calls_before, statements_before = Counter(stand_in.calls), Counter(statements)
+            started = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - started
+            papishares.notifications.drain(10)
+            results.append({
+                "phase": name,
+                "seconds": elapsed,
+                "calls": dict(stand_in.calls - calls_before),
+                "sql": dict(statements - statements_before),
+            })
+
+        db = os.environ["DB_PATH"]
+        measure("refresh (cold)", lambda: papishares.get_current_positions(db, instruments))
+        measure("refresh (warm)", lambda: papishares.get_current_positions(db, instruments))
+        measure("pending orders", lambda: papishares.get_pending_orders(instruments))
+        measure("stop losses", lambda: stoploss.manage_stop_losses(instruments))
+        return {"positions": len(payloads["portfolio"]), "results": results}
+    finally:
+        shutil.rmtree(data, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="5,25,100,500", help="Portfolio sizes to synthesize")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stand-in Trading 212/Telegram latency (s)")
+    parser.add_argument("--yahoo-latency", type=float, default=0.2, help="Fixture Yahoo latency per download (s)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Extra random latency, uniform in [0, jitter] (s)")
+    parser.add_argument("--rate-limit", type=float, default=1000, help="Yahoo and Telegram limiter requests/s, and the multiplier on the T212 endpoint limits")
+    parser.add_argument("--fixtures", help="Directory with recorded payloads to replay")
+    parser.add_argument("--record", help="Record live payloads into this directory and exit")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.record:
+        return record(args.record)
+    if args.worker is not None:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        with open(os.devnull, "w") as devnull:
+            # manage_stop_losses prints its report, keep stdout for the JSON result
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                run = worker(args)
+            finally:
+                sys.stdout = stdout
+        print(json.dumps(run))
+        return
+
+    from tabulate import tabulate
+    sizes = [0] if args.fixtures else [int(size) for size in args.sizes.split(",")]
+    rows = []
+    for size in sizes:
+        command = [sys.executable, __file__, "--worker", str(size), "--latency", str(args.latency),
+                   "--yahoo-latency", str(args.yahoo_latency), "--jitter", str(args.jitter),
+                   "--rate-limit", str(args.rate_limit)]
+        if args.fixtures:
+            command += ["--fixtures", args.fixtures]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        run = json.loads(output.strip().splitlines()[-1])
+        for result in run["results"]:
+            rows.append([
+                run["positions"], result["phase"], f"{result['seconds'] * 1000:.0f}",
+                ", ".join(f"{name}: {count}" for name, count in sorted(result["calls"].items())) or "-",
+                result["sql"].get("statements", 0), result["sql"].get("connections", 0),
+            ])
+    print(tabulate(rows, headers=["positions", "phase", "ms", "upstream calls", "SQL statements", "connections"]))
+
+
+if __name__ == "__main__":
+    main()
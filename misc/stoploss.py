@@ -1,33 +1,40 @@
+import os
+import sys
 import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 import papishares
+from stops import ProfitTieredStop
 
-def manage_stop_losses():
+def manage_stop_losses(instruments=None):
+    # Shared with the dashboard refresh when run in the same process, and the
+    # bulk /portfolio prices are used instead of one /portfolio/{ticker} call each
     positions = papishares.fetch_positions()
+    positions_fetched_at = papishares.upstream.fetched_at("portfolio") or time.time()
     orders = papishares.fetch_orders()
+    instruments = instruments or papishares.load_instruments()
     stop_orders = [o for o in orders if o.get("type") in ["STOP", "STOP_LIMIT"]]
     adjustments = False
     message = ""
     exceptions = [] #["MU_US_EQ", "WIX_US_EQ", "SCWO_US_EQ", "DMYI_US_EQ", "SNII_US_EQ"] # Micron, Wix, 374Water, IonQ, Rigetti
     default_target_stop_pct = 4
+    policy = ProfitTieredStop(base_pct=default_target_stop_pct, step=10)
 
     for pos in positions:
-        if pos["ticker"] in papishares.TICKERS:
-            ticker = papishares.TICKERS[pos["ticker"]]
-        else:
-            ticker = pos["ticker"]
+        ticker_info = instruments.get(pos["ticker"])
+        ticker = ticker_info.yahoo_symbol if ticker_info is not None else pos["ticker"]
 
-        qty = float(pos["quantity"])
         avg_price = float(pos["averagePrice"])
-        current_price = float(papishares.get_price(pos["ticker"]))
+        current_price = float(papishares.resolve_price(pos, positions_fetched_at)[0])
 
         # Profit %
         profit_pct = ((current_price - avg_price) / avg_price) * 100
 
         # Decide stop distance
-        stop_distance_pct = default_target_stop_pct + int(profit_pct / 10)
+        stop_distance_pct = int(policy.distance_pct(profit_pct))
 
         # Target stop price
-        target_stop = round(current_price * (1 - stop_distance_pct / 100), default_target_stop_pct)
+        target_stop = float(policy.target(current_price, avg_price, current_price))
 
         # Existing stop (if any)
         stop_order = next((o for o in stop_orders if o.get("ticker") == pos["ticker"]), None)
@@ -71,11 +78,9 @@ def manage_stop_losses():
         message += f"P/L: {minus_padding}{profit_pct:.2f}%{padding_profit}SL: {stop_loss_display}{padding_stop}{distance_display}\n"
         message += "- " * 18 + "\n"
 
-        time.sleep(1)  # To avoid hitting rate limits
-
         # Optionally auto-adjust:
         # if needs_adjust:
-        #     result = update_stop_order(ticker, qty, target_stop)
+        #     result = update_stop_order(ticker, float(pos["quantity"]), target_stop)
         #     print("✅ Stop updated:", result)
 
     print(message)
@@ -0,0 +1,165 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_BATCH_WINDOW = float(os.getenv("NOTIFY_BATCH_WINDOW", "2")) # Seconds alerts are gathered into one message
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5")) # Sends of a message before it is dropped
+TELEGRAM_MAX_LENGTH = 4096 # Telegram's limit per message
+
+
+class NotificationQueue:
+    """
+    Outbound message queue drained by a background sender.
+
+    Messages queued within `batch_window` seconds of each other (e.g. the
+    alerts of one refresh) are joined into a single message. The sender goes
+    through the Telegram rate limiter in `send`, and a failed batch is retried
+    up to max_attempts times. Callers never wait for the network.
+
+    Crossover alerts are deduplicated here: the last notified crossover per
+    symbol is loaded from the store and recorded there once it was delivered.
+
+    Parameters:
+    -----------
+    send : callable
+        send(text) -> True once delivered, False to retry later
+    batch_window : float
+        Seconds to wait for more messages before sending
+    """
+
+    def __init__(self, send: Callable[[str], bool], batch_window: float = NOTIFY_BATCH_WINDOW,
+                 max_attempts: int = NOTIFY_MAX_ATTEMPTS):
+        self.send = send
+        self.batch_window = batch_window
+        self.max_attempts = max_attempts
+        self.store = None
+        self._notified: Dict[str, str] = {}
+        self._pending: Dict[str, str] = {}
+        self._queue: "queue.Queue[Tuple[str, Optional[Tuple[str, str]]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"queued": 0, "sent": 0, "messages_sent": 0, "deduplicated": 0, "dropped": 0}
+
+    def use_store(self, store):
+        """
+        Persist crossover notifications in `store` (load_notifications/record_notifications).
+
+        The notified crossovers are (re)loaded from it, call it again whenever
+        this process takes over the notifications from another one.
+        """
+        notified = store.load_notifications()
+        with self._lock:
+            self.store = store
+            self._notified = notified
+
+    def put(self, text: str, dedupe_key: Optional[Tuple[str, str]] = None):
+        self._start()
+        self.stats["queued"] += 1
+        self._queue.put((text, dedupe_key))
+
+    def notify_crossover(self, symbol: str, crossover_type: str, text: str) -> bool:
+        """Queue a crossover alert unless this crossover was already notified (or is on its way)"""
+        with self._lock:
+            if self._notified.get(symbol) == crossover_type or self._pending.get(symbol) == crossover_type:
+                self.stats["deduplicated"] += 1
+                return False
+            self._pending[symbol] = crossover_type
+        self.put(text, (symbol, crossover_type))
+        return True
+
+    @property
+    def backlog(self) -> int:
+        """Messages queued or being sent"""
+        return self._queue.unfinished_tasks
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued message has been handled"""
+        with self._queue.all_tasks_done:
+            return self._queue.all_tasks_done.wait_for(lambda: self._queue.unfinished_tasks == 0, timeout)
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="notifier", daemon=True)
+                    self._thread.start()
+                    # Give scripts a chance to deliver what they queued before exiting
+                    atexit.register(self.drain, 30)
+
+    def _next_batch(self) -> List[Tuple[str, Optional[Tuple[str, str]]]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            for chunk in _chunks(batch):
+                self._deliver(chunk)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _deliver(self, chunk):
+        text = "\n\n".join(message for message, _ in chunk)
+        keys = [key for _, key in chunk if key is not None]
+        for attempt in range(self.max_attempts):
+            if attempt:
+                time.sleep(min(2 ** attempt, 30))
+            try:
+                delivered = self.send(text)
+            except Exception as e:
+                logger.info(f"Sending notification failed: {e}")
+                delivered = False
+            if delivered:
+                self.stats["sent"] += 1
+                self.stats["messages_sent"] += len(chunk)
+                self._record(keys)
+                return
+        self.stats["dropped"] += len(chunk)
+        logger.info(f"Dropped {len(chunk)} notifications after {self.max_attempts} attempts")
+        with self._lock:
+            # Not notified after all, a later refresh may queue them again
+            for symbol, crossover_type in keys:
+                if self._pending.get(symbol) == crossover_type:
+                    del self._pending[symbol]
+
+    def _record(self, keys: List[Tuple[str, str]]):
+        with self._lock:
+            for symbol, crossover_type in keys:
+                self._notified[symbol] = crossover_type
+                if self._pending.get(symbol) == crossover_type:
+                    del self._pending[symbol]
+        if keys and self.store is not None:
+            try:
+                self.store.record_notifications(dict(keys))
+            except Exception as e:
+                logger.info(f"Could not record crossover notifications: {e}")
+        for symbol, crossover_type in keys:
+            logger.info(f"Notification sent and recorded for {symbol} {crossover_type} crossover")
+
+
+def _chunks(batch):
+    """Split a batch so each joined message stays within Telegram's length limit"""
+    chunk, length = [], 0
+    for item in batch:
+        if chunk and length + len(item[0]) + 2 > TELEGRAM_MAX_LENGTH:
+            yield chunk
+            chunk, length = [], 0
+        chunk.append(item)
+        length += len(item[0]) + 2
+    if chunk:
+        yield chunk
@@ -1,6 +1,5 @@
 from dotenv import load_dotenv
 from typing import Dict, Optional, Tuple
-from datetime import date, datetime, timedelta
 import math
 import json
 import logging
@@ -8,8 +7,21 @@ import os
 import pandas as pd
 import requests, time
 import sqlite3
-import yfinance as yf
-from tabulate import tabulate
+from concurrent.futures import ThreadPoolExecutor
+import bars
+import history
+import indicators
+import metrics
+import ratelimit
+import risk
+import t212
+from coalesce import Coalescer
+from feed import FeedCache
+from instruments import InstrumentCache
+from notifier import NotificationQueue
+from portfolio import Portfolio, manual_stop_or_nan
+from repository import get_repository
+from watcher import StopLossWatcher, StopThreshold
 
 load_dotenv()
 
@@ -18,13 +30,18 @@ T212_API_KEY = os.getenv("T212_API_KEY")
 T212_SECRET_KEY = os.getenv("T212_SECRET_KEY")
 TELEGRAM_BOT_TOKEN =os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
 
 RISK_PERCENTAGE = 0.7 # Percentage of account to risk on all positions
 TOTAL_RISK_PERCENTAGE = 7.0 # Total percentage of account to risk across all positions
-
-HEADERS = {
-    "Content-Type": "application/json"
-}
+REFRESH_WORKERS = int(os.getenv("REFRESH_WORKERS", "8")) # Positions enriched concurrently
+PRICE_MAX_AGE = float(os.getenv("PRICE_MAX_AGE", "60")) # Seconds a bulk /portfolio price is trusted for
+INSTRUMENTS_CACHE_PATH = os.getenv("INSTRUMENTS_CACHE_PATH", os.path.join(os.path.dirname(os.getenv("DB_PATH", "./papishares.db")) or ".", "instruments.json"))
+FETCH_CACHE_TTL = float(os.getenv("FETCH_CACHE_TTL", "10")) # Seconds /portfolio, /orders and /account/cash responses are shared between callers
+INSTRUMENTS_MAX_AGE = float(os.getenv("INSTRUMENTS_MAX_AGE", "86400")) # Seconds before the cached instrument list is refreshed
+ENTRIES_URL = os.getenv("ENTRIES_URL", "http://stuff.dabeed.net/suggested_entries.json") # Suggested entries feed shown by /entries
+ENTRIES_CACHE_PATH = os.getenv("ENTRIES_CACHE_PATH", os.path.join(os.path.dirname(os.getenv("DB_PATH", "./papishares.db")) or ".", "entries.json"))
+ENTRIES_MAX_AGE = float(os.getenv("ENTRIES_MAX_AGE", "300")) # Seconds before the cached entries feed is revalidated
 
 logging.basicConfig(
     level=logging.INFO,
@@ -32,7 +49,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-current_prices = {}
+# One pooled keep-alive session for every Trading 212 call of the process
+client = t212.T212Client(T212_API_BASE, T212_API_KEY, T212_SECRET_KEY, pool_size=REFRESH_WORKERS)
+# Concurrent and back-to-back callers (refresh, /orders, scripts) share one request per endpoint
+upstream = Coalescer(ttl=FETCH_CACHE_TTL)
+# Alerts are sent by a background thread, merged per refresh
+telegram_session = requests.Session()
+notifications = NotificationQueue(lambda message: post_telegram_message(message))
+# Auto-sell runs in its own thread against live prices, started by the app
+stop_watcher = StopLossWatcher(
+    lambda: poll_positions(),
+    lambda ticker, quantity: sell(ticker, quantity),
+    lambda message: send_telegram_message(message),
+)
+
+last_portfolio = None # Columnar model of the latest refresh, used for what-if risk recomputation
+price_stats = {"bulk": 0, "fallback": 0} # Cumulative price sources since startup, every bulk hit is a saved round trip
 
 def initialize_database(db):
     logger.info("Initializing database...")
@@ -58,49 +90,56 @@ def initialize_database(db):
             status BOOLEAN
         )
     """)
+    # Leader election between replicas/workers, and the snapshots the leader publishes (shared.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT,
+            expires_at REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shared_state (
+            name TEXT PRIMARY KEY,
+            generation INTEGER,
+            body BLOB
+        )
+    """)
+    # WAL persists in the DB file, the refresh writer no longer blocks readers
+    conn.execute("PRAGMA journal_mode=WAL")
+    # The risk limit alert state used to be kept as a pseudo-symbol among the crossovers, it is a flag now
+    conn.execute("DELETE FROM macd_notifications WHERE symbol = 'TOTAL_RISK'")
     conn.commit()
     conn.close()
 
-def get_db(db):
-    conn = sqlite3.connect(db)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def get_sma(symbol, days=17):
+def get_sma(symbol, days=17, states=None):
     """
     Calculate the Simple Moving Average for a given stock symbol.
-    Fetches data from Yahoo Finance.
+    Reads daily bars from the shared bar store (backed by Yahoo Finance).
 
     Parameters:
     symbol (str): Stock ticker symbol (e.g., 'AAPL', 'MSFT', 'TSLA')
     days (int): Number of days for the SMA calculation (default: 17)
+    states (tuple): (previous, latest) indicator states already computed for the symbol, looked up if omitted
 
     Returns:
     dict: Dictionary containing the SMA value, current price, and date
           Returns None if there's an error or insufficient data
     """
     try:
-        # Create ticker object
-        ticker = yf.Ticker(symbol)
+        if states is None:
+            states = _latest_indicator_states(symbol)
+            if states is None:
+                return None
 
-        # Get enough historical data (fetch 2x the days to account for weekends/holidays)
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days * 2)
+        # SMA from the incremental closes window
+        _, latest = states
+        sma_value = latest.sma(days)
 
-        # Fetch historical data
-        data = ticker.history(start=start_date, end=end_date)
-
-        if len(data) < days:
-            logger.info(f"Insufficient data for {symbol}. Need {days} days, got {len(data)}")
+        if sma_value is None:
+            logger.info(f"Insufficient data for {symbol}. Need {days} days, got {len(latest.closes)}")
             return None
 
-        # Get closing prices
-        prices = data['Close'].tolist()
-
-        # Calculate SMA
-        last_n = prices[-days:]
-        sma_value = sum(last_n) / days
-
         return round(sma_value, 2)
 
     except Exception as e:
@@ -156,7 +195,7 @@ def get_macd_data(
     interval: str = "1d"
 ) -> Optional[pd.DataFrame]:
     """
-    Get price data and calculate MACD using yfinance.
+    Get price data from the shared bar store and calculate MACD.
 
     Parameters:
     -----------
@@ -174,16 +213,14 @@ def get_macd_data(
     """
 
     try:
-        logger.info(f"Fetching data for {symbol}...")
-        ticker = yf.Ticker(symbol)
-        df = ticker.history(period=period, interval=interval)
+        df = bars.store.get(symbol, interval=interval, period=period)
 
-        if df.empty:
+        if df is None or df.empty:
             logger.info(f"❌ No data available for {symbol}")
             return None
 
-        # Calculate MACD
-        df = calculate_macd(df)
+        # Calculate MACD on a copy, the stored bars are shared
+        df = calculate_macd(df.copy())
 
         return df
 
@@ -192,6 +229,21 @@ def get_macd_data(
         return None
 
 
+def _latest_indicator_states(symbol: str):
+    """(previous, latest) incremental indicator states for a symbol, or None if there is no data"""
+    try:
+        df = bars.store.get(symbol)
+    except Exception as e:
+        logger.info(f"❌ Error fetching data for {symbol}: {e}")
+        return None
+
+    if df is None or df.empty:
+        logger.info(f"❌ No data available for {symbol}")
+        return None
+
+    return indicators.engine.update(symbol, df)
+
+
 def get_latest_macd(symbol: str) -> Optional[Tuple[float, float, float, str]]:
     """
     Get the most recent MACD values for a symbol.
@@ -202,23 +254,19 @@ def get_latest_macd(symbol: str) -> Optional[Tuple[float, float, float, str]]:
         (MACD, Signal, Histogram, Date) or None if request fails
     """
 
-    df = get_macd_data(symbol)
+    states = _latest_indicator_states(symbol)
 
-    if df is None or df.empty:
+    if states is None:
         return None
 
     # Get the most recent values
-    latest = df.iloc[-1]
-    latest_date = df.index[-1].strftime('%Y-%m-%d')
+    _, latest = states
+    latest_date = pd.Timestamp(latest.ts).strftime('%Y-%m-%d')
 
-    macd = latest['MACD']
-    signal = latest['Signal']
-    histogram = latest['Histogram']
+    return (latest.macd, latest.signal_line, latest.histogram, latest_date)
 
-    return (macd, signal, histogram, latest_date)
 
-
-def analyze_macd_signal(symbol: str, show_chart: bool = False) -> Optional[str]:
+def analyze_macd_signal(symbol: str, show_chart: bool = False, states=None) -> Optional[str]:
     """
     Analyze MACD and provide trading signal.
 
@@ -228,6 +276,8 @@ def analyze_macd_signal(symbol: str, show_chart: bool = False) -> Optional[str]:
         Ticker symbol
     show_chart : bool
         If True, display recent MACD history
+    states : tuple, optional
+        (previous, latest) indicator states already computed for the symbol, looked up if omitted
 
     Returns:
     --------
@@ -235,23 +285,24 @@ def analyze_macd_signal(symbol: str, show_chart: bool = False) -> Optional[str]:
         Trading signal: 'BULLISH', 'BEARISH', or 'NEUTRAL'
     """
 
-    df = get_macd_data(symbol)
+    if states is None:
+        states = _latest_indicator_states(symbol)
 
-    if df is None or df.empty:
+    if states is None:
         return None
 
-    # Get latest values
-    latest = df.iloc[-1]
-    macd = latest['MACD']
-    signal = latest['Signal']
-    histogram = latest['Histogram']
-    date = df.index[-1].strftime('%Y-%m-%d %H:%M:%S')
+    # Get latest values from the incremental state, no DataFrame rebuild needed
+    prev, latest = states
+    macd = latest.macd
+    signal = latest.signal_line
+    histogram = latest.histogram
+    date = pd.Timestamp(latest.ts).strftime('%Y-%m-%d %H:%M:%S')
 
     logger.info(f"{'='*60}")
     logger.info(f"{symbol} - MACD Analysis")
     logger.info(f"{'='*60}")
     logger.info(f"Date: {date}")
-    logger.info(f"Current Price: {latest['Close']:.2f}")
+    logger.info(f"Current Price: {latest.close:.2f}")
     logger.info(f"MACD: {macd:.4f}")
     logger.info(f"Signal: {signal:.4f}")
     logger.info(f"Histogram: {histogram:.4f}")
@@ -269,10 +320,9 @@ def analyze_macd_signal(symbol: str, show_chart: bool = False) -> Optional[str]:
 
     # Check for crossovers
     crossover = None
-    if len(df) >= 2:
-        prev = df.iloc[-2]
-        prev_macd = prev['MACD']
-        prev_signal = prev['Signal']
+    if prev is not None:
+        prev_macd = prev.macd
+        prev_signal = prev.signal_line
 
         # Bullish crossover
         if prev_macd <= prev_signal and macd > signal:
@@ -286,10 +336,12 @@ def analyze_macd_signal(symbol: str, show_chart: bool = False) -> Optional[str]:
 
     # Show recent history if requested
     if show_chart:
-        logger.info(f"📊 Recent MACD History (Last 10 periods):")
+        logger.info("📊 Recent MACD History (Last 10 periods):")
         logger.info("-" * 60)
-        recent = df[['Close', 'MACD', 'Signal', 'Histogram']].tail(10)
-        logger.info(recent.to_string())
+        df = get_macd_data(symbol)
+        if df is not None:
+            recent = df[['Close', 'MACD', 'Signal', 'Histogram']].tail(10)
+            logger.info(recent.to_string())
 
     return signal_type, crossover
 
@@ -298,12 +350,15 @@ def analyze_multiple_symbols(symbols: list, delay: float = 0) -> Dict[str, Dict]
     """
     Analyze MACD for multiple symbols.
 
+    Bars for all symbols are fetched in one batch and MACD is computed over a
+    column-per-symbol frame in one vectorized pass.
+
     Parameters:
     -----------
     symbols : list
         List of ticker symbols
     delay : float
-        Delay between requests in seconds (0 = no delay with yfinance)
+        Unused, kept for compatibility (downloads are batched and rate limited)
 
     Returns:
     --------
@@ -311,251 +366,96 @@ def analyze_multiple_symbols(symbols: list, delay: float = 0) -> Dict[str, Dict]
         Dictionary with symbol as key and MACD data as value
     """
 
-    import time
-
     results = {}
 
     logger.info(f"{'='*60}")
     logger.info(f"Analyzing {len(symbols)} symbols")
     logger.info(f"{'='*60}")
 
-    for symbol in symbols:
-        result = get_latest_macd(symbol)
-
-        if result:
-            macd, signal, histogram, date = result
-            trend = "BULLISH 📈" if histogram > 0 else "BEARISH 📉"
+    closes = bars.store.close_frame(symbols)
+    macd_data = indicators.macd_frame(closes) if not closes.empty else None
 
-            results[symbol] = {
-                'macd': macd,
-                'signal': signal,
-                'histogram': histogram,
-                'date': date,
-                'trend': trend
-            }
-
-            logger.info(f"{symbol:15} | MACD: {macd:8.4f} | Signal: {signal:8.4f} | Hist: {histogram:8.4f} | {trend}")
-        else:
+    for symbol in symbols:
+        if macd_data is None or symbol not in closes or closes[symbol].last_valid_index() is None:
             logger.info(f"{symbol:15} | ❌ No data available")
             results[symbol] = None
+            continue
 
-        if delay > 0:
-            time.sleep(delay)
-
-    return results
-
-def has_crossover_been_notified(db, symbol, crossover_type):
-    """Check if we've already notified about this crossover"""
-    conn = sqlite3.connect(db)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT last_crossover_type, last_notified_time
-        FROM macd_notifications
-        WHERE symbol = ?
-    """, (symbol,))
-
-    result = cursor.fetchone()
-    conn.close()
-
-    if result is None:
-        return False
-
-    last_type, last_time = result
-    return last_type == crossover_type
-
-def record_crossover_notification(db, symbol, crossover_type):
-    """Record that we've notified about this crossover"""
-    conn = sqlite3.connect(db)
-    cursor = conn.cursor()
-
-    now = datetime.now().isoformat()
-
-    cursor.execute("""
-        INSERT INTO macd_notifications (symbol, last_crossover_type, last_crossover_time, last_notified_time)
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(symbol) DO UPDATE SET
-            last_crossover_type = excluded.last_crossover_type,
-            last_crossover_time = excluded.last_crossover_time,
-            last_notified_time = excluded.last_notified_time
-    """, (symbol, crossover_type, now, now))
-
-    conn.commit()
-    conn.close()
+        last = closes[symbol].last_valid_index()
+        macd = macd_data["MACD"].at[last, symbol]
+        signal = macd_data["Signal"].at[last, symbol]
+        histogram = macd_data["Histogram"].at[last, symbol]
+        date = bars.store.get(symbol).index[-1].strftime('%Y-%m-%d')
+        trend = "BULLISH 📈" if histogram > 0 else "BEARISH 📉"
 
-def update_max_price(ticker, price, db):
-    conn = get_db(db)
-    c = conn.cursor()
+        results[symbol] = {
+            'macd': macd,
+            'signal': signal,
+            'histogram': histogram,
+            'date': date,
+            'trend': trend
+        }
 
-    c.execute("SELECT stop_loss FROM positions WHERE ticker=?", (ticker,))
-    row = c.fetchone()
+        logger.info(f"{symbol:15} | MACD: {macd:8.4f} | Signal: {signal:8.4f} | Hist: {histogram:8.4f} | {trend}")
 
-    if row is None:
-        c.execute("INSERT INTO positions (ticker, max_price) VALUES (?, ?)",
-                  (ticker, price))
-    else:
-        c.execute("UPDATE positions SET max_price=? WHERE ticker=?",
-                  (price, ticker))
-
-    conn.commit()
-    conn.close()
+    return results
 
 def update_flag(flag, db):
-    conn = get_db(db)
-    c = conn.cursor()
-
-    c.execute("SELECT status FROM flags WHERE flag=?", (flag,))
-    row = c.fetchone()
-
-    if row is None:
-        c.execute("INSERT INTO flags (flag, status) VALUES (?, ?)",
-                  (flag, 'False'))
-    else:
-        current_status = row[0]
-        new_status = not current_status
-        c.execute("UPDATE flags SET status=? WHERE flag=?",
-                  (new_status, flag))
-
-    conn.commit()
-    conn.close()
+    get_repository(db).toggle_flag(flag)
 
 def get_flag(flag, db, default=False):
-    conn = get_db(db)
-    c = conn.cursor()
-    c.execute("SELECT status FROM flags WHERE flag=?", (flag,))
-    row = c.fetchone()
-    conn.close()
-
-    if row is None:
-        return default
-
-    return row[0]
-
-def update_stop_loss(ticker, stop_loss_price, db):
-    conn = get_db(db)
-    c = conn.cursor()
-
-    c.execute("SELECT stop_loss FROM positions WHERE ticker=?", (ticker,))
-    row = c.fetchone()
+    return get_repository(db).get_flag(flag, default)
 
-    if row is None:
-        c.execute("INSERT INTO positions (ticker, stop_loss) VALUES (?, ?)",
-                  (ticker, stop_loss_price))
-    else:
-        c.execute("UPDATE positions SET stop_loss=? WHERE ticker=?",
-                  (stop_loss_price, ticker))
-
-    conn.commit()
-    conn.close()
-
-def cleanup_stale_notifications(db, active_tickers):
-    """Remove notification records for tickers not in current positions"""
-    conn = sqlite3.connect(db)
-    cursor = conn.cursor()
-
-    # Get all tickers currently in the database
-    cursor.execute("SELECT DISTINCT ticker FROM positions")
-    db_tickers = {row[0] for row in cursor.fetchall()}
-
-    # Find tickers to remove (in DB but not in active positions)
-    stale_tickers = db_tickers - set(active_tickers)
-
-    if stale_tickers:
-        # Delete stale entries
-        placeholders = ','.join('?' * len(stale_tickers))
-        cursor.execute(f"DELETE FROM positions WHERE ticker IN ({placeholders})",
-                      tuple(stale_tickers))
-        deleted_count = cursor.rowcount
-        conn.commit()
-        logger.info(f"Cleaned up {deleted_count} stale notification records for tickers: {stale_tickers}")
-    else:
-        logger.info("No stale notification records to clean up")
-
-    conn.close()
-
-def get_stop_loss(ticker, db):
-    conn = get_db(db)
-    c = conn.cursor()
-
-    c.execute("SELECT stop_loss FROM positions WHERE ticker=?", (ticker,))
-    row = c.fetchone()
-
-    conn.close()
-
-    if row is None:
-        return None
-    else:
-        return row[0]
-
-def get_max_price(ticker, db):
-    conn = get_db(db)
-    c = conn.cursor()
-
-    c.execute("SELECT max_price FROM positions WHERE ticker=?", (ticker,))
-    row = c.fetchone()
+def fetch_all_tickers_info():
+    return client.instruments().json()
 
-    conn.close()
+def fetch_instruments(etag=None):
+    """
+    Conditionally fetch the instrument list.
 
-    if row is None:
-        return None
-    else:
-        return row[0]
+    Returns:
+    --------
+    tuple
+        (instruments or None if unchanged since `etag`, new ETag)
+    """
+    resp = client.instruments(etag)
+    if resp.status_code == 304:
+        return None, etag
+    return resp.json(), resp.headers.get("ETag")
 
-def fetch_all_tickers_info():
-    url = f"{T212_API_BASE}/metadata/instruments"
-    resp = requests.get(url, headers=HEADERS, auth=(T212_API_KEY,T212_SECRET_KEY))
-    resp.raise_for_status()
-    return resp.json()
+def load_instruments():
+    """Instrument metadata index, served from the on-disk cache and refreshed in the background"""
+    return InstrumentCache(fetch_instruments, INSTRUMENTS_CACHE_PATH, max_age=INSTRUMENTS_MAX_AGE)
 
 def get_account_value():
-    url = f"{T212_API_BASE}/account/cash"
-    resp = requests.get(url, headers=HEADERS, auth=(T212_API_KEY,T212_SECRET_KEY))
-    resp.raise_for_status()
-    return resp.json()
+    return upstream.get("cash", client.cash)
 
 def fetch_positions():
-    """Fetch all current equity positions"""
-    url = f"{T212_API_BASE}/portfolio"
-    while True:
-        try:
-            resp = requests.get(url, headers=HEADERS, auth=(T212_API_KEY,T212_SECRET_KEY))
-            resp.raise_for_status()
-            return resp.json()
-        except requests.exceptions.HTTPError as e:
-            if resp.status_code == 429:  # Too Many Requests
-                logger.info("Rate limit hit. Retrying after a short delay...")
-                time.sleep(1)  # Wait before retrying
-            else:
-                raise e
+    """Fetch all current equity positions (429s are retried by the client)"""
+    return upstream.get("portfolio", client.portfolio)
+
+def poll_positions():
+    """Fresh /portfolio for the stop-loss watcher, still shared with anyone fetching at the same moment"""
+    return upstream.get("portfolio", client.portfolio, max_age=0)
 
 def fetch_orders():
-    """Fetch the latest market price for a given ticker"""
-    url = f"{T212_API_BASE}/orders"
-    resp = requests.get(url, headers=HEADERS, auth=(T212_API_KEY,T212_SECRET_KEY))
-    resp.raise_for_status()
-    return resp.json()
+    """Fetch all pending orders"""
+    return upstream.get("orders", client.orders)
 
 def get_price(ticker: str):
     """Fetch the latest market price for a given ticker"""
-    url = f"{T212_API_BASE}/portfolio/{ticker}"
-    resp = requests.get(url, headers=HEADERS, auth=(T212_API_KEY,T212_SECRET_KEY))
-    resp.raise_for_status()
-    return resp.json()["currentPrice"]
+    return client.position(ticker)["currentPrice"]
 
 def sell(ticker, quantity):
-    url = f"{T212_API_BASE}/orders/market"
-    payload = {
-        "quantity": -quantity,
-        "ticker": ticker
-    }
     logger.info(f"Selling {quantity} x {ticker}")
-    resp = requests.post(url, json=payload, headers=HEADERS, auth=(T212_API_KEY,T212_SECRET_KEY))
-    data = resp.json()
+    data = client.market_order(ticker, -quantity)
+    upstream.invalidate("portfolio", "orders", "cash")
     logger.info(data)
     return data
 
-def send_telegram_message(message):
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+def post_telegram_message(message):
+    """Send one message right away, returns whether Telegram accepted it"""
+    url = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
 
     payload = {
         "chat_id": TELEGRAM_CHAT_ID,
@@ -563,154 +463,252 @@ def send_telegram_message(message):
         "parse_mode": "HTML"
     }
 
-    response = requests.post(url, data=payload)
+    ratelimit.TELEGRAM.acquire()
+    with metrics.upstream_call("telegram", "sendMessage") as call:
+        response = telegram_session.post(url, data=payload, timeout=10)
+        call["status"] = str(response.status_code)
 
     if response.status_code == 200:
         logger.info("Message sent successfully!")
+        return True
+    if response.status_code == 429:
+        retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+        ratelimit.TELEGRAM.penalize(float(retry_after))
+    logger.info(f"Failed to send message: {response.text}")
+    return False
+
+def send_telegram_message(message):
+    """Queue a message for the background sender, never blocks on Telegram"""
+    notifications.put(message)
+
+def resolve_price(pos, fetched_at, max_age=PRICE_MAX_AGE):
+    """
+    Current price for a /portfolio entry.
+
+    Uses the currentPrice already present in the bulk payload and only falls back
+    to a per-ticker request when it is missing or the payload is older than max_age.
+
+    Returns:
+    --------
+    tuple
+        (price, source) where source is 'bulk' or 'fallback'
+    """
+    price = pos.get("currentPrice")
+    if price is not None and price > 0 and time.time() - fetched_at <= max_age:
+        return price, "bulk"
+    return get_price(pos["ticker"]), "fallback"
+
+def _enrich_position(pos, fetched_at, ticker_info, stop_orders, state):
+    """Per-position data that needs I/O (price, max price, indicators), returns (position_dict, price source)"""
+    position_dict = {}
+
+    # Basic data update from current positions
+    position_dict["ticker"] = ticker_info.ticker
+    position_dict["short_name"] = ticker_info.yahoo_symbol # Includes the .L suffix for London listings
+    position_dict["name"] = ticker_info.name
+    position_dict["currency"] = ticker_info.currency_code
+
+    position_dict["quantity"] = pos["quantity"]
+    position_dict["average_price"] = round(pos["averagePrice"], 2)
+    position_dict["current_price"], price_source = resolve_price(pos, fetched_at)
+
+    # Raise the max price if needed (written at the end of the refresh)
+    position_dict["max_price"] = state.raise_max_price(position_dict["ticker"], position_dict["current_price"])
+
+    # Check if a manual stop loss has been set
+    stop_order = next((o for o in stop_orders if o.get("ticker") == pos["ticker"]), None)
+    # logger.info(f"Checking manual stop loss for {position_dict['ticker']}: {stop_order}")
+    position_dict["manual_stop_loss_price"] = float(stop_order["stopPrice"]) if stop_order is not None else None
+    position_dict["manual_stop_loss_quantity"] = stop_order["quantity"] if stop_order is not None else 0
+
+    # Check MACD (the indicator states are computed once and shared with the SMA below)
+    indicators_started = time.perf_counter()
+    states = _latest_indicator_states(position_dict["short_name"])
+    signal_type, crossover = analyze_macd_signal(position_dict["short_name"], states=states)
+    # logger.info(f"Analyzing {position_dict['short_name']} ({position_dict['name']}): {signal_type} / {crossover}")
+    position_dict["macd_signal"] = signal_type
+    position_dict["macd_crossover"] = crossover
+    # logger.info(f"Signal type: {signal_type}")
+
+    if crossover is not None:
+        symbol = position_dict["short_name"]
+        if notifications.notify_crossover(
+            symbol, crossover, f"🚨 {position_dict['short_name']} ({position_dict['name']}) MACD {crossover} crossover!"
+        ):
+            logger.info(f"Notification queued for {symbol} {crossover} crossover")
+        else:
+            logger.info(f"Already notified about {symbol} {crossover} crossover, skipping")
+
+    # Check SMA (17)
+    sma_value = get_sma(position_dict['short_name'], days=17, states=states)
+    position_dict['sma_17'] = sma_value if (sma_value is not None and not math.isnan(sma_value)) else 0.0
+    metrics.INDICATOR_SECONDS.observe(time.perf_counter() - indicators_started)
+    logger.info(f"SMA(17) for {position_dict['short_name']}: {position_dict['sma_17']}")
+
+    return position_dict, price_source
+
+def _notify_risk_limit(risk_report, state, repository):
+    """Alert when total risk goes over the limit, and when it is back within it after having been over"""
+    # The last state is kept in the flags table, so a restart doesn't repeat the alert
+    over_limit = risk_report["over_limit"]
+    if over_limit == bool(state.get_flag("risk_over_limit")):
+        return
+    repository.set_flag("risk_over_limit", over_limit)
+    if over_limit:
+        notifications.put(
+            f"⚠️ Total risk {risk_report['total_risk']:.2f}% is over the {risk_report['limit']:.1f}% limit "
+            f"(correlation-adjusted {risk_report['correlated_risk']:.2f}%)"
+        )
     else:
-        logger.info("Failed to send message:", response.text)
+        notifications.put(f"✅ Total risk {risk_report['total_risk']:.2f}% is back within the {risk_report['limit']:.1f}% limit")
+
+def build_portfolio(all_positions, raw_average_prices, total_capital):
+    """Columnar model of the enriched positions"""
+    return Portfolio(
+        tickers=[p["ticker"] for p in all_positions],
+        currencies=[p["currency"] for p in all_positions],
+        quantity=[p["quantity"] for p in all_positions],
+        average_price=[p["average_price"] for p in all_positions],
+        raw_average_price=raw_average_prices,
+        current_price=[p["current_price"] for p in all_positions],
+        max_price=[p["max_price"] for p in all_positions],
+        manual_stop=[manual_stop_or_nan(p["manual_stop_loss_price"]) for p in all_positions],
+        total_capital=total_capital,
+    )
+
+def get_current_positions(db, instruments, risk_percentage = RISK_PERCENTAGE):
+    global last_portfolio
 
-def get_current_positions(db, all_tickers, risk_percentage = RISK_PERCENTAGE):
     result = {} # Full result dict to return, including positions and total risk
-    total_risk = 0.0
     all_positions = []
+    refresh_price_stats = {"bulk": 0, "fallback": 0}
 
-    positions = fetch_positions()
-    orders = fetch_orders()
-    stop_orders = [o for o in orders if o.get("type") in ["STOP", "STOP_LIMIT"]]
-
-    total_capital = get_account_value()["total"]
-    total_risk_per_trade = total_capital * risk_percentage / 100    # 0.07% of account value
-
-    for pos in positions:
-        position_dict = {}
+    # Each stage is timed into papishares_refresh_stage_seconds
+    stage = metrics.REFRESH_STAGE_SECONDS.time
 
-        ticker_info = next((item for item in all_tickers if item['ticker'] == pos['ticker']), None)
+    # All DB rows needed by the refresh in one read, changes are written in one transaction at the end
+    with stage(stage="db_load"):
+        repository = get_repository(db)
+        state = repository.load_state()
+        if notifications.store is not repository:
+            notifications.use_store(repository)
+    auto_sell = state.get_flag("auto_sell")
 
-        # Basic data update from current positions
-        position_dict["ticker"] = ticker_info['ticker']
-        position_dict["short_name"] = ticker_info['shortName']
-        position_dict["name"] = ticker_info['name']
-        position_dict["currency"] = ticker_info["currencyCode"]
+    with stage(stage="fetch"):
+        positions = fetch_positions()
+        positions_fetched_at = upstream.fetched_at("portfolio") or time.time()
+        orders = fetch_orders()
+        stop_orders = [o for o in orders if o.get("type") in ["STOP", "STOP_LIMIT"]]
 
-        if ticker_info["currencyCode"] == "GBX" or ticker_info["currencyCode"] == "GBP" or ticker_info["shortName"] in ["3CFL", "COFF", "COCO"]: # Coffee/Cocoa is in USD but listed in London
-            position_dict["short_name"] += ".L"
+        total_capital = get_account_value()["total"]
 
-        position_dict["quantity"] = pos["quantity"]
-        position_dict["average_price"] = round(pos["averagePrice"], 2)
-        position_dict["current_price"] = get_price(ticker_info["ticker"])
-        position_dict["profit_pct"] = round(((position_dict["current_price"] - pos["averagePrice"]) / pos["averagePrice"]) * 100, 2)
+    ticker_infos = [instruments.get(pos['ticker']) for pos in positions]
 
-        # Get the max price and update the DB if needed
-        max_price = get_max_price(position_dict["ticker"], db)
+    # Refresh the daily bars of the whole portfolio in one batch before the per-position work
+    try:
+        with stage(stage="bars"):
+            bars.store.prefetch([ticker_info.yahoo_symbol for ticker_info in ticker_infos])
+    except Exception as e:
+        logger.info(f"Batch bar prefetch failed, falling back to per-symbol downloads: {e}")
 
-        if max_price is None or max_price < position_dict["current_price"]:
-            update_max_price(position_dict["ticker"], position_dict["current_price"], db)
-            position_dict["max_price"] = position_dict["current_price"]
-        else:
-            position_dict["max_price"] = max_price
+    try:
+        # Enrich positions concurrently, upstream calls are paced by the shared rate limiters
+        with stage(stage="enrich"), ThreadPoolExecutor(max_workers=REFRESH_WORKERS) as executor:
+            futures = [
+                executor.submit(_enrich_position, pos, positions_fetched_at, ticker_info, stop_orders, state)
+                for pos, ticker_info in zip(positions, ticker_infos)
+            ]
+            for future in futures:
+                position_dict, price_source = future.result()
+                all_positions.append(position_dict)
+                refresh_price_stats[price_source] += 1
+
+        for source, count in refresh_price_stats.items():
+            price_stats[source] += count
+
+        # Profit, stop losses and risk for all positions in one vectorized pass
+        with stage(stage="compute"):
+            model = build_portfolio(all_positions, [pos["averagePrice"] for pos in positions], total_capital)
+            computed = model.compute(risk_percentage)
+        for i, position_dict in enumerate(all_positions):
+            position_dict["profit_pct"] = float(model.profit_pct[i])
+            position_dict["stop_loss_price"] = float(computed["stop_loss_price"][i])
+            position_dict["stop_loss_percentage"] = float(computed["stop_loss_percentage"][i])
+            logger.info(f"Risk for {position_dict['ticker']}: {computed['position_risk'][i]:.2f}")
+        last_portfolio = model
+
+        # Exposure per currency and sector and correlation-adjusted risk, against TOTAL_RISK_PERCENTAGE
+        with stage(stage="risk"):
+            risk_report = risk.engine.breakdown(
+                model, [position_dict["short_name"] for position_dict in all_positions],
+                computed["position_risk"], TOTAL_RISK_PERCENTAGE,
+            )
+        _notify_risk_limit(risk_report, state, repository)
+
+        # Hand the new stops to the watcher, which checks them against live prices between refreshes
+        stop_watcher.auto_sell = auto_sell
+        stop_watcher.update_thresholds(
+            StopThreshold(
+                ticker=position_dict["ticker"],
+                short_name=position_dict["short_name"],
+                name=position_dict["name"],
+                quantity=position_dict["quantity"],
+                average_price=position_dict["average_price"],
+                raw_average_price=pos["averagePrice"],
+                max_price=position_dict["max_price"],
+                risk_per_share=float(computed["risk_per_share"][i]),
+            )
+            for i, (position_dict, pos) in enumerate(zip(all_positions, positions))
+        )
 
-        # Calculate the stop loss and update the DB if needed
-        position_value = position_dict["quantity"] * position_dict["average_price"]
-        stop_loss_caculating_price = max(position_dict["average_price"], position_dict["max_price"])
+        # Record the computed stop losses (selling is left to the stop-loss watcher)
+        for position_dict in all_positions:
+            state.update_stop_loss(position_dict["ticker"], position_dict["stop_loss_price"])
 
-        if ticker_info["currencyCode"] == "GBX":
-            position_value /= 100
-            risk_for_calculation = total_risk_per_trade * 100
-        else:
-            risk_for_calculation = total_risk_per_trade
-
-        position_dict["stop_loss_price"] = round(stop_loss_caculating_price - (risk_for_calculation / position_dict["quantity"]), 2)
-        position_dict["stop_loss_percentage"] = round(((stop_loss_caculating_price - position_dict["stop_loss_price"]) / stop_loss_caculating_price) * 100, 2)
-        update_stop_loss(position_dict["ticker"], position_dict["stop_loss_price"], db)
-
-        # Check if a manual stop loss has been set
-        stop_order = next((o for o in stop_orders if o.get("ticker") == pos["ticker"]), None)
-        # logger.info(f"Checking manual stop loss for {position_dict['ticker']}: {stop_order}")
-        position_dict["manual_stop_loss_price"] = float(stop_order["stopPrice"]) if stop_order is not None else None
-        position_dict["manual_stop_loss_quantity"] = stop_order["quantity"] if stop_order is not None else 0
-
-        # Calculate total risk
-        stop_loss_price = position_dict["manual_stop_loss_price"] if position_dict["manual_stop_loss_price"] is not None else position_dict["stop_loss_price"]
-        if position_dict["average_price"] > stop_loss_price:
-            risk_percentage = (position_dict["average_price"] - stop_loss_price) / position_dict["average_price"]
-            logger.info(f"Risk percentage for {position_dict['ticker']}: {risk_percentage*100:.2f}%")
-        else:
-            risk_percentage = 0.0
-        total_risk += risk_percentage * position_value
-
-        # Check MACD
-        signal_type, crossover = analyze_macd_signal(position_dict["short_name"])
-        # logger.info(f"Analyzing {position_dict['short_name']} ({position_dict['name']}): {signal_type} / {crossover}")
-        position_dict["macd_signal"] = signal_type
-        position_dict["macd_crossover"] = crossover
-        # logger.info(f"Signal type: {signal_type}")
-
-        if crossover is not None:
-            symbol = position_dict["short_name"]
-            if not has_crossover_been_notified(db, symbol, crossover):
-                send_telegram_message(
-                    f"🚨 {position_dict['short_name']} ({position_dict['name']}) MACD {crossover} crossover!"
-                )
-                record_crossover_notification(db, symbol, crossover)
-                logger.info(f"Notification sent and recorded for {symbol} {crossover} crossover")
-            else:
-                logger.info(f"Already notified about {symbol} {crossover} crossover, skipping")
-
-        # Check SMA (17)
-        sma_value = get_sma(position_dict['short_name'], days=17)
-        position_dict['sma_17'] = sma_value if (sma_value is not None and not math.isnan(sma_value)) else 0.0
-        logger.info(f"SMA(17) for {position_dict['short_name']}: {position_dict['sma_17']}")
-
-        # Check if stop loss has been reached, then if auto_sell is enabled, sell at market and send a message (only weekdays)
-        if get_flag("auto_sell", db) and position_dict["stop_loss_price"] >= position_dict["current_price"] and date.today().weekday() < 5:
-            # Attempt to sell - It will only sell if there are no stop losses already set
-            # and the error code will be 'SellingEquityNotOwned'
-
-            rc = sell(position_dict['ticker'], position_dict['quantity'])
-
-            if "type" in rc and rc["type"] == "/api-errors/selling-equity-not-owned":
-                logger.info(f"Could not sell {position_dict['ticker']}, probably because there is a stop loss in place")
-            else:
-                message =  f"Stop loss activated for {position_dict['short_name']} - {position_dict['name']}.\n"
-                message += f"Purchased price: {position_dict['average_price']}\n"
-                message += f"Current price: {position_dict['current_price']}\n"
-                message += f"Max price: {position_dict['max_price']}\n"
-                message += f"Stop loss price: {position_dict['stop_loss_price']}\n"
-                message += f"P/L: {position_dict['profit_pct']}%\n"
-                send_telegram_message(message)
-
-        all_positions.append(position_dict)
-        time.sleep(1)  # To avoid hitting rate limits
-
-    # Clean up old symbols from DB
-    active_tickers = [position_dict['ticker'] for position_dict in all_positions]
-    cleanup_stale_notifications(db, active_tickers)
+        # Clean up old symbols from DB
+        state.cleanup_stale(position_dict['ticker'] for position_dict in all_positions)
+    finally:
+        # Also keeps new max prices and sent crossover notifications when the refresh fails
+        with stage(stage="db_commit"):
+            repository.commit(state)
 
     # Build json
     result = {
         "positions": sorted(all_positions, key=lambda order: order['profit_pct'], reverse=True),
-        "total_risk": total_risk / total_capital * 100,
-        "auto_sell": get_flag("auto_sell", db)
+        "total_risk": float(computed["total_risk"]),
+        "risk_limit": TOTAL_RISK_PERCENTAGE,
+        "risk": risk_report,
+        "auto_sell": auto_sell,
+        "price_calls_saved": refresh_price_stats["bulk"],
+        "price_fallbacks": refresh_price_stats["fallback"],
+        # Served by /orders from the snapshot, so no worker fetches /orders on its own
+        "orders": get_pending_orders(instruments, orders),
     }
 
-    # logger.info(tabulate(result['positions'], headers='keys', tablefmt='simple'))
+    # Keep the snapshot in the on-disk history, losing one must not fail the refresh
+    try:
+        with stage(stage="history"):
+            history.store.append(result, total_capital)
+    except Exception as e:
+        logger.info(f"Could not append snapshot to history: {e}")
+
     # logger.info(f"Total Risk: {result['total_risk']:.2f}% of account value")
-    logger.info(json.dumps(result, indent=4))
+    logger.debug(json.dumps(result, indent=4))
 
     return result
 
-def get_pending_orders(all_tickers):
+def get_pending_orders(instruments, all_orders=None):
     orders = []
-    pending_orders = [o for o in fetch_orders() if o.get("type") in ["LIMIT", "MARKET"]]
+    all_orders = fetch_orders() if all_orders is None else all_orders
+    pending_orders = [o for o in all_orders if o.get("type") in ["LIMIT", "MARKET"]]
     for order in pending_orders:
         order_dict = {}
-        ticker_info = next((item for item in all_tickers if item['ticker'] == order['ticker']), None)
+        ticker_info = instruments.get(order['ticker'])
 
-        order_dict["name"] = ticker_info["name"]
-        order_dict["ticker"] = ticker_info["shortName"]
+        order_dict["name"] = ticker_info.name
+        order_dict["ticker"] = ticker_info.short_name
 
-        if ticker_info["currencyCode"] == "USD":
+        if ticker_info.currency_code == "USD":
             order_dict["currency"] = "💵"
         else:
             order_dict["currency"] = "💷"
@@ -723,23 +721,36 @@ def get_pending_orders(all_tickers):
         order_dict["quantity"] = order["quantity"]
         orders.append(order_dict)
 
-        time.sleep(1)  # To avoid hitting rate limits
-
     return orders
 
-def get_last_entries():
-    json_url = 'http://stuff.dabeed.net/suggested_entries.json'
+def fetch_entries(etag=None, last_modified=None):
+    """
+    Conditional GET of the suggested entries feed.
 
-    try:
-        response = requests.get(json_url, timeout=10)
-        response.raise_for_status()
-
-        # Parse JSON
-        data = response.json()
-        return data
-    except requests.exceptions.RequestException as e:
-        return f"Error fetching data from URL: {str(e)}"
-    except json.JSONDecodeError as e:
-        return f"Error parsing JSON: {str(e)}"
-    except Exception as e:
-        return f"Unexpected error: {str(e)}"
+    Returns:
+    --------
+    tuple
+        (entries or None if unchanged, ETag, Last-Modified)
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    with metrics.upstream_call("entries", "suggested_entries") as call:
+        response = requests.get(ENTRIES_URL, headers=headers, timeout=10)
+        call["status"] = response.status_code
+    if response.status_code == 304:
+        return None, etag, last_modified
+    response.raise_for_status()
+    return response.json(), response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+# Served from memory (and a file next to the DB across restarts), revalidated in the background
+entries_feed = FeedCache(fetch_entries, ENTRIES_CACHE_PATH, max_age=ENTRIES_MAX_AGE)
+
+def get_last_entries():
+    """Latest suggested entries and their version, or an error message if the feed was never fetched"""
+    data, version = entries_feed.get()
+    if data is None:
+        return f"Error fetching data from URL: {entries_feed.error}", None
+    return data, version
@@ -0,0 +1,150 @@
+from typing import Dict, List, Optional
+import numpy as np
+from stops import RiskBudgetTrailingStop, round_to
+
+
+def round2(values) -> np.ndarray:
+    """Round to 2 decimals like Python's round() (see stops.round_to)"""
+    return round_to(values, 2)
+
+
+class Portfolio:
+    """
+    Columnar portfolio model: one NumPy array per field, one entry per position.
+
+    Holds only what is needed to recompute profit, stop losses and risk, so
+    what-if scenarios (e.g. a different risk percentage) need no network calls.
+
+    Parameters:
+    -----------
+    tickers : list
+        Trading 212 tickers
+    currencies : list
+        Instrument currency codes (GBX prices are in pence)
+    quantity, average_price, raw_average_price, current_price, max_price : array-like
+        Per position values, average_price rounded to 2 decimals as shown on the dashboard
+    manual_stop : array-like
+        Manual stop order price or NaN when there is none
+    total_capital : float
+        Account value used as the risk budget base
+    """
+
+    def __init__(self, tickers: List[str], currencies: List[str], quantity, average_price, raw_average_price,
+                 current_price, max_price, manual_stop, total_capital: float):
+        self.tickers = list(tickers)
+        self.currencies = list(currencies)
+        self.quantity = np.asarray(quantity, dtype=float)
+        self.average_price = np.asarray(average_price, dtype=float)
+        self.raw_average_price = np.asarray(raw_average_price, dtype=float)
+        self.current_price = np.asarray(current_price, dtype=float)
+        self.max_price = np.asarray(max_price, dtype=float)
+        self.manual_stop = np.asarray(manual_stop, dtype=float)
+        self.total_capital = float(total_capital)
+        self.is_gbx = np.array([currency == "GBX" for currency in self.currencies], dtype=bool)
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def to_json(self) -> dict:
+        """Constructor arguments as plain lists (manual stops may be NaN)"""
+        return {
+            "tickers": self.tickers,
+            "currencies": self.currencies,
+            "quantity": self.quantity.tolist(),
+            "average_price": self.average_price.tolist(),
+            "raw_average_price": self.raw_average_price.tolist(),
+            "current_price": self.current_price.tolist(),
+            "max_price": self.max_price.tolist(),
+            "manual_stop": self.manual_stop.tolist(),
+            "total_capital": self.total_capital,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Portfolio":
+        return cls(**data)
+
+    @property
+    def profit_pct(self) -> np.ndarray:
+        return round2((self.current_price - self.raw_average_price) / self.raw_average_price * 100)
+
+    @property
+    def position_value(self) -> np.ndarray:
+        """Position cost in pounds/dollars (GBX converted from pence)"""
+        return np.where(self.is_gbx, self.quantity * self.average_price / 100, self.quantity * self.average_price)
+
+    @property
+    def market_value(self) -> np.ndarray:
+        """Position value at the current price in pounds/dollars"""
+        return np.where(self.is_gbx, self.quantity * self.current_price / 100, self.quantity * self.current_price)
+
+    def compute(self, risk_percentage) -> Dict[str, np.ndarray]:
+        """
+        Stop losses and risk for one or more risk percentages at once.
+
+        Parameters:
+        -----------
+        risk_percentage : float or array-like
+            Percentage of the account to risk per position
+
+        Returns:
+        --------
+        dict
+            'stop_loss_price', 'stop_loss_percentage', 'position_risk' and
+            'risk_per_share' (trailing distance below the basis, in price
+            units) shaped (positions,) for a scalar or (scenarios, positions)
+            for an array, and 'total_risk' as a percentage of total capital
+            per scenario
+        """
+        risk = np.asarray(risk_percentage, dtype=float)
+        scalar = risk.ndim == 0
+        risk = np.atleast_1d(risk)[:, None]
+
+        # Trailing stop below the higher of purchase price and the high-water mark
+        basis = np.maximum(self.average_price, self.max_price)
+        risk_per_share = RiskBudgetTrailingStop.budget_per_share(self.total_capital, risk, self.quantity, self.is_gbx)
+        stop_loss_price = RiskBudgetTrailingStop(risk_per_share).target(self.current_price, self.average_price, self.max_price)
+        stop_loss_percentage = round2((basis - stop_loss_price) / basis * 100)
+
+        # Manual stop orders take precedence when measuring risk
+        effective_stop = np.where(np.isnan(self.manual_stop), stop_loss_price, self.manual_stop)
+        risk_fraction = np.where(
+            self.average_price > effective_stop,
+            (self.average_price - effective_stop) / self.average_price,
+            0.0,
+        )
+        position_risk = risk_fraction * self.position_value
+        total_risk = position_risk.sum(axis=1) / self.total_capital * 100
+
+        result = {
+            "stop_loss_price": stop_loss_price,
+            "stop_loss_percentage": stop_loss_percentage,
+            "position_risk": position_risk,
+            "risk_per_share": np.broadcast_to(risk_per_share, stop_loss_price.shape),
+            "total_risk": total_risk,
+        }
+        if scalar:
+            result = {key: value[0] for key, value in result.items()}
+        return result
+
+    def what_if(self, risk_percentages) -> List[Dict]:
+        """JSON-ready scenarios for a sweep of risk percentages, computed in one pass"""
+        risk_percentages = [float(r) for r in risk_percentages]
+        result = self.compute(risk_percentages)
+        scenarios = []
+        for i, risk in enumerate(risk_percentages):
+            scenarios.append({
+                "risk_percentage": risk,
+                "total_risk": float(result["total_risk"][i]),
+                "stop_losses": {
+                    ticker: {
+                        "stop_loss_price": float(result["stop_loss_price"][i, j]),
+                        "stop_loss_percentage": float(result["stop_loss_percentage"][i, j]),
+                    }
+                    for j, ticker in enumerate(self.tickers)
+                },
+            })
+        return scenarios
+
+
+def manual_stop_or_nan(price: Optional[float]) -> float:
+    return np.nan if price is None else float(price)
@@ -0,0 +1,168 @@
+import fcntl
+import logging
+import os
+import struct
+import threading
+import time
+import metrics
+from shared import shared_path
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every caller of one upstream.
+
+    Parameters:
+    -----------
+    name : str
+        Upstream name, used in log lines
+    rate : float
+        Tokens added per second
+    capacity : float
+        Maximum burst size
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float = 1):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """Block until a token is available and return the time spent waiting"""
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    metrics.RATELIMIT_WAIT_SECONDS.observe(now - started, bucket=self.name)
+                    return now - started
+                wait = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def penalize(self, retry_after: float):
+        """Stop handing out tokens for `retry_after` seconds (e.g. after a 429)"""
+        with self._lock:
+            now = time.monotonic()
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+            self._tokens = 0
+            self._updated = now
+        metrics.RATELIMIT_PENALTIES.inc(bucket=self.name)
+        logger.info(f"Rate limit hit on {self.name}, backing off for {retry_after:.1f}s")
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    TokenBucket whose state lives in a file, so every worker process of the
+    app draws from one budget instead of each getting the full rate.
+
+    Parameters:
+    -----------
+    path : str
+        State file (tokens, last refill and penalty end, wall clock times)
+    """
+
+    _STATE = struct.Struct("ddd")
+
+    def __init__(self, name: str, rate: float, capacity: float, path: str):
+        super().__init__(name, rate, capacity)
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def _update(self, change):
+        """Apply change(tokens, blocked_until, now) -> ((tokens, blocked_until), result) under the file lock"""
+        # flock() doesn't exclude threads sharing the descriptor, hence the thread lock too
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                raw = os.pread(self._fd, self._STATE.size, 0)
+                if len(raw) == self._STATE.size:
+                    tokens, updated, blocked_until = self._STATE.unpack(raw)
+                else:
+                    tokens, updated, blocked_until = self.capacity, now, 0.0
+                tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+                (tokens, blocked_until), result = change(tokens, blocked_until, now)
+                os.pwrite(self._fd, self._STATE.pack(tokens, now, blocked_until), 0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return result
+
+    def _take(self, tokens, blocked_until, now):
+        """Take a token if one is available, else the seconds until one will be"""
+        if now >= blocked_until and tokens >= 1:
+            return (tokens - 1, blocked_until), 0.0
+        return (tokens, blocked_until), max(blocked_until - now, (1 - tokens) / self.rate)
+
+    def acquire(self) -> float:
+        started = time.monotonic()
+        while True:
+            wait = self._update(self._take)
+            if wait <= 0:
+                waited = time.monotonic() - started
+                metrics.RATELIMIT_WAIT_SECONDS.observe(waited, bucket=self.name)
+                return waited
+            time.sleep(wait)
+
+    def penalize(self, retry_after: float):
+        self._update(lambda tokens, blocked_until, now: ((0.0, max(blocked_until, now + retry_after)), None))
+        metrics.RATELIMIT_PENALTIES.inc(bucket=self.name)
+        logger.info(f"Rate limit hit on {self.name}, backing off for {retry_after:.1f}s")
+
+
+def bucket(name: str, rate: float, capacity: float) -> TokenBucket:
+    """Process-local bucket, or one shared by all worker processes when SHARED_STATE_DIR is set"""
+    path = shared_path(f"ratelimit-{name}")
+    if path is None:
+        return TokenBucket(name, rate, capacity)
+    return SharedTokenBucket(name, rate, capacity, path)
+
+
+def retry_after_from_headers(headers, default: float = 1.0) -> float:
+    """Seconds to wait according to Retry-After or Trading 212's x-ratelimit-reset header"""
+    if headers.get("Retry-After"):
+        try:
+            return max(0.0, float(headers["Retry-After"]))
+        except ValueError:
+            pass
+    if headers.get("x-ratelimit-reset"):
+        try:
+            return max(0.0, float(headers["x-ratelimit-reset"]) - time.time())
+        except ValueError:
+            pass
+    return default
+
+
+# Trading 212 limits each endpoint separately: (requests, per seconds) as documented, T212Client keeps one bucket per endpoint
+T212_LIMITS = {
+    "GET /portfolio": (1, 5),
+    "GET /portfolio/{ticker}": (1, 1),
+    "GET /orders": (1, 5),
+    "GET /orders/{id}": (1, 1),
+    "GET /account/cash": (1, 2),
+    "GET /account/info": (1, 30),
+    "GET /metadata/instruments": (1, 50),
+    "GET /metadata/exchanges": (1, 30),
+    "POST /orders/market": (50, 60),
+    "POST /orders/limit": (1, 2),
+    "POST /orders/stop": (1, 2),
+    "POST /orders/stop_limit": (1, 2),
+    "DELETE /orders/{id}": (50, 60),
+}
+T212_DEFAULT_LIMIT = (1, 1)  # Endpoints missing from T212_LIMITS
+T212_RATE_SCALE = float(os.getenv("T212_RATE_SCALE", "1"))  # Multiplier on the documented limits, e.g. against a stand-in server
+
+# One bucket per upstream, shared by every thread of the process (and every worker process with SHARED_STATE_DIR)
+YAHOO = bucket("yahoo", rate=float(os.getenv("YAHOO_RATE_LIMIT", "4")), capacity=float(os.getenv("YAHOO_RATE_BURST", "4")))
+TELEGRAM = bucket("telegram", rate=float(os.getenv("TELEGRAM_RATE_LIMIT", "1")), capacity=float(os.getenv("TELEGRAM_RATE_BURST", "3")))
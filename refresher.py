@@ -0,0 +1,280 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot(NamedTuple):
+    """
+    An immutable, already-serialized result published by a Refresher.
+
+    The version only changes with the data, created_at is the time of the
+    last refresh that computed it.
+    """
+    version: int
+    created_at: float
+    data: Any
+    body: bytes
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.created_at
+
+
+def delta(old: dict, new: dict, list_keys: Dict[str, str]) -> dict:
+    """
+    Field-level changes from `old` to `new`.
+
+    Top-level fields are compared as a whole, except the lists named in
+    `list_keys` (e.g. {"positions": "ticker"}), which are diffed per item:
+    new items are sent whole, existing ones only with their changed fields.
+
+    Returns:
+    --------
+    dict
+        'changed' (field -> value, or key -> item fields for keyed lists),
+        'removed' (list field -> removed keys) and 'order' (list field ->
+        keys in their new order, only when it changed)
+    """
+    changed, removed, order = {}, {}, {}
+    for field, value in new.items():
+        if field not in list_keys:
+            if field not in old or old[field] != value:
+                changed[field] = value
+            continue
+
+        key = list_keys[field]
+        old_items = {item[key]: item for item in old.get(field, [])}
+        items = {}
+        for item in value:
+            previous = old_items.get(item[key])
+            if previous is None:
+                items[item[key]] = item
+            else:
+                fields = {name: v for name, v in item.items() if name not in previous or previous[name] != v}
+                if fields:
+                    items[item[key]] = fields
+        if items:
+            changed[field] = items
+
+        keys = [item[key] for item in value]
+        gone = [k for k in old_items if k not in set(keys)]
+        if gone:
+            removed[field] = gone
+        if keys != list(old_items):
+            order[field] = keys
+    return {"changed": changed, "removed": removed, "order": order}
+
+
+class Refresher:
+    """
+    Rebuilds a result in a background thread every `interval` seconds and
+    publishes it as a Snapshot, so readers never pay for the computation.
+
+    Parameters:
+    -----------
+    name : str
+        Name used for the thread and log lines
+    compute : callable
+        Function returning a JSON-serializable result
+    interval : float
+        Seconds between the start of two consecutive refreshes
+    list_keys : dict
+        Keyed lists in the result, used for deltas (see delta())
+    history : int
+        Recent snapshots kept to serve deltas from
+    shared, lock : see shared.leader_lock() and shared.shared_store()
+        With several processes, only the holder of `lock` computes and writes
+        each snapshot to `shared`; the others follow it every `follow_interval`
+        seconds and take over when the holder exits or loses its lease
+    on_lead, on_follow : callable
+        Called when this process starts and stops computing (e.g. to start
+        and stop jobs that must run in one process only)
+    """
+
+    def __init__(self, name: str, compute: Callable[[], Any], interval: float = 30,
+                 list_keys: Optional[Dict[str, str]] = None, history: int = 20,
+                 shared=None, lock=None, on_lead: Optional[Callable[[], None]] = None,
+                 on_follow: Optional[Callable[[], None]] = None, follow_interval: float = 1):
+        self.name = name
+        self.compute = compute
+        self.interval = interval
+        self.list_keys = list_keys or {}
+        self.shared = shared
+        self.lock = lock
+        self.on_lead = on_lead
+        self.on_follow = on_follow
+        self.follow_interval = follow_interval
+        self.leading = False
+        # Versions restart with the process, the epoch keeps ETags from colliding across restarts
+        self.epoch = format(int(time.time()), "x")
+        self._snapshot: Optional[Snapshot] = None
+        self._recent = deque(maxlen=history)
+        self._deltas: Dict[int, Tuple[int, bytes]] = {}
+        self._ready = threading.Event()
+        self._published = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=f"refresh-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def get(self) -> Optional[Snapshot]:
+        """Return the latest snapshot (or None before the first refresh)"""
+        return self._snapshot
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[Snapshot]:
+        """Return the latest snapshot, waiting up to `timeout` seconds for the first one"""
+        self._ready.wait(timeout)
+        return self._snapshot
+
+    def wait_for_update(self, version: int, timeout: Optional[float] = None) -> Optional[Snapshot]:
+        """Return the latest snapshot once it is newer than `version`, or None after `timeout` seconds"""
+        with self._published:
+            self._published.wait_for(lambda: self._snapshot is not None and self._snapshot.version > version, timeout)
+        snapshot = self._snapshot
+        return snapshot if snapshot is not None and snapshot.version > version else None
+
+    def etag(self, snapshot: Snapshot) -> str:
+        return f'"{self.epoch}-{snapshot.version}"'
+
+    def version_from_etag(self, etag: Optional[str]) -> Optional[int]:
+        """Snapshot version of an ETag issued by this process, None for anything else"""
+        if etag and etag.strip('"').startswith(f"{self.epoch}-"):
+            try:
+                return int(etag.strip('"').split("-", 1)[1])
+            except ValueError:
+                return None
+        return None
+
+    def delta_body(self, since: int) -> Optional[bytes]:
+        """
+        Serialized delta from version `since` to the latest snapshot, or None
+        when `since` is no longer kept (the caller then sends the full body).
+        Deltas are computed once per base version and shared by all readers.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        cached = self._deltas.get(since)
+        if cached is not None and cached[0] == snapshot.version:
+            return cached[1]
+        base = next((s for s in self._recent if s.version == since), None)
+        if base is None or not isinstance(snapshot.data, dict):
+            return None
+        body = json.dumps(dict(
+            delta(base.data, snapshot.data, self.list_keys), since=since, version=snapshot.version
+        )).encode()
+        self._deltas[since] = (snapshot.version, body)
+        return body
+
+    def refresh(self) -> Snapshot:
+        """Compute and publish a new snapshot in the calling thread"""
+        started = time.time()
+        data = self.compute()
+        body = json.dumps(data).encode()
+        previous = self._snapshot
+        changed = previous is None or body != previous.body
+        if changed:
+            snapshot = Snapshot(version=previous.version + 1 if previous is not None else 1, created_at=started, data=data, body=body)
+        else:
+            # Same version and ETag, so clients keep getting 304s; only the refresh time moves on
+            snapshot = previous._replace(created_at=started)
+        if self.lock is not None and not self.lock.held:
+            # Lost the lease while computing, the new leader publishes from now on
+            raise RuntimeError(f"No longer the leader for {self.name}, dropping the result")
+        if self.shared is not None:
+            header = json.dumps({"epoch": self.epoch, "version": snapshot.version, "created_at": snapshot.created_at})
+            self.shared.write(header.encode() + b"\n" + snapshot.body)
+        self._set(snapshot)
+        logger.info(f"{'Published' if changed else 'Unchanged'} {self.name} snapshot v{snapshot.version} in {time.time() - started:.2f}s")
+        return snapshot
+
+    def follow(self) -> Optional[Snapshot]:
+        """Adopt the snapshot last written to the shared file if it is newer than ours"""
+        if self.shared is None:
+            return None
+        loaded = self.shared.load(self._decode)
+        if loaded is None:
+            return None
+        epoch, snapshot = loaded
+        current = self._snapshot
+        if epoch == self.epoch and current is not None and current.version >= snapshot.version:
+            if current.version == snapshot.version and current.created_at < snapshot.created_at:
+                # Refreshed without changes
+                self._set(current._replace(created_at=snapshot.created_at))
+            return None
+        if epoch != self.epoch:
+            # Written by a process with another epoch, its versions can't be diffed against ours
+            self.epoch = epoch
+            self._recent.clear()
+            self._snapshot = None
+        self._set(snapshot)
+        return snapshot
+
+    @staticmethod
+    def _decode(contents: bytes) -> Tuple[str, Snapshot]:
+        header, body = contents.split(b"\n", 1)
+        header = json.loads(header)
+        return header["epoch"], Snapshot(
+            version=header["version"], created_at=header["created_at"], data=json.loads(body), body=body,
+        )
+
+    def _set(self, snapshot: Snapshot):
+        # A single reference assignment, so readers always see a complete snapshot
+        with self._published:
+            changed = self._snapshot is None or self._snapshot.version != snapshot.version
+            self._snapshot = snapshot
+            if changed:
+                self._recent.append(snapshot)
+                self._deltas = {}
+                self._published.notify_all()
+        self._ready.set()
+
+    def _lead(self) -> bool:
+        """Whether this process computes the snapshots, taking over if the lock is free"""
+        if self.leading and self.lock is not None and not self.lock.held:
+            self.leading = False
+            logger.info(f"Process {os.getpid()} lost the lead for {self.name}, following")
+            if self.on_follow is not None:
+                self.on_follow()
+        if not self.leading:
+            if self.lock is not None and not self.lock.acquire(blocking=False):
+                return False
+            # Continue the versions (and ETags) of the previous holder
+            try:
+                self.follow()
+            except Exception as e:
+                logger.exception(f"Reading the shared {self.name} snapshot failed: {e}")
+            self.leading = True
+            logger.info(f"Process {os.getpid()} now refreshes {self.name}")
+            if self.on_lead is not None:
+                self.on_lead()
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            if not self._lead():
+                try:
+                    self.follow()
+                except Exception as e:
+                    logger.exception(f"Reading the shared {self.name} snapshot failed: {e}")
+                self._stop.wait(self.follow_interval)
+                continue
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.exception(f"Refreshing {self.name} failed, keeping previous snapshot: {e}")
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
@@ -0,0 +1,348 @@
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+POSITIONS_FLUSH_INTERVAL = float(os.getenv("POSITIONS_FLUSH_INTERVAL", "30")) # Seconds between write-behind flushes of stop losses
+
+
+class PositionCache:
+    """
+    Write-behind cache of the positions table (max_price, stop_loss).
+
+    Only the process refreshing the positions (the leader, see shared.py)
+    writes, so the table is read once and then served from memory. Changed rows are flushed by a background thread every
+    flush_interval seconds and at exit; a raised max price (the trailing-stop
+    high-water mark, which can't be recomputed) is flushed right away.
+    """
+
+    def __init__(self, repository: "Repository", flush_interval: float = POSITIONS_FLUSH_INTERVAL):
+        self.repository = repository
+        self.flush_interval = flush_interval
+        self._rows: Optional[Dict[str, dict]] = None
+        self._dirty = set()
+        self._deleted = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"hits": 0, "misses": 0, "flushes": 0, "rows_flushed": 0, "last_flush_ms": 0.0, "total_flush_ms": 0.0}
+
+    def _ensure_loaded(self) -> Dict[str, dict]:
+        if self._rows is None:
+            with self._lock:
+                if self._rows is None:
+                    conn = self.repository.connection()
+                    with metrics.upstream_call("sqlite", "load_positions"):
+                        self._rows = {
+                            row["ticker"]: {"max_price": row["max_price"], "stop_loss": row["stop_loss"]}
+                            for row in conn.execute("SELECT ticker, max_price, stop_loss FROM positions")
+                        }
+                    logger.info(f"Loaded {len(self._rows)} position rows")
+                    self._start()
+        return self._rows
+
+    def reset(self):
+        """Forget the cached rows, e.g. after another process took over the writes"""
+        with self._lock:
+            # Unflushed rows are stop losses, the next refresh recomputes them; raised max prices are already written
+            self._rows = None
+            self._dirty.clear()
+            self._deleted.clear()
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="positions-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.info(f"Flushing position rows failed, will retry: {e}")
+
+    def _get(self, ticker: str, field: str) -> Optional[float]:
+        row = self._ensure_loaded().get(ticker)
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return row[field]
+
+    def _set(self, ticker: str, field: str, value: float) -> bool:
+        rows = self._ensure_loaded()
+        with self._lock:
+            row = rows.setdefault(ticker, {"max_price": None, "stop_loss": None})
+            if row[field] == value:
+                return False
+            row[field] = value
+            self._dirty.add(ticker)
+            self._deleted.discard(ticker)
+            return True
+
+    def get_max_price(self, ticker: str) -> Optional[float]:
+        return self._get(ticker, "max_price")
+
+    def get_stop_loss(self, ticker: str) -> Optional[float]:
+        return self._get(ticker, "stop_loss")
+
+    def update_stop_loss(self, ticker: str, stop_loss_price: float):
+        self._set(ticker, "stop_loss", stop_loss_price)
+
+    def raise_max_price(self, ticker: str, price: float, flush: bool = True, create: bool = False) -> bool:
+        """
+        Record a new high of a held position, never lowering the stored one (the
+        refresh and the stop watcher both raise it). Written right away unless
+        `flush` is False; a row is only added for an unknown ticker with `create`.
+        """
+        rows = self._ensure_loaded()
+        with self._lock:
+            row = rows.get(ticker)
+            if row is None and not create:
+                return False
+            if row is None:
+                row = rows[ticker] = {"max_price": None, "stop_loss": None}
+            if row["max_price"] is not None and row["max_price"] >= price:
+                return False
+            row["max_price"] = price
+            self._dirty.add(ticker)
+            self._deleted.discard(ticker)
+        if flush:
+            self.flush()
+        return True
+
+    def remove_stale(self, active_tickers: Iterable[str]):
+        """Forget rows for tickers no longer held, deleted from the table on the next flush"""
+        rows = self._ensure_loaded()
+        with self._lock:
+            stale_tickers = set(rows) - set(active_tickers)
+            for ticker in stale_tickers:
+                del rows[ticker]
+                self._dirty.discard(ticker)
+            self._deleted |= stale_tickers
+        if stale_tickers:
+            logger.info(f"Cleaned up {len(stale_tickers)} stale position records for tickers: {stale_tickers}")
+
+    def flush(self):
+        """Write dirty and deleted rows in one transaction"""
+        with self._flush_lock:
+            with self._lock:
+                dirty = {ticker: dict(self._rows[ticker]) for ticker in self._dirty}
+                deleted = set(self._deleted)
+                self._dirty.clear()
+                self._deleted.clear()
+            if not dirty and not deleted:
+                return
+
+            start = time.perf_counter()
+            conn = self.repository.connection()
+            try:
+                with metrics.upstream_call("sqlite", "positions_flush"), conn:
+                    conn.executemany("""
+                        INSERT INTO positions (ticker, max_price, stop_loss) VALUES (?, ?, ?)
+                        ON CONFLICT(ticker) DO UPDATE SET
+                            max_price = excluded.max_price,
+                            stop_loss = excluded.stop_loss
+                    """, [(ticker, row["max_price"], row["stop_loss"]) for ticker, row in dirty.items()])
+                    if deleted:
+                        placeholders = ','.join('?' * len(deleted))
+                        conn.execute(f"DELETE FROM positions WHERE ticker IN ({placeholders})", tuple(deleted))
+            except Exception:
+                # Put the rows back so the next flush retries them (unless they changed again meanwhile)
+                with self._lock:
+                    self._dirty |= set(dirty) & set(self._rows)
+                    self._deleted |= deleted - set(self._rows)
+                raise
+
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.stats["flushes"] += 1
+            self.stats["rows_flushed"] += len(dirty) + len(deleted)
+            self.stats["last_flush_ms"] = elapsed_ms
+            self.stats["total_flush_ms"] += elapsed_ms
+
+    def stats_summary(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": self.stats["hits"] / lookups if lookups else None,
+            "avg_flush_ms": self.stats["total_flush_ms"] / self.stats["flushes"] if self.stats["flushes"] else None,
+            "dirty_rows": len(self._dirty) + len(self._deleted),
+        }
+
+
+class RefreshState:
+    """
+    Per-refresh view of the DB: flags are read once at the start, positions
+    go through the shared write-behind cache.
+    """
+
+    def __init__(self, positions: PositionCache, flags: Dict[str, bool]):
+        self.positions = positions
+        self.flags = flags
+        self.active_tickers: Optional[set] = None
+        self.max_price_raised = False
+
+    def get_max_price(self, ticker: str) -> Optional[float]:
+        return self.positions.get_max_price(ticker)
+
+    def get_stop_loss(self, ticker: str) -> Optional[float]:
+        return self.positions.get_stop_loss(ticker)
+
+    def raise_max_price(self, ticker: str, price: float) -> float:
+        """Max price of `ticker` after raising it to `price` (a higher one recorded meanwhile, e.g. by the stop watcher, is kept)"""
+        if self.positions.raise_max_price(ticker, price, flush=False, create=True):
+            self.max_price_raised = True
+        return self.positions.get_max_price(ticker)
+
+    def update_stop_loss(self, ticker: str, stop_loss_price: float):
+        self.positions.update_stop_loss(ticker, stop_loss_price)
+
+    def get_flag(self, flag: str, default=False):
+        return self.flags.get(flag, default)
+
+    def cleanup_stale(self, active_tickers: Iterable[str]):
+        """Drop positions rows for tickers no longer held (applied on commit)"""
+        self.active_tickers = set(active_tickers)
+
+
+class Repository:
+    """
+    Data access for the papishares SQLite DB.
+
+    Keeps one long-lived connection per thread (WAL mode, so readers don't
+    block the writer) instead of connecting for every read and write.
+    """
+
+    def __init__(self, db: str):
+        self.db = db
+        self._local = threading.local()
+        self.positions = PositionCache(self)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load_state(self) -> RefreshState:
+        """Read every row a refresh needs up front"""
+        conn = self.connection()
+        with metrics.upstream_call("sqlite", "load_flags"):
+            flags = {row["flag"]: row["status"] for row in conn.execute("SELECT flag, status FROM flags")}
+        return RefreshState(self.positions, flags)
+
+    def commit(self, state: RefreshState):
+        """Hand position changes to the cache (flushed now if a max price rose)"""
+        if state.active_tickers is not None:
+            self.positions.remove_stale(state.active_tickers)
+
+        if state.max_price_raised:
+            self.positions.flush()
+            state.max_price_raised = False
+
+    def load_notifications(self) -> Dict[str, str]:
+        """Last notified MACD crossover type per symbol"""
+        return {
+            row["symbol"]: row["last_crossover_type"]
+            for row in self.connection().execute("SELECT symbol, last_crossover_type FROM macd_notifications")
+        }
+
+    def record_notifications(self, notifications: Dict[str, str]):
+        """Record delivered crossover notifications (symbol -> type) in one transaction"""
+        now = datetime.now().isoformat()
+        conn = self.connection()
+        with metrics.upstream_call("sqlite", "record_notifications"), conn:
+            conn.executemany("""
+                INSERT INTO macd_notifications (symbol, last_crossover_type, last_crossover_time, last_notified_time)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(symbol) DO UPDATE SET
+                    last_crossover_type = excluded.last_crossover_type,
+                    last_crossover_time = excluded.last_crossover_time,
+                    last_notified_time = excluded.last_notified_time
+            """, [(symbol, crossover_type, now, now) for symbol, crossover_type in notifications.items()])
+
+    def try_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Take or renew the lease `name` for ttl seconds unless another holder has an unexpired one"""
+        now = time.time()
+        conn = self.connection()
+        with metrics.upstream_call("sqlite", "lease"), conn:
+            cursor = conn.execute("""
+                INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    holder = excluded.holder,
+                    expires_at = excluded.expires_at
+                WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+            """, (name, holder, now + ttl, now))
+        return cursor.rowcount == 1
+
+    def release_lease(self, name: str, holder: str):
+        conn = self.connection()
+        with conn:
+            conn.execute("DELETE FROM leases WHERE name=? AND holder=?", (name, holder))
+
+    def write_shared(self, name: str, body: bytes):
+        """Replace the published blob `name` (e.g. a snapshot), bumping its generation"""
+        conn = self.connection()
+        with metrics.upstream_call("sqlite", "write_shared"), conn:
+            conn.execute("""
+                INSERT INTO shared_state (name, generation, body) VALUES (?, 1, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    generation = shared_state.generation + 1,
+                    body = excluded.body
+            """, (name, body))
+
+    def shared_generation(self, name: str) -> Optional[int]:
+        row = self.connection().execute("SELECT generation FROM shared_state WHERE name=?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def read_shared(self, name: str) -> Optional[Tuple[int, bytes]]:
+        with metrics.upstream_call("sqlite", "read_shared"):
+            row = self.connection().execute("SELECT generation, body FROM shared_state WHERE name=?", (name,)).fetchone()
+        return None if row is None else (row[0], bytes(row[1]))
+
+    def get_flag(self, flag: str, default=False):
+        row = self.connection().execute("SELECT status FROM flags WHERE flag=?", (flag,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_flag(self, flag: str, status: bool):
+        conn = self.connection()
+        with conn:
+            conn.execute("""
+                INSERT INTO flags (flag, status) VALUES (?, ?)
+                ON CONFLICT(flag) DO UPDATE SET status = excluded.status
+            """, (flag, status))
+
+    def toggle_flag(self, flag: str):
+        conn = self.connection()
+        with conn:
+            row = conn.execute("SELECT status FROM flags WHERE flag=?", (flag,)).fetchone()
+            if row is None:
+                conn.execute("INSERT INTO flags (flag, status) VALUES (?, ?)", (flag, 'False'))
+            else:
+                conn.execute("UPDATE flags SET status=? WHERE flag=?", (not row[0], flag))
+
+
+_repositories: Dict[str, Repository] = {}
+_repositories_lock = threading.Lock()
+
+
+def get_repository(db: str) -> Repository:
+    """Shared Repository for a DB path"""
+    with _repositories_lock:
+        if db not in _repositories:
+            _repositories[db] = Repository(db)
+        return _repositories[db]
@@ -0,0 +1,268 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import pandas as pd
+import yfinance as yf
+import bars
+import metrics
+import ratelimit
+
+logger = logging.getLogger(__name__)
+
+RISK_LOOKBACK = os.getenv("RISK_LOOKBACK", bars.DEFAULT_PERIOD) # Daily bars the return covariance is estimated from, the refresh already keeps 3mo
+SECTOR_MAX_AGE = float(os.getenv("SECTOR_MAX_AGE", str(30 * 86400))) # Seconds before a cached Yahoo sector is looked up again
+SECTOR_RETRY = 3600 # Seconds before a failed sector lookup is retried
+UNKNOWN_SECTOR = "Unknown"
+
+
+class SectorStore:
+    """
+    Yahoo Finance sector per symbol, cached in the bars DB.
+
+    Lookups never wait for the network: symbols without a (fresh) sector are
+    queued for a background thread, which fetches them one at a time through
+    the Yahoo rate limiter, and show as 'Unknown' until it has.
+    """
+
+    def __init__(self, path: str = bars.BARS_DB_PATH, max_age: float = SECTOR_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._sectors: Optional[Dict[str, Tuple[str, float]]] = None
+        self._wanted: List[str] = []
+        self._failed: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"hits": 0, "misses": 0, "fetches": 0, "errors": 0}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sectors (
+                symbol TEXT PRIMARY KEY,
+                sector TEXT,
+                fetched_at REAL
+            )
+        """)
+        return conn
+
+    def _ensure_loaded(self) -> Dict[str, Tuple[str, float]]:
+        with self._lock:
+            if self._sectors is None:
+                conn = self._connect()
+                try:
+                    self._sectors = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT symbol, sector, fetched_at FROM sectors")}
+                finally:
+                    conn.close()
+            return self._sectors
+
+    def get_many(self, symbols: Iterable[str]) -> List[str]:
+        """Sector of each symbol, 'Unknown' (and queued for lookup) when not cached yet"""
+        sectors = self._ensure_loaded()
+        now = time.time()
+        result, missing = [], []
+        for symbol in symbols:
+            cached = sectors.get(symbol)
+            if cached is None or now - cached[1] > self.max_age:
+                self.stats["misses"] += 1
+                if now - self._failed.get(symbol, 0) > SECTOR_RETRY:
+                    missing.append(symbol)
+            else:
+                self.stats["hits"] += 1
+            result.append(cached[0] if cached is not None else UNKNOWN_SECTOR)
+        if missing:
+            with self._lock:
+                self._wanted.extend(symbol for symbol in missing if symbol not in self._wanted)
+            self._start()
+            self._wake.set()
+        return result
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sectors", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while True:
+                with self._lock:
+                    if not self._wanted:
+                        break
+                    symbol = self._wanted[0]
+                try:
+                    self._save(symbol, self._fetch(symbol))
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    self._failed[symbol] = time.time()
+                    logger.info(f"Could not look up the sector of {symbol}: {e}")
+                with self._lock:
+                    self._wanted.remove(symbol)
+
+    def _fetch(self, symbol: str) -> str:
+        self.stats["fetches"] += 1
+        ratelimit.YAHOO.acquire()
+        with metrics.upstream_call("yahoo", "info"):
+            info = yf.Ticker(symbol).info or {}
+        # Funds have no sector, group them by their quote type (ETF, MUTUALFUND)
+        return info.get("sector") or info.get("quoteType") or UNKNOWN_SECTOR
+
+    def _save(self, symbol: str, sector: str):
+        fetched_at = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("""
+                    INSERT INTO sectors (symbol, sector, fetched_at) VALUES (?, ?, ?)
+                    ON CONFLICT(symbol) DO UPDATE SET sector = excluded.sector, fetched_at = excluded.fetched_at
+                """, (symbol, sector, fetched_at))
+        finally:
+            conn.close()
+        with self._lock:
+            self._sectors[symbol] = (sector, fetched_at)
+
+
+def _group(labels: List[str], exposure: np.ndarray, position_risk: np.ndarray, total_capital: float, key: str) -> List[Dict]:
+    """Exposure and risk summed per label, largest exposure first"""
+    names, inverse = np.unique(np.asarray(labels, dtype=object), return_inverse=True)
+    exposure_sum = np.bincount(inverse, weights=exposure, minlength=len(names))
+    risk_sum = np.bincount(inverse, weights=position_risk, minlength=len(names))
+    counts = np.bincount(inverse, minlength=len(names))
+    groups = [
+        {
+            key: str(name),
+            "positions": int(count),
+            "exposure": round(float(value), 2),
+            "exposure_pct": round(float(value / total_capital * 100), 2),
+            "risk_pct": round(float(risk / total_capital * 100), 2),
+        }
+        for name, count, value, risk in zip(names, counts, exposure_sum, risk_sum)
+    ]
+    return sorted(groups, key=lambda group: group["exposure"], reverse=True)
+
+
+class RiskEngine:
+    """
+    Portfolio-wide risk: totals against the limit, per currency and sector
+    breakdowns and correlation-adjusted figures.
+
+    The covariance of daily returns only changes with a new daily bar, so it
+    is cached per set of symbols and last bar dates; each refresh then only
+    re-weights it with the latest prices and stops, a few vector products.
+
+    Parameters:
+    -----------
+    bar_store : BarStore
+        Source of the daily closes (already fetched by the refresh)
+    sectors : SectorStore
+        Sector lookups
+    lookback : str
+        Period of daily bars the covariance is estimated from
+    """
+
+    def __init__(self, bar_store, sectors: SectorStore, lookback: str = RISK_LOOKBACK):
+        self.bar_store = bar_store
+        self.sectors = sectors
+        self.lookback = lookback
+        self._covariance: Optional[Tuple[Tuple, np.ndarray]] = None
+        self._lock = threading.Lock()
+        self.stats = {"covariance_hits": 0, "covariance_updates": 0}
+
+    def covariance(self, symbols: List[str]) -> np.ndarray:
+        """
+        Covariance of daily returns, symbols x symbols.
+
+        Pairs without overlapping history get NaN, callers decide how to
+        treat them.
+        """
+        frames = {}
+        for symbol in dict.fromkeys(symbols):
+            try:
+                df = self.bar_store.get(symbol, "1d", self.lookback)
+            except Exception as e:
+                logger.info(f"No bars for {symbol} risk: {e}")
+                continue
+            if df is not None and not df.empty:
+                frames[symbol] = df["Close"]
+        key = (tuple(symbols), tuple(frames[s].index[-1] if s in frames else None for s in symbols))
+
+        with self._lock:
+            if self._covariance is not None and self._covariance[0] == key:
+                self.stats["covariance_hits"] += 1
+                return self._covariance[1]
+
+        if frames:
+            # London and New York bars carry different timezones, align them on the trading date
+            closes = pd.concat(
+                {symbol: close.set_axis(pd.DatetimeIndex(close.index.date)) for symbol, close in frames.items()}, axis=1
+            ).sort_index()
+            returns = closes.pct_change(fill_method=None)
+            covariance = returns.cov(min_periods=10).reindex(index=symbols, columns=symbols).to_numpy()
+        else:
+            covariance = np.full((len(symbols), len(symbols)), np.nan)
+
+        with self._lock:
+            self._covariance = (key, covariance)
+            self.stats["covariance_updates"] += 1
+        return covariance
+
+    def breakdown(self, portfolio, symbols: List[str], position_risk, limit: float) -> Dict:
+        """
+        Risk report of a refresh, JSON-ready.
+
+        Parameters:
+        -----------
+        portfolio : Portfolio
+            Latest columnar model
+        symbols : list
+            Yahoo symbol of each position, in the portfolio's order
+        position_risk : array-like
+            Money lost per position if every stop is hit (Portfolio.compute)
+        limit : float
+            Maximum total risk, as a percentage of the account
+
+        Returns:
+        --------
+        dict
+            'total_risk' and 'limit' (% of the account) and whether it is
+            'over_limit'; 'correlated_risk', the loss at the stops if
+            positions moved with their historical correlation rather than all
+            together (% of the account); 'volatility', the portfolio's daily
+            standard deviation (% of the account); and 'currencies' and
+            'sectors' breakdowns of exposure and risk
+        """
+        position_risk = np.asarray(position_risk, dtype=float)
+        capital = portfolio.total_capital
+        exposure = portfolio.market_value
+        total_risk = float(position_risk.sum() / capital * 100)
+
+        covariance = self.covariance(symbols)
+        std = np.sqrt(np.diag(covariance))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            correlation = covariance / np.outer(std, std)
+        # No shared history, no diversification credit: assume the pair moves together
+        correlation = np.where(np.isnan(correlation), 1.0, np.clip(correlation, -1.0, 1.0))
+        correlated_risk = float(np.sqrt(max(position_risk @ correlation @ position_risk, 0.0)))
+        # Positions without bars add nothing to the volatility estimate
+        weighted = np.nan_to_num(covariance)
+        volatility = float(np.sqrt(max(exposure @ weighted @ exposure, 0.0)))
+
+        return {
+            "total_risk": round(total_risk, 2),
+            "limit": limit,
+            "over_limit": total_risk > limit,
+            "correlated_risk": round(correlated_risk / capital * 100, 2),
+            "volatility": round(volatility / capital * 100, 2),
+            "currencies": _group(portfolio.currencies, exposure, position_risk, capital, "currency"),
+            "sectors": _group(self.sectors.get_many(symbols), exposure, position_risk, capital, "sector"),
+        }
+
+
+sectors = SectorStore()
+engine = RiskEngine(bars.store, sectors)
@@ -0,0 +1,226 @@
+from typing import Any, Callable, Optional, Tuple
+import atexit
+import fcntl
+import logging
+import mmap
+import os
+import socket
+import threading
+import time
+from repository import get_repository
+
+logger = logging.getLogger(__name__)
+
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", "") # Directory for state shared by worker processes, empty = single process
+LEADER_BACKEND = os.getenv("LEADER_BACKEND", "file") # "file": flock in SHARED_STATE_DIR (workers of one pod), "sqlite": lease in DB_PATH (replicas sharing the PVC)
+LEASE_TTL = float(os.getenv("LEASE_TTL", "15")) # Seconds a SQLite lease stays valid without renewal
+
+
+def shared_path(name: str) -> Optional[str]:
+    """Path of `name` in SHARED_STATE_DIR, None when running as a single process"""
+    if not SHARED_STATE_DIR:
+        return None
+    os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+    return os.path.join(SHARED_STATE_DIR, name)
+
+
+class FileLock:
+    """
+    Exclusive flock() on a file, shared by no two processes.
+
+    The OS releases it when the holder exits or crashes, so another
+    process can take over without any expiry to tune.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SharedFile:
+    """
+    File written by one process and read by many.
+
+    Writes go to a temporary file that atomically replaces the old one, so a
+    reader never sees a partial write. Readers map the file and only re-read
+    and decode it when it was replaced since their last read.
+
+    Parameters:
+    -----------
+    path : str
+        File location, on a filesystem shared by the processes (e.g. /tmp)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        self._decoded: Any = None
+        self._lock = threading.Lock()
+
+    def write(self, data: bytes):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+    def load(self, decode: Callable[[bytes], Any]) -> Any:
+        """decode(contents) of the current file, cached until the file is replaced, None if there is none"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if stamp != self._stamp:
+                self._decoded = decode(self._read()) if st.st_size else None
+                self._stamp = stamp
+            return self._decoded
+
+    def _read(self) -> bytes:
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[:]
+
+
+class SqliteLease:
+    """
+    Time-bound lease in the leases table, for processes that only share the DB.
+
+    Once acquired it is renewed by a background thread every ttl/3 seconds.
+    The holder considers it lost as soon as it could not be renewed for ttl
+    seconds, which is also when the others consider it expired, so at most
+    one process holds it (given roughly synchronized clocks). It is released
+    at exit so a follower can take over right away.
+
+    Parameters:
+    -----------
+    db : str
+        SQLite DB shared by the contenders (e.g. on the PVC)
+    name : str
+        Lease name, one per job
+    """
+
+    def __init__(self, db: str, name: str, ttl: float = LEASE_TTL):
+        self.repository = get_repository(db)
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self._valid_until = 0.0
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def held(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    def acquire(self, blocking: bool = True) -> bool:
+        while not self._renew():
+            if not blocking:
+                return False
+            time.sleep(self.ttl / 3)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"lease-{self.name}", daemon=True)
+            self._thread.start()
+            atexit.register(self.release)
+        return True
+
+    def release(self):
+        self._valid_until = 0.0
+        try:
+            self.repository.release_lease(self.name, self.holder)
+        except Exception as e:
+            logger.info(f"Could not release lease {self.name}: {e}")
+
+    def _renew(self) -> bool:
+        started = time.monotonic()
+        try:
+            acquired = self.repository.try_lease(self.name, self.holder, self.ttl)
+        except Exception as e:
+            logger.info(f"Could not renew lease {self.name}: {e}")
+            return self.held
+        if acquired:
+            self._valid_until = started + self.ttl
+        elif self.held:
+            logger.info(f"Lease {self.name} was taken over by another process")
+            self._valid_until = 0.0
+        return acquired
+
+    def _run(self):
+        while True:
+            time.sleep(self.ttl / 3)
+            if self.held:
+                self._renew()
+
+
+class SqliteSharedFile:
+    """
+    SharedFile stored as a row of the shared_state table, for processes that
+    only share the DB. Readers poll the row's generation and only fetch and
+    decode the body when it changed.
+    """
+
+    def __init__(self, db: str, name: str):
+        self.repository = get_repository(db)
+        self.name = name
+        self._generation: Optional[int] = None
+        self._decoded: Any = None
+        self._lock = threading.Lock()
+
+    def write(self, data: bytes):
+        self.repository.write_shared(self.name, data)
+
+    def load(self, decode: Callable[[bytes], Any]) -> Any:
+        generation = self.repository.shared_generation(self.name)
+        if generation is None:
+            return None
+        with self._lock:
+            if generation != self._generation:
+                generation, body = self.repository.read_shared(self.name)
+                self._decoded = decode(body) if body else None
+                self._generation = generation
+            return self._decoded
+
+
+def leader_lock(name: str, db: str):
+    """Lock deciding which process runs job `name`, None when running as a single process"""
+    if LEADER_BACKEND == "sqlite":
+        return SqliteLease(db, name)
+    path = shared_path(f"{name}.lock")
+    return FileLock(path) if path else None
+
+
+def shared_store(name: str, db: str):
+    """Where the leader publishes `name` for the other processes, None when running as a single process"""
+    if LEADER_BACKEND == "sqlite":
+        return SqliteSharedFile(db, name)
+    path = shared_path(name)
+    return SharedFile(path) if path else None
@@ -0,0 +1,228 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Union
+import numpy as np
+import pandas as pd
+
+
+def round_to(values, digits: int) -> np.ndarray:
+    """
+    Round like Python's round().
+
+    np.round scales by 10**digits first and can land on the other side of a
+    tie (e.g. 34.225), which would move stop levels by a cent compared to the
+    scalar code, so values close to a tie go through the correctly rounded builtin.
+    """
+    values = np.asarray(values, dtype=float)
+    flat = values.ravel()
+    rounded = np.round(flat, digits)
+    # Only values within float error of a tie can differ, redo those with the builtin
+    with np.errstate(invalid="ignore"):
+        scaled = np.abs(flat) * 10.0 ** digits
+        near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_tie.any():
+        rounded[near_tie] = [round(v, digits) for v in flat[near_tie].tolist()]
+    return rounded.reshape(values.shape)
+
+
+class StopPolicy(ABC):
+    """
+    A stop-loss rule evaluated element-wise over NumPy arrays.
+
+    target() gives the stop level for the current state of a position, for
+    one position, a portfolio (one entry per position) or whole price
+    histories (time x tickers), so the live code and backtest() share it.
+    """
+
+    name = "policy"
+
+    @abstractmethod
+    def target(self, price, average_price, high_water) -> np.ndarray:
+        """
+        Stop level for each element.
+
+        Parameters:
+        -----------
+        price : array-like
+            Latest price
+        average_price : array-like
+            Entry (average purchase) price
+        high_water : array-like
+            Highest price since entry (at least `price`)
+        """
+
+
+class RiskBudgetTrailingStop(StopPolicy):
+    """
+    Trailing stop a fixed distance below the higher of entry price and high-water mark.
+
+    The distance is the share of the account risked per position spread over
+    the shares held (the dashboard's and auto-sell's rule), or, for
+    backtests, a fraction of the entry price.
+
+    Parameters:
+    -----------
+    risk_per_share : array-like, optional
+        Distance below the basis in price units
+    fraction : float, optional
+        Distance as a fraction of the entry price (e.g. risk 0.7% of the account on a
+        10% position: 0.07)
+    """
+
+    name = "risk"
+
+    def __init__(self, risk_per_share=None, fraction: Optional[float] = None):
+        if (risk_per_share is None) == (fraction is None):
+            raise ValueError("Give either risk_per_share or fraction")
+        self.risk_per_share = None if risk_per_share is None else np.asarray(risk_per_share, dtype=float)
+        self.fraction = fraction
+
+    @staticmethod
+    def budget_per_share(total_capital: float, risk_percentage, quantity, is_gbx) -> np.ndarray:
+        """Account risk budget per share, GBX prices being in pence"""
+        total_risk_per_trade = total_capital * np.asarray(risk_percentage, dtype=float) / 100
+        risk_for_calculation = np.where(is_gbx, total_risk_per_trade * 100, total_risk_per_trade)
+        return risk_for_calculation / quantity
+
+    def target(self, price, average_price, high_water) -> np.ndarray:
+        average_price = np.asarray(average_price, dtype=float)
+        risk_per_share = self.risk_per_share if self.fraction is None else average_price * self.fraction
+        # Trailing basis: the higher of purchase price and the high-water mark
+        basis = np.maximum(average_price, high_water)
+        return round_to(basis - risk_per_share, 2)
+
+
+class ProfitTieredStop(StopPolicy):
+    """
+    Stop `base_pct` percent below the current price, one point looser per
+    `step` percent of profit (misc/stoploss.py's rule for manual stop orders).
+
+    Parameters:
+    -----------
+    base_pct : float
+        Distance below the price while the position is within +-step% of entry
+    step : float
+        Profit percentage per extra point of distance
+    """
+
+    name = "tiered"
+
+    def __init__(self, base_pct: float = 4, step: float = 10):
+        self.base_pct = base_pct
+        self.step = step
+
+    def distance_pct(self, profit_pct) -> np.ndarray:
+        # Truncated like int(), so losses under one step keep the base distance
+        return self.base_pct + np.trunc(np.asarray(profit_pct, dtype=float) / self.step)
+
+    def target(self, price, average_price, high_water) -> np.ndarray:
+        price = np.asarray(price, dtype=float)
+        profit_pct = (price - average_price) / average_price * 100
+        return round_to(price * (1 - self.distance_pct(profit_pct) / 100), 4)
+
+
+POLICIES = {policy.name: policy for policy in (RiskBudgetTrailingStop, ProfitTieredStop)}
+
+
+def parse_policy(spec: str) -> StopPolicy:
+    """
+    Policy from a command line spec.
+
+    'risk:0.7:10' risks 0.7% of the account on positions of 10% of it, i.e.
+    trails 7% below the basis; 'tiered:4:10' is ProfitTieredStop(4, 10).
+    """
+    name, *args = spec.split(":")
+    if name not in POLICIES:
+        raise ValueError(f"Unknown stop policy {name!r}, expected one of {', '.join(POLICIES)}")
+    args = [float(arg) for arg in args]
+    if name == "risk":
+        risk_pct = args[0] if len(args) > 0 else 0.7
+        position_pct = args[1] if len(args) > 1 else 10
+        return RiskBudgetTrailingStop(fraction=risk_pct / position_pct)
+    return ProfitTieredStop(*args)
+
+
+def _array(frame) -> np.ndarray:
+    return frame.to_numpy(dtype=float) if isinstance(frame, (pd.DataFrame, pd.Series)) else np.asarray(frame, dtype=float)
+
+
+def backtest(policy: StopPolicy, close: Union[pd.DataFrame, np.ndarray], high=None, low=None, entry=None) -> pd.DataFrame:
+    """
+    Hold every ticker from its entry until the stop is hit, all tickers at once.
+
+    The stop is re-evaluated at every close and only ever raised (as the live
+    orders are), and a bar whose low reaches the previous close's stop exits
+    at that stop. Tickers that never hit it are marked to the last close.
+
+    Parameters:
+    -----------
+    close : DataFrame or array
+        Daily closes, one row per bar and one column per ticker (NaN before listing)
+    high, low : DataFrame or array, optional
+        Daily highs and lows, the closes are used when missing
+    entry : array-like, optional
+        Row of the entry bar per ticker, the first valid close by default
+
+    Returns:
+    --------
+    DataFrame
+        Per ticker: entry and exit bar and price, whether the stop was hit,
+        bars held, return % and the highest price seen
+    """
+    closes = _array(close)
+    if closes.ndim == 1:
+        closes = closes[:, None]
+    highs = closes if high is None else _array(high).reshape(closes.shape)
+    lows = closes if low is None else _array(low).reshape(closes.shape)
+    bars, tickers = closes.shape
+    rows = np.arange(bars)[:, None]
+
+    valid = ~np.isnan(closes)
+    if entry is None:
+        entry = np.where(valid.any(axis=0), valid.argmax(axis=0), bars - 1)
+    entry = np.asarray(entry, dtype=int)
+    entry_price = closes[entry, np.arange(tickers)]
+    held = rows >= entry
+
+    # Forward-fill gaps so a missing bar neither resets the high nor exits the position
+    filled = pd.DataFrame(np.where(held, closes, np.nan)).ffill().to_numpy()
+    high_water = np.fmax.accumulate(np.where(held, np.fmax(highs, filled), np.nan), axis=0)
+    stops = policy.target(filled, entry_price, high_water)
+    stops = np.fmax.accumulate(np.where(held, stops, np.nan), axis=0)
+
+    # Exit on the first bar after entry whose low reaches the stop set at the previous close
+    hit = np.zeros_like(held)
+    hit[1:] = held[:-1] & (lows[1:] <= stops[:-1])
+    exited = hit.any(axis=0)
+    last = np.where(valid.any(axis=0), bars - 1 - valid[::-1].argmax(axis=0), entry)
+    exit_row = np.where(exited, hit.argmax(axis=0), last)
+    columns = np.arange(tickers)
+    exit_price = np.where(exited, stops[np.maximum(exit_row - 1, 0), columns], closes[last, columns])
+
+    index = close.index if isinstance(close, pd.DataFrame) else np.arange(bars)
+    result = pd.DataFrame({
+        "entry": index[entry],
+        "entry_price": entry_price,
+        "exit": index[exit_row],
+        "exit_price": exit_price,
+        "stopped": exited,
+        "bars_held": exit_row - entry,
+        "return_pct": (exit_price - entry_price) / entry_price * 100,
+        "max_price": high_water[exit_row, columns],
+    }, index=close.columns if isinstance(close, pd.DataFrame) else columns)
+    return result
+
+
+def summarize(result: pd.DataFrame) -> Dict[str, float]:
+    """Aggregate statistics of one backtest() result"""
+    returns = result["return_pct"].dropna()
+    return {
+        "tickers": int(len(result)),
+        "stopped": int(result["stopped"].sum()),
+        "mean_return_pct": float(returns.mean()) if len(returns) else float("nan"),
+        "median_return_pct": float(returns.median()) if len(returns) else float("nan"),
+        "win_rate": float((returns > 0).mean()) if len(returns) else float("nan"),
+        "worst_return_pct": float(returns.min()) if len(returns) else float("nan"),
+        "mean_bars_held": float(result["bars_held"].mean()) if len(result) else float("nan"),
+        # How much of the best price the exits captured
+        "mean_giveback_pct": float(((result["max_price"] - result["exit_price"]) / result["max_price"] * 100).mean()),
+    }
@@ -0,0 +1,161 @@
+from typing import Dict, Optional, Tuple
+import asyncio
+import logging
+import os
+import random
+import re
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import metrics
+import ratelimit
+
+logger = logging.getLogger(__name__)
+
+T212_TIMEOUT = float(os.getenv("T212_TIMEOUT", "10")) # Seconds to wait for Trading 212 to answer
+T212_MAX_RETRIES = int(os.getenv("T212_MAX_RETRIES", "5")) # Retries after a 429 before giving up
+T212_BACKOFF = float(os.getenv("T212_BACKOFF", "1")) # Base of the exponential backoff in seconds
+
+
+class T212Client:
+    """
+    Trading 212 API client sharing one pooled keep-alive session.
+
+    Auth and headers are set once on the session. Every request takes a token
+    from the shared rate limiter of its endpoint (Trading 212 limits each one
+    separately, see ratelimit.T212_LIMITS), and a 429 is retried up to
+    max_retries times after the server's Retry-After (or an exponential
+    backoff) plus jitter, during which that limiter holds back every other
+    caller of the endpoint too.
+
+    Parameters:
+    -----------
+    base_url : str
+        API root, e.g. https://live.trading212.com/api/v0
+    api_key, secret_key : str
+        API credentials
+    pool_size : int
+        Connections kept open, at least the number of concurrent callers
+    limits : dict
+        (requests, per seconds) per endpoint ("GET /portfolio")
+    """
+
+    def __init__(self, base_url: str, api_key: str, secret_key: str, timeout: float = T212_TIMEOUT,
+                 max_retries: int = T212_MAX_RETRIES, backoff: float = T212_BACKOFF, pool_size: int = 8,
+                 limits: Dict[str, Tuple[float, float]] = ratelimit.T212_LIMITS, rate_scale: float = ratelimit.T212_RATE_SCALE):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.limits = limits
+        self.rate_scale = rate_scale
+        self._limiters: Dict[str, ratelimit.TokenBucket] = {}
+        self._limiters_lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0}
+
+        self.session = requests.Session()
+        self.session.auth = (api_key, secret_key)
+        self.session.headers.update({"Content-Type": "application/json"})
+        # Dropped connections are retried at the transport level for reads only, never for orders;
+        # 429s are left to request() so they go through the rate limiter
+        retry = Retry(total=2, connect=2, read=0, status=0, allowed_methods={"GET"}, backoff_factor=0.2,
+                      respect_retry_after_header=False, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @staticmethod
+    def endpoint(method: str, path: str) -> str:
+        """Endpoint of a request as in the API docs, one per path template rather than per ticker or order"""
+        path = re.sub(r"^/portfolio/.+", "/portfolio/{ticker}", path)
+        return f"{method} {re.sub(r'^/orders/[0-9]+$', '/orders/{id}', path)}"
+
+    def limiter(self, endpoint: str) -> ratelimit.TokenBucket:
+        """Rate limiter of `endpoint`, created with its documented limit on first use"""
+        with self._limiters_lock:
+            limiter = self._limiters.get(endpoint)
+            if limiter is None:
+                count, seconds = self.limits.get(endpoint, ratelimit.T212_DEFAULT_LIMIT)
+                name = "trading212-" + re.sub(r"[^a-z0-9]+", "-", endpoint.lower()).strip("-")
+                limiter = self._limiters[endpoint] = ratelimit.bucket(
+                    name, rate=count / seconds * self.rate_scale, capacity=count
+                )
+            return limiter
+
+    def request(self, method: str, path: str, raise_for_status: bool = True, **kwargs) -> requests.Response:
+        url = f"{self.base_url}{path}"
+        endpoint = self.endpoint(method, path)
+        limiter = self.limiter(endpoint)
+        for attempt in range(self.max_retries + 1):
+            limiter.acquire()
+            self.stats["requests"] += 1
+            with metrics.upstream_call("t212", endpoint) as call:
+                resp = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                call["status"] = str(resp.status_code)
+            if resp.status_code != 429 or attempt == self.max_retries:
+                break
+            # Too Many Requests: hold back every caller, jittered so retries don't line up
+            self.stats["retries"] += 1
+            delay = ratelimit.retry_after_from_headers(resp.headers, default=self.backoff * 2 ** attempt)
+            delay += random.uniform(0, self.backoff * 2 ** attempt)
+            logger.info(f"Rate limit hit on {method} {path}, retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+            limiter.penalize(delay)
+        if raise_for_status:
+            resp.raise_for_status()
+        return resp
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def portfolio(self) -> list:
+        return self.get("/portfolio").json()
+
+    def position(self, ticker: str) -> dict:
+        return self.get(f"/portfolio/{ticker}").json()
+
+    def orders(self) -> list:
+        return self.get("/orders").json()
+
+    def cash(self) -> dict:
+        return self.get("/account/cash").json()
+
+    def instruments(self, etag: Optional[str] = None) -> requests.Response:
+        return self.get("/metadata/instruments", headers={"If-None-Match": etag} if etag else None)
+
+    def market_order(self, ticker: str, quantity: float) -> dict:
+        """Place a market order (negative quantity sells), the API's error body is returned as is"""
+        return self.post("/orders/market", json={"quantity": quantity, "ticker": ticker}, raise_for_status=False).json()
+
+
+class AsyncT212Client:
+    """
+    asyncio front-end of T212Client.
+
+    Calls run in the default executor on the same pooled session and rate
+    limiter, so async and threaded callers share connections and limits.
+    """
+
+    def __init__(self, client: T212Client):
+        self.client = client
+
+    async def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        return await asyncio.to_thread(self.client.request, method, path, **kwargs)
+
+    async def portfolio(self) -> list:
+        return await asyncio.to_thread(self.client.portfolio)
+
+    async def position(self, ticker: str) -> dict:
+        return await asyncio.to_thread(self.client.position, ticker)
+
+    async def orders(self) -> list:
+        return await asyncio.to_thread(self.client.orders)
+
+    async def cash(self) -> dict:
+        return await asyncio.to_thread(self.client.cash)
+
+    async def market_order(self, ticker: str, quantity: float) -> dict:
+        return await asyncio.to_thread(self.client.market_order, ticker, quantity)
@@ -0,0 +1,65 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import bars
+
+
+def utc(*args) -> float:
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+def test_todays_bar_is_topped_up_during_trading_hours(monkeypatch):
+    monkeypatch.setattr(bars, "BARS_LIVE_TTL", 300)
+    monkeypatch.setattr(bars, "BARS_LIVE_HOURS", "7-21")
+    # Wednesday
+    assert bars.is_fresh("1d", utc(2026, 10, 14, 14, 0), utc(2026, 10, 14, 14, 4))
+    assert not bars.is_fresh("1d", utc(2026, 10, 14, 14, 0), utc(2026, 10, 14, 14, 6))
+    # Once more after the close for the closing values, then not until the next session
+    assert not bars.is_fresh("1d", utc(2026, 10, 14, 20, 58), utc(2026, 10, 14, 21, 30))
+    assert bars.is_fresh("1d", utc(2026, 10, 14, 21, 5), utc(2026, 10, 14, 22, 30))
+    # Saturday
+    assert bars.is_fresh("1d", utc(2026, 10, 17, 10, 0), utc(2026, 10, 17, 12, 0))
+
+
+def test_live_ttl_zero_fetches_once_per_day(monkeypatch):
+    monkeypatch.setattr(bars, "BARS_LIVE_TTL", 0)
+    assert bars.is_fresh("1d", utc(2026, 10, 14, 8, 0), utc(2026, 10, 14, 20, 0))
+
+
+def test_short_history_is_covered_by_a_full_download(tmp_path, monkeypatch):
+    # A listing with 40 bars never spans the 3mo window, downloading it in full once is enough
+    index = pd.date_range("2026-08-24", periods=40, freq="B", tz="America/New_York", name="Date")
+    history = pd.DataFrame({column: 1.0 for column in bars.COLUMNS}, index=index)
+    calls = []
+
+    def download(self, symbol, interval, period):
+        calls.append(("full", symbol))
+        return history
+
+    def download_since(self, symbol, interval, start):
+        calls.append(("since", symbol))
+        return history[history.index >= start]
+
+    def download_batch(self, symbols, interval, **kwargs):
+        calls.append(("batch", tuple(symbols), "period" in kwargs))
+        return {symbol: history[history.index >= kwargs["start"]] for symbol in symbols}
+
+    monkeypatch.setattr(bars.BarStore, "_download", download)
+    monkeypatch.setattr(bars.BarStore, "_download_since", download_since)
+    monkeypatch.setattr(bars.BarStore, "_download_batch", download_batch)
+    monkeypatch.setattr(bars, "is_fresh", lambda interval, fetched_at, now=None: False)
+
+    path = str(tmp_path / "bars.db")
+    store = bars.BarStore(path)
+    assert len(store.get("NEW")) == 40
+    assert len(store.get("NEW")) == 40
+    # After a restart the stored bars still count as the full download
+    restarted = bars.BarStore(path)
+    assert restarted.prefetch(["NEW"]) == 1
+    assert len(restarted.get("NEW")) == 40
+
+    assert calls == [("full", "NEW"), ("since", "NEW"), ("batch", ("NEW",), False), ("since", "NEW")]
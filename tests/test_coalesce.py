@@ -0,0 +1,49 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from coalesce import Coalescer
+
+
+def test_concurrent_callers_share_one_fetch():
+    coalescer = Coalescer(ttl=60)
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {"portfolio": []}
+
+    with ThreadPoolExecutor(8) as executor:
+        futures = [executor.submit(coalescer.get, "/portfolio", fetch) for _ in range(8)]
+        while coalescer.stats["fetches"] + coalescer.stats["coalesced"] < 8:
+            time.sleep(0.001)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert coalescer.get("/portfolio", fetch) is results[0]
+    assert coalescer.stats == {"hits": 1, "coalesced": 7, "fetches": 1}
+
+
+def test_errors_are_not_cached_and_invalidate_refetches():
+    coalescer = Coalescer(ttl=60)
+
+    def fail():
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        coalescer.get("/orders", fail)
+    assert coalescer.get("/orders", lambda: [1]) == [1]
+    assert coalescer.get("/orders", lambda: [2]) == [1]
+    # max_age=0 asks for a fresh copy, as does an invalidation
+    assert coalescer.get("/orders", lambda: [3], max_age=0) == [3]
+    coalescer.invalidate("/orders")
+    assert coalescer.get("/orders", lambda: [4]) == [4]
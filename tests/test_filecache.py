@@ -0,0 +1,29 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from filecache import write_json
+
+
+def test_write_json_replaces_the_file_without_leftovers(tmp_path):
+    path = str(tmp_path / "cache.json")
+    write_json(path, {"version": 1})
+    write_json(path, {"version": 2})
+
+    with open(path) as f:
+        assert json.load(f) == {"version": 2}
+    assert os.listdir(tmp_path) == ["cache.json"]
+
+
+def test_write_json_keeps_the_old_copy_when_serializing_fails(tmp_path):
+    path = str(tmp_path / "cache.json")
+    write_json(path, {"version": 1})
+    with pytest.raises(TypeError):
+        write_json(path, {"version": object()})
+
+    with open(path) as f:
+        assert json.load(f) == {"version": 1}
+    assert os.listdir(tmp_path) == ["cache.json"]
@@ -0,0 +1,52 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from history import HistoryStore
+
+
+def utc(*args) -> float:
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+def result(price, total_risk=1.5):
+    return {
+        "total_risk": total_risk,
+        "positions": [
+            {"ticker": "AAA_US_EQ", "quantity": 3, "current_price": price, "max_price": 12.0,
+             "stop_loss_price": 10.5, "profit_pct": 5.0, "macd_signal": "BULLISH", "macd_crossover": None},
+            {"ticker": "BBB_US_EQ", "quantity": 1, "current_price": 20.0, "max_price": 20.0,
+             "stop_loss_price": 18.0, "profit_pct": -1.0, "macd_signal": "BEARISH", "macd_crossover": "BEARISH"},
+        ],
+    }
+
+
+def test_position_rows_are_only_written_on_change(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append(result(11.0), 1000.0, ts=utc(2026, 10, 14, 14, 0))
+    store.append(result(11.0), 1000.0, ts=utc(2026, 10, 14, 14, 1))
+    store.append(result(11.5), 1010.0, ts=utc(2026, 10, 14, 14, 2))
+
+    assert [row["total_capital"] for row in store.equity_curve(utc(2026, 10, 14), utc(2026, 10, 15))] == [1000.0, 1000.0, 1010.0]
+    aaa = store.position_history("AAA_US_EQ", utc(2026, 10, 14), utc(2026, 10, 15))
+    assert [(row["ts"], row["current_price"]) for row in aaa] == [(utc(2026, 10, 14, 14, 0), 11.0), (utc(2026, 10, 14, 14, 2), 11.5)]
+    bbb = store.position_history("BBB_US_EQ", utc(2026, 10, 14), utc(2026, 10, 15))
+    assert len(bbb) == 1 and bbb[0]["macd_crossover"] == "BEARISH"
+    assert store.position_history("CCC_US_EQ", utc(2026, 10, 14), utc(2026, 10, 15)) == []
+
+
+def test_closed_days_are_compressed_and_still_read(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append(result(11.0), 1000.0, ts=utc(2026, 10, 14, 14, 0))
+    store.append(result(11.0), 1020.0, ts=utc(2026, 10, 15, 14, 0))
+
+    assert sorted(name for name in os.listdir(tmp_path) if "2026-10-14" in name) == [
+        "positions-2026-10-14.bin.gz", "snapshots-2026-10-14.bin.gz",
+    ]
+    # A new day starts with a full set of position rows
+    restarted = HistoryStore(str(tmp_path))
+    aaa = restarted.position_history("AAA_US_EQ", utc(2026, 10, 14), utc(2026, 10, 16))
+    assert [row["ts"] for row in aaa] == [utc(2026, 10, 14, 14, 0), utc(2026, 10, 15, 14, 0)]
+    curve = restarted.equity_curve(utc(2026, 10, 14), utc(2026, 10, 16), step=86400)
+    assert [row["total_capital"] for row in curve] == [1000.0, 1020.0]
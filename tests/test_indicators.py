@@ -0,0 +1,69 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import bars
+import indicators
+from papishares import calculate_macd
+
+
+def random_walk(days, seed=0, tz="America/New_York"):
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range("2025-01-02", periods=days, tz=tz)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, days)))
+    return pd.DataFrame({"Close": closes}, index=index)
+
+
+def assert_matches(state, row):
+    assert state.macd == row["MACD"]
+    assert state.signal_line == row["Signal"]
+    assert state.histogram == row["Histogram"]
+
+
+@pytest.fixture
+def engine():
+    return indicators.IndicatorEngine()
+
+
+def test_engine_matches_calculate_macd_over_the_moving_window(engine):
+    history = random_walk(230)
+    for end in range(30, len(history) + 1):
+        # What the bar store serves on that day: the 3mo window ending at the latest bar
+        window = bars.BarStore._window(history.iloc[:end], bars.DEFAULT_PERIOD)
+        previous, latest = engine.update("SYM", window)
+        expected = calculate_macd(window.copy())
+        assert_matches(latest, expected.iloc[-1])
+        assert_matches(previous, expected.iloc[-2])
+        assert latest.sma(17) == sum(window["Close"].tolist()[-17:]) / 17
+
+
+def test_partial_bar_updates_match(engine):
+    window = bars.BarStore._window(random_walk(120, seed=1), bars.DEFAULT_PERIOD)
+    engine.update("SYM", window)
+    for close in (95.0, 101.5, 99.25):
+        # Intraday top-ups only change the last, not yet completed, bar
+        live = window.copy()
+        live.iloc[-1, 0] = close
+        previous, latest = engine.update("SYM", live)
+        expected = calculate_macd(live.copy())
+        assert_matches(latest, expected.iloc[-1])
+        assert_matches(previous, expected.iloc[-2])
+
+
+def test_macd_frame_matches_calculate_macd_per_symbol():
+    windows = {
+        "US": bars.BarStore._window(random_walk(100, seed=3), bars.DEFAULT_PERIOD),
+        "UK.L": bars.BarStore._window(random_walk(90, seed=4, tz="Europe/London"), bars.DEFAULT_PERIOD),
+    }
+    closes = pd.concat({symbol: df["Close"] for symbol, df in windows.items()}, axis=1, sort=True)
+    frame = indicators.macd_frame(closes)
+    for symbol, df in windows.items():
+        expected = calculate_macd(df.copy())
+        last = closes[symbol].last_valid_index()
+        assert frame["MACD"].at[last, symbol] == expected["MACD"].iloc[-1]
+        assert frame["Signal"].at[last, symbol] == expected["Signal"].iloc[-1]
+        assert frame["Histogram"].at[last, symbol] == expected["Histogram"].iloc[-1]
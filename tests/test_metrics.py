@@ -0,0 +1,39 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import metrics
+
+
+def make_registry(requests, seconds, rows):
+    registry = metrics.Registry()
+    counter = registry.counter("requests_total", "Requests", ("route",))
+    counter.inc(requests, route="/positions")
+    registry.histogram("call_seconds", "Calls", buckets=(1.0,)).observe(seconds)
+    registry.gauge("rows", "Rows", (), lambda: {(): rows})
+    return registry
+
+
+def test_worker_metrics_are_summed_over_workers(tmp_path):
+    directory = str(tmp_path / "metrics")
+    this = metrics.WorkerMetrics(make_registry(2, 0.5, 10), directory)
+    # A worker that exited: its counters and histograms still count, its gauges don't
+    exited = make_registry(3, 2.0, 99)
+    with open(os.path.join(directory, "999999999-1.json"), "w") as f:
+        json.dump(exited.snapshot(), f)
+
+    lines = this.render().splitlines()
+
+    assert 'requests_total{route="/positions"} 5.0' in lines
+    assert 'call_seconds_bucket{le="1.0"} 1' in lines
+    assert 'call_seconds_bucket{le="+Inf"} 2' in lines
+    assert "call_seconds_sum 2.5" in lines
+    assert [line for line in lines if line.startswith("rows")] == [f'rows{{worker="{os.getpid()}"}} 10.0']
+
+
+def test_single_process_render_is_unchanged():
+    registry = make_registry(2, 0.5, 10)
+    lines = registry.render().splitlines()
+    assert 'requests_total{route="/positions"} 2.0' in lines
+    assert "rows 10.0" in lines
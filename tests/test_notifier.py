@@ -0,0 +1,52 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from notifier import NotificationQueue
+
+
+class Store:
+    def __init__(self, notified):
+        self.notified = dict(notified)
+
+    def load_notifications(self):
+        return dict(self.notified)
+
+    def record_notifications(self, notifications):
+        self.notified.update(notifications)
+
+
+def test_crossovers_are_deduplicated_and_batched():
+    sent = []
+    notifications = NotificationQueue(lambda text: sent.append(text) or True, batch_window=0.2)
+    store = Store({"BBB": "BEARISH"})
+    notifications.use_store(store)
+
+    assert notifications.notify_crossover("AAA", "BULLISH", "AAA bullish")
+    # Still queued: the same crossover isn't queued twice
+    assert not notifications.notify_crossover("AAA", "BULLISH", "AAA bullish")
+    # Already notified before a restart
+    assert not notifications.notify_crossover("BBB", "BEARISH", "BBB bearish")
+    notifications.put("Risk over the limit")
+    assert notifications.drain(5)
+
+    assert sent == ["AAA bullish\n\nRisk over the limit"]
+    assert store.notified == {"AAA": "BULLISH", "BBB": "BEARISH"}
+    assert notifications.stats["deduplicated"] == 2
+    # Delivered: the next crossover of that symbol is a new one
+    assert not notifications.notify_crossover("AAA", "BULLISH", "AAA bullish")
+    assert notifications.notify_crossover("AAA", "BEARISH", "AAA bearish")
+    assert notifications.drain(5)
+    assert sent[-1] == "AAA bearish"
+
+
+def test_dropped_crossover_can_be_queued_again(monkeypatch):
+    monkeypatch.setattr("notifier.time.sleep", lambda seconds: None)
+    notifications = NotificationQueue(lambda text: False, batch_window=0, max_attempts=2)
+
+    assert notifications.notify_crossover("AAA", "BULLISH", "AAA bullish")
+    assert notifications.drain(5)
+
+    assert notifications.stats["dropped"] == 1
+    assert notifications.notify_crossover("AAA", "BULLISH", "AAA bullish")
+    assert notifications.drain(5)
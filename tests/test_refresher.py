@@ -0,0 +1,80 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from refresher import Refresher
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), "..", "templates", "positions.html")
+
+OLD = {
+    "total_risk": 2.0,
+    "positions": [
+        {"ticker": "A", "current_price": 10.0, "max_price": 11.0},
+        {"ticker": "B", "current_price": 20.0, "max_price": 21.0},
+        {"ticker": "C", "current_price": 30.0, "max_price": 31.0},
+    ],
+}
+NEW = {
+    "total_risk": 2.5,
+    "positions": [
+        {"ticker": "C", "current_price": 30.0, "max_price": 31.0},
+        {"ticker": "A", "current_price": 12.0, "max_price": 12.0},
+        {"ticker": "D", "current_price": 40.0, "max_price": 40.0},
+    ],
+}
+
+
+def positions_refresher():
+    results = [OLD, NEW]
+    refresher = Refresher("test", lambda: results.pop(0), list_keys={"positions": "ticker"})
+    return refresher, refresher.refresh(), refresher.refresh()
+
+
+def test_version_only_changes_with_the_data():
+    results = [{"a": 1}, {"a": 1}, {"a": 2}]
+    refresher = Refresher("test", lambda: results.pop(0))
+
+    first = refresher.refresh()
+    unchanged = refresher.refresh()
+    changed = refresher.refresh()
+
+    assert refresher.etag(unchanged) == refresher.etag(first)
+    assert unchanged.created_at >= first.created_at
+    assert unchanged.body == b'{"a": 1}'
+    assert changed.version == first.version + 1
+    assert refresher.delta_body(first.version) is not None
+    assert refresher.wait_for_update(first.version, 0) is changed
+
+
+def test_since_delta_only_carries_the_changes():
+    refresher, first, second = positions_refresher()
+
+    body = json.loads(refresher.delta_body(first.version))
+
+    assert body["since"] == first.version and body["version"] == second.version
+    assert body["changed"] == {
+        "total_risk": 2.5,
+        "positions": {"A": {"current_price": 12.0, "max_price": 12.0}, "D": NEW["positions"][2]},
+    }
+    assert body["removed"] == {"positions": ["B"]}
+    assert body["order"] == {"positions": ["C", "A", "D"]}
+    # Versions that are no longer kept get the full body instead
+    assert refresher.delta_body(first.version - 1) is None
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_dashboard_delta_merge_gives_the_new_snapshot():
+    refresher, first, second = positions_refresher()
+    with open(TEMPLATE) as f:
+        apply_delta = re.search(r"^    function applyDelta\(.*?^    }$", f.read(), re.S | re.M).group(0)
+    script = f"{apply_delta}\nconsole.log(JSON.stringify(applyDelta({first.body.decode()}, {refresher.delta_body(first.version).decode()})));"
+
+    merged = subprocess.run(["node", "-e", script], capture_output=True, text=True, check=True).stdout
+
+    assert json.loads(merged) == second.data
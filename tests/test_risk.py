@@ -0,0 +1,64 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from portfolio import Portfolio
+from risk import RiskEngine
+
+
+class Bars:
+    def __init__(self, frames):
+        self.frames = frames
+
+    def get(self, symbol, interval, period):
+        return self.frames.get(symbol)
+
+
+class Sectors:
+    def __init__(self, sectors):
+        self.sectors = sectors
+
+    def get_many(self, symbols):
+        return [self.sectors.get(symbol, "Unknown") for symbol in symbols]
+
+
+def closes(returns, scale=100.0, tz="America/New_York"):
+    index = pd.bdate_range("2026-07-01", periods=len(returns) + 1, tz=tz)
+    return pd.DataFrame({"Close": scale * np.cumprod(np.concatenate([[1.0], 1 + returns]))}, index=index)
+
+
+def test_correlation_offsets_opposite_positions():
+    returns = np.random.default_rng(0).normal(0, 0.02, 40)
+    engine = RiskEngine(
+        Bars({
+            "AAA": closes(returns),
+            # Same moves as AAA on the London calendar
+            "BBB.L": closes(returns, 2000.0, tz="Europe/London"),
+            "CCC": closes(-returns),
+        }),
+        Sectors({"AAA": "Technology", "BBB.L": "Technology", "CCC": "Energy"}),
+    )
+    symbols = ["AAA", "BBB.L", "CCC", "NEW"]
+    portfolio = Portfolio(
+        tickers=["AAA_US_EQ", "BBBl_EQ", "CCC_US_EQ", "NEW_US_EQ"], currencies=["USD", "GBX", "USD", "USD"],
+        quantity=[10, 10, 10, 10], average_price=[100.0, 2000.0, 100.0, 10.0],
+        raw_average_price=[100.0, 2000.0, 100.0, 10.0], current_price=[100.0, 2000.0, 100.0, 10.0],
+        max_price=[100.0, 2000.0, 100.0, 10.0], manual_stop=[None] * 4, total_capital=10000.0,
+    )
+
+    report = engine.breakdown(portfolio, symbols, [100.0, 100.0, 100.0, 0.0], limit=2.0)
+
+    assert report["total_risk"] == 3.0 and report["over_limit"]
+    # AAA and BBB.L move together and CCC against them: 100 + 100 - 100 at risk
+    assert report["correlated_risk"] == 1.0
+    assert [(group["sector"], group["positions"]) for group in report["sectors"]] == [
+        ("Technology", 2), ("Energy", 1), ("Unknown", 1),
+    ]
+    assert [(group["currency"], group["risk_pct"]) for group in report["currencies"]] == [("USD", 2.0), ("GBX", 1.0)]
+
+    # The covariance is only recomputed with a new daily bar
+    engine.breakdown(portfolio, symbols, [100.0, 100.0, 100.0, 0.0], limit=2.0)
+    assert engine.stats == {"covariance_hits": 1, "covariance_updates": 1}
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from papishares import initialize_database
+from shared import SqliteLease, SqliteSharedFile
+
+
+def lease(db, holder, ttl=0.3):
+    contender = SqliteLease(db, "positions", ttl=ttl)
+    contender.holder = holder
+    return contender
+
+
+def test_lease_is_taken_over_once_it_expires(tmp_path):
+    db = str(tmp_path / "papishares.db")
+    initialize_database(db)
+    # Taken without the renewal thread, as by a leader that hangs right after
+    hung, follower = lease(db, "pod-a:1"), lease(db, "pod-b:1")
+    assert hung._renew()
+    assert not follower.acquire(blocking=False)
+
+    time.sleep(0.4)
+    assert follower.acquire(blocking=False)
+    assert not hung._renew() and not hung.held
+    # Releasing a lost lease doesn't drop the new holder's
+    hung.release()
+    assert not lease(db, "pod-c:1").acquire(blocking=False)
+
+    # Renewed in the background past its ttl
+    time.sleep(0.5)
+    assert follower.held and not lease(db, "pod-c:1").acquire(blocking=False)
+
+    # A graceful release hands it over right away
+    follower.release()
+    assert lease(db, "pod-c:1").acquire(blocking=False)
+
+
+def test_shared_file_only_decodes_new_generations(tmp_path):
+    db = str(tmp_path / "papishares.db")
+    initialize_database(db)
+    writer, reader = SqliteSharedFile(db, "positions.snapshot"), SqliteSharedFile(db, "positions.snapshot")
+    decoded = []
+
+    def decode(body):
+        decoded.append(body)
+        return body.decode()
+
+    assert reader.load(decode) is None
+    writer.write(b"v1")
+    assert reader.load(decode) == "v1"
+    assert reader.load(decode) == "v1"
+    writer.write(b"v2")
+    assert reader.load(decode) == "v2"
+    assert decoded == [b"v1", b"v2"]
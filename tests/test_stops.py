@@ -0,0 +1,41 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from stops import ProfitTieredStop, RiskBudgetTrailingStop, backtest, parse_policy, round_to
+
+
+def test_round_to_matches_builtin_round_at_ties():
+    values = [34.225, 1.005, -2.675, 0.125, 2.5]
+    assert round_to(values, 2).tolist() == [round(value, 2) for value in values]
+    assert round_to(np.array([[0.5, 1.5], [2.5, -0.5]]), 0).tolist() == [[0.0, 2.0], [2.0, -0.0]]
+
+
+def test_backtest_exits_at_the_trailed_stop():
+    close = pd.DataFrame(
+        {"AAA": [100.0, 110.0, 120.0, 105.0, 100.0], "BBB": [np.nan, 50.0, 52.0, 53.0, 54.0]},
+        index=pd.bdate_range("2026-10-05", periods=5),
+    )
+    result = backtest(RiskBudgetTrailingStop(fraction=0.1), close)
+
+    # The stop trails 10 below the 120 high, 105 goes through it and exits at 110
+    aaa = result.loc["AAA"]
+    assert (aaa["stopped"], aaa["bars_held"], aaa["exit_price"], aaa["max_price"]) == (True, 3, 110.0, 120.0)
+    assert aaa["exit"] == close.index[3]
+    assert round(aaa["return_pct"], 6) == 10.0
+    # Listed a bar later and never stopped: marked to the last close
+    bbb = result.loc["BBB"]
+    assert (bbb["stopped"], bbb["entry"], bbb["exit_price"]) == (False, close.index[1], 54.0)
+    assert round(bbb["return_pct"], 6) == 8.0
+
+
+def test_parse_policy():
+    risk = parse_policy("risk:0.7:10")
+    assert isinstance(risk, RiskBudgetTrailingStop) and round(risk.fraction, 6) == 0.07
+    tiered = parse_policy("tiered:4:10")
+    assert isinstance(tiered, ProfitTieredStop) and (tiered.base_pct, tiered.step) == (4, 10)
+    # 25% up: two points looser than the 4% base
+    assert tiered.target(125.0, 100.0, 125.0) == 117.5
@@ -0,0 +1,24 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import ratelimit
+from t212 import T212Client
+
+
+def test_each_endpoint_has_its_own_documented_limit(monkeypatch):
+    monkeypatch.setattr(ratelimit, "shared_path", lambda name: None)
+    client = T212Client("http://t212.invalid", "key", "secret", rate_scale=1)
+
+    assert client.endpoint("GET", "/portfolio/AAPL_US_EQ") == "GET /portfolio/{ticker}"
+    assert client.endpoint("DELETE", "/orders/123") == "DELETE /orders/{id}"
+    assert client.endpoint("POST", "/orders/market") == "POST /orders/market"
+
+    portfolio = client.limiter("GET /portfolio")
+    assert client.limiter("GET /portfolio") is portfolio
+    assert (portfolio.rate, portfolio.capacity) == (0.2, 1)
+    market = client.limiter("POST /orders/market")
+    assert (market.rate, market.capacity) == (50 / 60, 50)
+    # A 429 on one endpoint doesn't hold back the others
+    portfolio.penalize(30)
+    assert client.limiter("GET /account/cash").acquire() < 0.1
@@ -0,0 +1,70 @@
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import watcher
+from papishares import initialize_database
+from repository import Repository
+from watcher import StopLossWatcher, StopThreshold
+
+
+class Wednesday(date):
+    @classmethod
+    def today(cls):
+        return cls(2026, 10, 14)
+
+
+def make_watcher(monkeypatch):
+    monkeypatch.setattr(watcher, "date", Wednesday)
+    sells, highs, messages = [], [], []
+    stop_watcher = StopLossWatcher(
+        fetch_positions=lambda: [],
+        sell=lambda ticker, quantity: sells.append((ticker, quantity)) or {},
+        notify=messages.append,
+        cooldown=60,
+    )
+    stop_watcher.record_high = lambda ticker, high: highs.append((ticker, high))
+    stop_watcher.auto_sell = True
+    stop_watcher.update_thresholds([StopThreshold("AAA_US_EQ", "AAA", "Aaa", 3, 100.0, 100.0, 110.0, 5.0)])
+    return stop_watcher, sells, highs, messages
+
+
+def test_stop_trails_new_highs_and_sells_once_per_cooldown(monkeypatch):
+    stop_watcher, sells, highs, messages = make_watcher(monkeypatch)
+    price = lambda value: [{"ticker": "AAA_US_EQ", "currentPrice": value}]
+
+    # 5 below the 110 max price: 105, not reached
+    assert stop_watcher.check(price(108.0), now=1000) == []
+    # A new high trails the stop up to 115 and is recorded
+    assert stop_watcher.check(price(120.0), now=1001) == []
+    assert highs == [("AAA_US_EQ", 120.0)]
+    # 114 is above the refresh's stop but below the trailed one
+    assert stop_watcher.check(price(114.0), now=1002) == ["AAA_US_EQ"]
+    assert sells == [("AAA_US_EQ", 3)]
+    assert "Max price: 120.0" in messages[0]
+
+    assert stop_watcher.check(price(113.0), now=1030) == []
+    assert stop_watcher.check(price(113.0), now=1063) == ["AAA_US_EQ"]
+    assert len(sells) == 2
+
+
+def test_no_sell_without_auto_sell(monkeypatch):
+    stop_watcher, sells, _, _ = make_watcher(monkeypatch)
+    stop_watcher.auto_sell = False
+    assert stop_watcher.check([{"ticker": "AAA_US_EQ", "currentPrice": 90.0}], now=1000) == []
+    assert sells == []
+
+
+def test_refresh_keeps_a_higher_high_recorded_by_the_watcher(tmp_path):
+    db = str(tmp_path / "papishares.db")
+    initialize_database(db)
+    repository = Repository(db)
+    state = repository.load_state()
+    assert state.raise_max_price("AAA_US_EQ", 110.0) == 110.0
+
+    # The watcher sees 120 while the refresh still works with its older price
+    assert repository.positions.raise_max_price("AAA_US_EQ", 120.0)
+    assert state.raise_max_price("AAA_US_EQ", 115.0) == 120.0
+    assert not repository.positions.raise_max_price("UNKNOWN", 1.0)
+    assert Repository(db).positions.get_max_price("AAA_US_EQ") == 120.0
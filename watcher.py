@@ -0,0 +1,156 @@
+from datetime import date
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+import logging
+import os
+import threading
+import time
+from stops import RiskBudgetTrailingStop
+
+logger = logging.getLogger(__name__)
+
+STOP_WATCH_INTERVAL = float(os.getenv("STOP_WATCH_INTERVAL", "5")) # Seconds between stop-loss price polls
+STOP_SELL_COOLDOWN = float(os.getenv("STOP_SELL_COOLDOWN", "60")) # Seconds before a sell of the same ticker is attempted again
+
+
+class StopThreshold(NamedTuple):
+    """Trailing stop of one position as computed by the last refresh"""
+    ticker: str
+    short_name: str
+    name: str
+    quantity: float
+    average_price: float
+    raw_average_price: float
+    max_price: float
+    risk_per_share: float
+
+    def stop_price(self, high: float) -> float:
+        """Stop level once the price has reached `high`, same policy as Portfolio.compute()"""
+        return float(RiskBudgetTrailingStop(self.risk_per_share).target(high, self.average_price, max(self.max_price, high)))
+
+
+class StopLossWatcher:
+    """
+    Sells positions whose trailing stop has been reached.
+
+    Runs in its own thread, independent of the dashboard refresh: every
+    `interval` seconds it polls the bulk /portfolio prices and checks them
+    against the thresholds published by the last refresh, trailing the stop
+    up with any new high it sees in between (and handing it to `record_high`,
+    so the refreshes keep it). A ticker is sold at most once per `cooldown`
+    seconds.
+
+    Parameters:
+    -----------
+    fetch_positions : callable
+        Returns the /portfolio entries (ticker, quantity, currentPrice)
+    sell : callable
+        sell(ticker, quantity) -> API response dict
+    notify : callable
+        Sends a message for each executed sell
+    """
+
+    def __init__(self, fetch_positions: Callable[[], List[dict]], sell: Callable[[str, float], dict],
+                 notify: Callable[[str], None], interval: float = STOP_WATCH_INTERVAL, cooldown: float = STOP_SELL_COOLDOWN):
+        self.fetch_positions = fetch_positions
+        self.sell = sell
+        self.notify = notify
+        self.interval = interval
+        self.cooldown = cooldown
+        self.auto_sell = False
+        # Optional fresh read of the flag before selling, when it can be toggled by another process
+        self.read_auto_sell: Optional[Callable[[], bool]] = None
+        # Optional record_high(ticker, high) for highs above the refresh's max price
+        self.record_high: Optional[Callable[[str, float], None]] = None
+        self._thresholds: Dict[str, StopThreshold] = {}
+        self._highs: Dict[str, float] = {}
+        self._attempted: Dict[str, float] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"polls": 0, "sells": 0, "errors": 0, "last_poll_ms": 0.0}
+
+    def start(self):
+        if self._thread is not None and not self._stop.is_set():
+            return
+        # A fresh event per thread, so a stopped thread still winding down can't be revived
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name="stop-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def update_thresholds(self, thresholds: Iterable[StopThreshold]):
+        """Replace the thresholds with those of a new refresh"""
+        thresholds = {threshold.ticker: threshold for threshold in thresholds}
+        # Highs seen since are kept, they may be above the max price the refresh saw
+        self._highs = {ticker: high for ticker, high in self._highs.items() if ticker in thresholds}
+        self._thresholds = thresholds
+
+    def check(self, positions: List[dict], now: Optional[float] = None) -> List[str]:
+        """Evaluate every stop against the given /portfolio entries and sell the triggered ones"""
+        now = time.time() if now is None else now
+        triggered = []
+        thresholds = self._thresholds
+        for pos in positions:
+            threshold = thresholds.get(pos["ticker"])
+            price = pos.get("currentPrice")
+            if threshold is None or price is None or price <= 0:
+                continue
+            previous = max(self._highs.get(threshold.ticker, threshold.max_price), threshold.max_price)
+            high = self._highs[threshold.ticker] = max(self._highs.get(threshold.ticker, price), price)
+            if high > previous and self.record_high is not None:
+                try:
+                    self.record_high(threshold.ticker, high)
+                except Exception as e:
+                    logger.info(f"Could not record the new high of {threshold.ticker}: {e}")
+            stop_loss_price = threshold.stop_price(high)
+            if stop_loss_price >= price:
+                triggered.append((threshold, price, high, stop_loss_price))
+
+        if triggered and self.read_auto_sell is not None:
+            self.auto_sell = self.read_auto_sell()
+
+        # Only weekdays, as before
+        if not self.auto_sell or date.today().weekday() >= 5:
+            return []
+
+        sold = []
+        for threshold, price, high, stop_loss_price in triggered:
+            if now - self._attempted.get(threshold.ticker, 0) < self.cooldown:
+                continue
+            self._attempted[threshold.ticker] = now
+            self._fire(threshold, price, high, stop_loss_price)
+            sold.append(threshold.ticker)
+        return sold
+
+    def _fire(self, threshold: StopThreshold, price: float, high: float, stop_loss_price: float):
+        # It will only sell if there are no stop losses already set, otherwise the
+        # error code will be 'SellingEquityNotOwned'
+        rc = self.sell(threshold.ticker, threshold.quantity)
+
+        if "type" in rc and rc["type"] == "/api-errors/selling-equity-not-owned":
+            logger.info(f"Could not sell {threshold.ticker}, probably because there is a stop loss in place")
+            return
+
+        self.stats["sells"] += 1
+        profit_pct = round((price - threshold.raw_average_price) / threshold.raw_average_price * 100, 2)
+        message =  f"Stop loss activated for {threshold.short_name} - {threshold.name}.\n"
+        message += f"Purchased price: {threshold.average_price}\n"
+        message += f"Current price: {price}\n"
+        message += f"Max price: {max(threshold.max_price, high)}\n"
+        message += f"Stop loss price: {stop_loss_price}\n"
+        message += f"P/L: {profit_pct}%\n"
+        self.notify(message)
+
+    def _run(self, stop: threading.Event):
+        while not stop.is_set():
+            started = time.monotonic()
+            if self._thresholds:
+                try:
+                    self.check(self.fetch_positions())
+                    self.stats["polls"] += 1
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.info(f"Stop-loss check failed: {e}")
+                self.stats["last_poll_ms"] = (time.monotonic() - started) * 1000
+            stop.wait(max(0.0, self.interval - (time.monotonic() - started)))